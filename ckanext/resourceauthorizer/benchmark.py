@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import datetime
+import random
+import time
+import uuid
+
+from sqlalchemy import event
+
+import ckan.model as model
+from ckan.logic import get_action
+from ckan.lib.plugins import DefaultPermissionLabels
+from ckan.lib.search.common import make_connection
+from ckan.lib.search.query import solr_literal
+
+from ckanext.resourceauthorizer import labels as resourceauthorizer_labels
+from ckanext.resourceauthorizer.cache import set_cache
+from ckanext.resourceauthorizer.logic import auth
+from ckanext.resourceauthorizer.model import insert_acls
+from ckanext.resourceauthorizer.model import history_partitioned
+from ckanext.resourceauthorizer.model import create_history_partitions
+from ckanext.resourceauthorizer.principal import get_principal
+
+
+def percentiles(timings, points=(50, 90, 99)):
+    '''Return the given percentiles of the timings, in milliseconds.'''
+    timings = sorted(timings)
+    if not timings:
+        return {}
+    result = {}
+    for point in points:
+        index = min(len(timings) - 1, int(round(point / 100.0 *
+                                                (len(timings) - 1))))
+        result['p%d' % point] = round(timings[index] * 1000, 3)
+    return result
+
+
+def label_filter_query(labels):
+    '''Build the permission_labels filter query as package_search does.'''
+    return u'+permission_labels:(%s)' % u' OR '.join(
+        solr_literal(label) for label in labels)
+
+
+def benchmark_label_modes(user_names, repeat=10):
+    '''Compare the filter query length and the solr latency of the labeling
+    modes for each user.
+
+    Solr is queried with rows=0, so the timings measure the cost of
+    evaluating the filter query, whichever mode the index was built with.
+    '''
+    connection = make_connection()
+    default_labels = DefaultPermissionLabels()
+    results = []
+    for name in user_names:
+        userobj = model.User.get(name)
+        principal = get_principal({}, name)
+        result = {'user': name}
+        for mode in resourceauthorizer_labels.LABEL_MODES:
+            start = time.time()
+            labels = default_labels.get_user_dataset_labels(userobj)
+            labels.extend(
+                resourceauthorizer_labels.user_labels(principal, mode))
+            labels_time = time.time() - start
+
+            fq = label_filter_query(labels)
+            timings = []
+            for _ in range(repeat):
+                start = time.time()
+                connection.search(q=u'*:*', fq=[fq], rows=0)
+                timings.append(time.time() - start)
+            result[mode] = {
+                'labels': len(labels),
+                'fq_length': len(fq),
+                'labels_ms': round(labels_time * 1000, 3),
+                'solr_ms': percentiles(timings),
+            }
+        results.append(result)
+    return results
+
+
+DEFAULT_SIZES = {
+    'datasets': 10,
+    'resources_per_dataset': 200,
+    'acls_per_resource': 20,
+    'orgs_per_user': 5,
+    'users_per_org': 50,
+}
+
+
+class QueryCounter(object):
+    '''Counts the SQL statements sent through the engine while active.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _before_cursor_execute(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+
+
+def seed(sizes, seed_value=0):
+    '''Create synthetic users, organizations, memberships, datasets,
+    resources and acls, and return the names and ids to benchmark with.
+
+    Everything is named after a random run id, so seeding can be repeated
+    on the same database. Nothing is removed, seed within rolled_back.
+    '''
+    rng = random.Random(seed_value)
+    run = uuid.uuid4().hex[:8]
+    model.repo.new_revision()
+
+    user_name = u'bench-%s-user' % run
+    user = model.User(name=user_name, email=u'%s@example.com' % user_name)
+    model.Session.add(user)
+
+    # the benchmarked user is a member of half the organizations
+    orgs = []
+    for i in range(sizes['orgs_per_user'] * 2):
+        org = model.Group(
+            name=u'bench-%s-org-%d' % (run, i), is_organization=True,
+            type='organization')
+        model.Session.add(org)
+        orgs.append(org)
+    model.Session.flush()
+
+    members = []
+    for i, org in enumerate(orgs):
+        if i % 2 == 0:
+            model.Session.add(
+                model.Member(table_name='user', table_id=user.id,
+                             group_id=org.id, capacity='member'))
+        for j in range(sizes['users_per_org']):
+            member = model.User(
+                name=u'bench-%s-org-%d-user-%d' % (run, i, j),
+                email=u'bench@example.com')
+            model.Session.add(member)
+            members.append(member)
+    model.Session.flush()
+    for i, member in enumerate(members):
+        org = orgs[i // max(sizes['users_per_org'], 1)]
+        model.Session.add(
+            model.Member(table_name='user', table_id=member.id,
+                         group_id=org.id, capacity='member'))
+
+    principals = [('user', user.id)] + [('org', o.id) for o in orgs] + [
+        ('user', m.id) for m in members
+    ]
+    package_ids = []
+    resource_ids = []
+    resources_by_package = {}
+    for i in range(sizes['datasets']):
+        package = model.Package(
+            name=u'bench-%s-dataset-%d' % (run, i),
+            owner_org=orgs[i % len(orgs)].id,
+            private=bool(i % 2))
+        model.Session.add(package)
+        model.Session.flush()
+        package_ids.append(package.id)
+        for j in range(sizes['resources_per_dataset']):
+            resource = model.Resource(
+                package_id=package.id, url=u'http://example.com/%d' % j,
+                name=u'resource %d' % j, position=j)
+            model.Session.add(resource)
+            model.Session.flush()
+            resource_ids.append(resource.id)
+            resources_by_package.setdefault(package.id,
+                                            []).append(resource.id)
+            count = min(sizes['acls_per_resource'], len(principals))
+            insert_acls([{
+                'resource_id': resource.id,
+                'auth_type': auth_type,
+                'auth_id': auth_id,
+                'permission': rng.choice(['none', 'read', 'read'])
+            } for auth_type, auth_id in rng.sample(principals, count)])
+    model.repo.commit_and_remove()
+    return {
+        'user': user_name,
+        'package_ids': package_ids,
+        'resource_ids': resource_ids,
+        'resources_by_package': resources_by_package
+    }
+
+
+@contextlib.contextmanager
+def rolled_back():
+    '''Bind the session to a transaction that is rolled back on exit, so
+    that the rows written meanwhile are never left behind, committed or
+    not.
+    '''
+    engine = model.meta.engine
+    if history_partitioned(engine):
+        # the partitions created in the transaction would be rolled back
+        # while known to exist
+        create_history_partitions(engine, datetime.datetime.utcnow())
+    model.Session.remove()
+    connection = engine.connect()
+    transaction = connection.begin()
+    # commits of the session end a subtransaction, not this one
+    model.Session.configure(bind=connection)
+    try:
+        yield
+    finally:
+        model.Session.remove()
+        transaction.rollback()
+        connection.close()
+        model.Session.configure(bind=engine)
+
+
+def _context(user):
+    return {'model': model, 'session': model.Session, 'user': user}
+
+
+def _operations(data, rng):
+    user = data['user']
+
+    def resource_show():
+        resource_id = rng.choice(data['resource_ids'])
+        auth.resource_show(_context(user), {'id': resource_id})
+
+    def after_show():
+        # package_show has loaded the package before after_show is called
+        package_id = rng.choice(data['package_ids'])
+        context = _context(user)
+        context['package'] = model.Package.get(package_id)
+        auth.authorized_resources(context, package_id, [{
+            'id': resource_id
+        } for resource_id in data['resources_by_package'][package_id]])
+
+    def user_dataset_labels():
+        resourceauthorizer_labels.user_labels(get_principal(_context(user)))
+
+    def resource_list_for_user():
+        get_action('resource_list_for_user')(_context(user), {})
+
+    return [('resource_show', resource_show), ('after_show', after_show),
+            ('get_user_dataset_labels', user_dataset_labels),
+            ('resource_list_for_user', resource_list_for_user)]
+
+
+def run(data, repeat=50, seed_value=0):
+    '''Time every operation, returning the latency percentiles and the
+    average number of SQL queries per call.
+    '''
+    rng = random.Random(seed_value)
+    engine = model.meta.engine
+    results = {}
+    for name, operation in _operations(data, rng):
+        operation()  # warm up
+        model.Session.remove()
+        timings = []
+        with QueryCounter(engine) as counter:
+            for _ in range(repeat):
+                start = time.time()
+                operation()
+                timings.append(time.time() - start)
+                model.Session.remove()
+        result = percentiles(timings)
+        result['mean_ms'] = round(sum(timings) / len(timings) * 1000, 3)
+        result['queries'] = round(float(counter.count) / repeat, 2)
+        results[name] = result
+    return results
+
+
+def benchmark(sizes=None, repeat=50, use_cache=False, seed_value=0):
+    '''Seed synthetic data and run the benchmark, the decision cache is
+    disabled unless use_cache is set. The seeded data is rolled back
+    afterwards.
+    '''
+    sizes = dict(DEFAULT_SIZES, **(sizes or {}))
+    if not use_cache:
+        set_cache(None)
+    with rolled_back():
+        data = seed(sizes, seed_value)
+        operations = run(data, repeat, seed_value)
+    return {
+        'meta': {
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'dialect': model.meta.engine.dialect.name,
+            'sizes': sizes,
+            'repeat': repeat,
+            'cache': use_cache,
+        },
+        'operations': operations,
+    }
+
+
+def compare(baseline, current):
+    '''Return the ratio current/baseline of the p50 latency and the query
+    count of every operation found in both results.
+    '''
+    ratios = {}
+    for name, result in current['operations'].items():
+        base = baseline['operations'].get(name)
+        if not base:
+            continue
+        ratios[name] = dict(
+            (key, round(result[key] / base[key], 3) if base[key] else None)
+            for key in ('p50', 'queries'))
+    return ratios
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import datetime
+import json
+import logging
+import threading
+import time
+
+from ckan.common import config
+
+from ckanext.resourceauthorizer.util import request_store
+
+log = logging.getLogger(__name__)
+
+REQUEST_KEY = 'ckanext.resourceauthorizer.authorizations'
+
+_cache = {}
+
+
+class MemoryBackend(object):
+    '''In-process LRU cache whose entries expire after their ttl.
+
+    Versions are kept apart from the cached values so that they are not
+    evicted with them, otherwise a stale entry could become reachable
+    again. They are bounded by the size too: when there are too many, they
+    are all dropped and a new generation, part of every version, starts.
+    '''
+
+    def __init__(self, size=10000):
+        self.size = size
+        self._values = collections.OrderedDict()
+        self._versions = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._values.pop(key, None)
+                if entry is not None and entry[1] > now:
+                    self._values[key] = entry
+                    values.append(entry[0])
+                else:
+                    values.append(None)
+        return values
+
+    def set_many(self, mapping, ttl):
+        expires = time.time() + ttl
+        with self._lock:
+            for key, value in mapping.items():
+                self._values.pop(key, None)
+                self._values[key] = (value, expires)
+            while len(self._values) > self.size:
+                self._values.popitem(last=False)
+
+    def versions(self, names):
+        with self._lock:
+            return [
+                '%d.%d' % (self._generation, self._versions.get(name, 0))
+                for name in names
+            ]
+
+    def bump(self, names):
+        with self._lock:
+            if len(self._versions) + len(names) > self.size:
+                # the entries cached under the previous generation are
+                # unreachable, free them too
+                self._versions.clear()
+                self._values.clear()
+                self._generation += 1
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._versions.clear()
+
+
+class RedisBackend(object):
+    '''Cache shared by all the workers through a Redis-protocol server.
+
+    Entries expire on the server after their ttl, eviction is left to the
+    server's maxmemory policy. Versions are plain counters without expiry.
+    '''
+
+    def __init__(self, client, prefix='resourceauthorizer:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        values = self.client.mget([self.prefix + key for key in keys])
+        return [json.loads(v) if v is not None else None for v in values]
+
+    def set_many(self, mapping, ttl):
+        if not mapping:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.setex(self.prefix + key, int(ttl), json.dumps(value))
+        pipe.execute()
+
+    def versions(self, names):
+        if not names:
+            return []
+        values = self.client.mget([self.prefix + 'v:' + n for n in names])
+        return [int(v) if v is not None else 0 for v in values]
+
+    def bump(self, names):
+        pipe = self.client.pipeline(transaction=False)
+        for name in names:
+            pipe.incr(self.prefix + 'v:' + name)
+        pipe.execute()
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class DecisionCache(object):
+    '''Caches acl decisions keyed on (user, resource), and the resources
+    and packages granted to each user.
+
+    Every key embeds the current version of its resource, writing an acl
+    of the resource bumps that version so that all the decisions cached
+    for the resource become unreachable at once. Entries depending on an acl
+    bounded in time expire when the acl starts or stops applying.
+    '''
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+
+    def _keys(self, user_id, resource_ids, permission):
+        versions = self.backend.versions(
+            ['resource:' + r for r in resource_ids])
+        return [
+            u'd:{0}:{1}:{2}:{3}'.format(r, v, user_id, permission)
+            for r, v in zip(resource_ids, versions)
+        ]
+
+    def get_decisions(self, user_id, resource_ids, permission):
+        '''Return the cached decisions, and the keys to store the missing
+        ones under.
+        '''
+        resource_ids = list(resource_ids)
+        keys = self._keys(user_id, resource_ids, permission)
+        values = self.backend.get_many(keys)
+        cached = {}
+        missing = {}
+        for resource_id, key, value in zip(resource_ids, keys, values):
+            if value is None:
+                missing[resource_id] = key
+            else:
+                cached[resource_id] = value
+        return cached, missing
+
+    def _ttl(self, until=None):
+        # until: the UTC time the cached value may change at, if any
+        if until is None:
+            return self.ttl
+        seconds = (until - datetime.datetime.utcnow()).total_seconds()
+        return max(1, min(self.ttl, int(seconds)))
+
+    def set_decisions(self, keys, decisions, boundaries=None):
+        '''Cache the decisions, boundaries optionally maps resource ids to
+        the time their decision may change at.
+        '''
+        boundaries = boundaries or {}
+        by_ttl = {}
+        for resource_id, decision in decisions.items():
+            ttl = self._ttl(boundaries.get(resource_id))
+            by_ttl.setdefault(ttl, {})[keys[resource_id]] = decision
+        for ttl, mapping in by_ttl.items():
+            self.backend.set_many(mapping, ttl)
+
+    def get_grants(self, user_id, scope):
+        '''Return the cached ids of the resources or packages (depending on
+        scope) granted to the user, and the key to store them under when
+        they are not cached.
+        '''
+        version = self.backend.versions(['grants'])[0]
+        key = u'g:{0}:{1}:{2}'.format(version, scope, user_id)
+        return self.backend.get_many([key])[0], key
+
+    def set_grants(self, key, ids, until=None):
+        self.backend.set_many({key: sorted(ids)}, self._ttl(until))
+
+    def invalidate(self, resource_ids):
+        resource_ids = set(resource_ids)
+        if resource_ids:
+            # any acl write may change the resources granted to many users
+            self.backend.bump(['resource:' + r for r in resource_ids] +
+                              ['grants'])
+
+    def clear(self):
+        self.backend.clear()
+
+
+def _redis_client(url):
+    import redis
+    return redis.StrictRedis.from_url(url)
+
+
+def get_cache():
+    '''Return the configured decision cache, or None when it is disabled.
+
+    ``ckanext.resourceauthorizer.cache.backend`` selects ``memory`` or
+    ``redis``, anything else disables the cache.
+    '''
+    if 'cache' not in _cache:
+        name = config.get('ckanext.resourceauthorizer.cache.backend', 'none')
+        ttl = int(config.get('ckanext.resourceauthorizer.cache.ttl', 300))
+        if name == 'memory':
+            size = int(
+                config.get('ckanext.resourceauthorizer.cache.size', 10000))
+            backend = MemoryBackend(size)
+        elif name == 'redis':
+            url = config.get('ckanext.resourceauthorizer.cache.redis_url',
+                             config.get('ckan.redis.url',
+                                        'redis://localhost:6379/0'))
+            backend = RedisBackend(_redis_client(url))
+        else:
+            backend = None
+        _cache['cache'] = DecisionCache(backend, ttl) if backend else None
+        log.debug('resource acl decision cache: %s', name)
+    return _cache['cache']
+
+
+def set_cache(cache):
+    '''Replace the configured decision cache, e.g. in tests.'''
+    _cache['cache'] = cache
+
+
+def request_authorizations():
+    '''Return the authorizations memoized for the current web request, keyed
+    on (user, permission, resource id), or None outside of a request.
+    '''
+    return request_store(REQUEST_KEY)
+
+
+def invalidate(resource_ids):
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate(resource_ids)
+    memo = request_authorizations()
+    if memo:
+        memo.clear()
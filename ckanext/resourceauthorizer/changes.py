@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import event
+
+import ckan.model as model
+
+from ckanext.resourceauthorizer import cache
+from ckanext.resourceauthorizer import effective
+from ckanext.resourceauthorizer import reindex
+
+INVALIDATE_KEY = 'resourceauthorizer.changes.invalidate'
+
+
+def commit_acl_changes(resource_ids, session=None, commit=True,
+                       package_ids=()):
+    '''Finish a change of the acls of the resources, and of the datasets
+    whose acls apply to all their resources: refresh their effective
+    permissions and record their datasets for reindexing in the same
+    transaction, commit unless told otherwise and invalidate the cached
+    decisions, again after the commit when it is left to the caller.
+    '''
+    session = session or model.Session
+    resource_ids = set(resource_ids)
+    resource_ids.discard(None)
+    package_ids = set(package_ids)
+    package_ids.discard(None)
+    if package_ids:
+        resource_ids.update(row[0] for row in session.query(
+            model.Resource.id).filter(
+                model.Resource.package_id.in_(package_ids)))
+    if effective.enabled() and resource_ids:
+        session.flush()
+        effective.refresh_resources(session, resource_ids)
+    if resource_ids:
+        reindex.record(session, resource_ids)
+    if commit:
+        session.commit()
+    else:
+        # until the commit, other requests still read the former acls and
+        # would cache their decisions under the new versions
+        session.info.setdefault(INVALIDATE_KEY, set()).update(resource_ids)
+    cache.invalidate(resource_ids)
+
+
+def _after_commit(session):
+    resource_ids = session.info.pop(INVALIDATE_KEY, None)
+    if resource_ids:
+        cache.invalidate(resource_ids)
+
+
+def _after_rollback(session):
+    session.info.pop(INVALIDATE_KEY, None)
+
+
+def listen():
+    '''Invalidate the cached decisions on the resources whose acls changed
+    without committing once the change is committed.
+    '''
+    if event.contains(model.Session, 'after_commit', _after_commit):
+        return
+    event.listen(model.Session, 'after_commit', _after_commit)
+    event.listen(model.Session, 'after_rollback', _after_rollback)
@@ -1,5 +1,7 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
+import datetime
+import json
 import sys
 
 from ckan import model
@@ -7,6 +9,8 @@ from ckan.logic import get_action
 
 from ckan.lib.cli import CkanCommand
 
+from ckanext.resourceauthorizer import transfer
+
 
 class ResourceAuthorizerCommand(CkanCommand):
     '''Resource authorizer commands
@@ -16,29 +20,146 @@ class ResourceAuthorizerCommand(CkanCommand):
       resourceauthorizer init-db
         - Create the resource_acl table in the database
 
-      resourceauthorizer list-acl [{resource-id}]
-        - lists resource acls
+      resourceauthorizer migrate-db
+        - Upgrade the resource_acl table: remove conflicting acls, fill the
+          permission ranks and build the indexes (concurrently on
+          PostgreSQL), and create the resource_acl_history table
+
+      resourceauthorizer list-acl [{resource-id}] [--dataset]
+        - lists resource acls, those of the dataset with --dataset
 
       resourceauthorizer show-acl {id}
         - shows information of the resource acl
 
       resourceauthorizer create-acl {resource-id} {auth-type} {auth-id} {permission}
-        - creates a new resource acl
+                                    [--dataset]
+        - creates a new resource acl, auth-type is one of user, org, group,
+          sysadmin, authenticated and anonymous (with * as auth-id) and
+          permission one of none, read, download, write and manage. With
+          --dataset, the id is a dataset id and the acl applies to all its
+          resources, unless the acls of a resource apply to the user
 
       resourceauthorizer delete-acl {id}
         - deletes the resource acl
 
       resourceauthorizer update-acl {id} {auth-type} {auth-id} {permission}
         - updates the resource acl
+
+      resourceauthorizer export-acl {file|-} [--format=jsonl|csv]
+        - streams every resource acl to the file (or stdout)
+
+      resourceauthorizer import-acl {file|-} [--format=jsonl|csv] [--dry-run]
+                                    [--chunk-size=1000]
+        - streams resource acls from the file (or stdin), inserting them or
+          updating the permission of the acl of the same resource and
+          principal, one chunk per transaction
+
+      resourceauthorizer reindex-labels
+        - rebuilds the search index of the datasets having resources, needed
+          after changing ckanext.resourceauthorizer.label_mode
+
+      resourceauthorizer reindex-acl-datasets
+        - rebuilds the search index of the datasets having resources with
+          acls only, one solr commit per batch
+
+      resourceauthorizer reindex-pending
+        - rebuilds the search index of the datasets whose acls changed and
+          that were not reindexed yet, e.g. from cron with
+          ckanext.resourceauthorizer.reindex = off
+
+      resourceauthorizer vacuum-acl [--dry-run] [--chunk-size=1000]
+        - deletes the acls of deleted resources, datasets, users,
+          organizations and groups, one chunk per transaction
+
+      resourceauthorizer sweep-expired [--archive] [--chunk-size=1000]
+        - deletes the acls whose valid_until has passed, one chunk per
+          transaction, moving them to resource_acl_archive with --archive
+
+      resourceauthorizer prune-history {days} [--chunk-size=1000]
+        - deletes the history of the acl changes older than the number of
+          days, dropping whole monthly partitions on PostgreSQL 11 and
+          later, and creates the partitions of the coming months
+
+      resourceauthorizer run-jobs
+        - runs the queued background acl jobs in this process, without
+          forking, and exits when the queue is empty, e.g. for local
+          development (use 'paster jobs worker' in production)
+
+      resourceauthorizer rebuild-effective
+        - rebuilds the resource_acl_effective table from the resource acls
+          and the organization memberships, needed before switching on
+          ckanext.resourceauthorizer.effective_table
+
+      resourceauthorizer benchmark [{size}={value} ...] [--output=file]
+                                   [--repeat=50] [--cache]
+        - seeds synthetic data in the database and reports the latency
+          percentiles and the SQL query count of the authorization hot paths
+          as JSON. Sizes: datasets, resources_per_dataset, acls_per_resource,
+          orgs_per_user, users_per_org. The seeded data is rolled back
+          afterwards.
+
+      resourceauthorizer benchmark-compare {baseline.json} {current.json}
+        - prints the p50 latency and query count ratios between two results
+
+      resourceauthorizer benchmark-labels {user} [{user} ...]
+        - compares the permission label filter query length and the solr
+          latency of the labeling modes for the users, as JSON
     '''
 
     summary = __doc__.split('\n')[0]
     usage = __doc__
-    max_args = 5
+    max_args = None
     min_args = 0
 
     def __init__(self, name):
         super(ResourceAuthorizerCommand, self).__init__(name)
+        self.parser.add_option(
+            '--format',
+            dest='format',
+            default='jsonl',
+            help='jsonl or csv, for export-acl and import-acl')
+        self.parser.add_option(
+            '--dry-run',
+            dest='dry_run',
+            action='store_true',
+            default=False,
+            help='import-acl, vacuum-acl: report the changes without '
+            'writing them')
+        self.parser.add_option(
+            '--dataset',
+            dest='dataset',
+            action='store_true',
+            default=False,
+            help='list-acl, create-acl: the id is the id of a dataset')
+        self.parser.add_option(
+            '--archive',
+            dest='archive',
+            action='store_true',
+            default=False,
+            help='sweep-expired: keep the expired acls in resource_acl_archive')
+        self.parser.add_option(
+            '--chunk-size',
+            dest='chunk_size',
+            type='int',
+            default=1000,
+            help='number of acls read or written at once')
+        self.parser.add_option(
+            '--output',
+            dest='output',
+            default=None,
+            help='benchmark: file to save the JSON results to')
+        self.parser.add_option(
+            '--repeat',
+            dest='repeat',
+            type='int',
+            default=50,
+            help='benchmark: number of timed calls per operation')
+        self.parser.add_option(
+            '--cache',
+            dest='cache',
+            action='store_true',
+            default=False,
+            help='benchmark: keep the configured decision cache enabled')
 
     def command(self):
         self._load_config()
@@ -54,12 +175,16 @@ class ResourceAuthorizerCommand(CkanCommand):
         }
         self.admin_user = get_action('get_site_user')(context, {})
 
-        print ''
-
         cmd = self.args[0]
 
+        if cmd != 'export-acl':
+            # keep stdout clean for 'export-acl -'
+            print ''
+
         if cmd == 'initdb':
             self.setup_db()
+        elif cmd == 'migrate-db':
+            self.migrate_db()
         elif cmd == 'list-acl':
             self.list_acl()
         elif cmd == 'show-acl':
@@ -70,6 +195,32 @@ class ResourceAuthorizerCommand(CkanCommand):
             self.delete_acl()
         elif cmd == 'update-acl':
             self.update_acl()
+        elif cmd == 'export-acl':
+            self.export_acl()
+        elif cmd == 'import-acl':
+            self.import_acl()
+        elif cmd == 'reindex-labels':
+            self.reindex_labels()
+        elif cmd == 'reindex-acl-datasets':
+            self.reindex_acl_datasets()
+        elif cmd == 'reindex-pending':
+            self.reindex_pending()
+        elif cmd == 'vacuum-acl':
+            self.vacuum_acl()
+        elif cmd == 'sweep-expired':
+            self.sweep_expired()
+        elif cmd == 'prune-history':
+            self.prune_history()
+        elif cmd == 'run-jobs':
+            self.run_jobs()
+        elif cmd == 'rebuild-effective':
+            self.rebuild_effective()
+        elif cmd == 'benchmark':
+            self.benchmark()
+        elif cmd == 'benchmark-compare':
+            self.benchmark_compare()
+        elif cmd == 'benchmark-labels':
+            self.benchmark_labels()
         else:
             print 'command %s not recognized' % cmd
 
@@ -79,6 +230,19 @@ class ResourceAuthorizerCommand(CkanCommand):
         print 'resource_acl table created'
         print ''
 
+    def migrate_db(self):
+        from ckanext.resourceauthorizer.model import migrate as db_migrate
+        from ckanext.resourceauthorizer import effective
+        db_migrate()
+        print 'resource_acl table migrated'
+        if effective.enabled():
+            count = effective.rebuild(model.Session)
+            print '%d effective permissions were stored.' % count
+        print ''
+
+    def _scope_field(self):
+        return 'package_id' if self.options.dataset else 'resource_id'
+
     def list_acl(self):
         context = {
             'model': model,
@@ -86,12 +250,14 @@ class ResourceAuthorizerCommand(CkanCommand):
             'user': self.admin_user['name'],
             'ignore_auth': True,
         }
-        data_dict = {}
+        data_dict = {'cursor': u''}
         if 2 <= len(self.args):
-            data_dict['resource_id'] = unicode(self.args[1])
-        acls = get_action('resource_acl_list')(context, data_dict)
-        for acl in acls:
-            self.print_acl(acl)
+            data_dict[self._scope_field()] = unicode(self.args[1])
+        while data_dict['cursor'] is not None:
+            page = get_action('resource_acl_list')(dict(context), data_dict)
+            for acl in page['results']:
+                self.print_acl(acl)
+            data_dict['cursor'] = page['next_cursor']
 
     def show_acl(self):
         if len(self.args) != 2:
@@ -119,7 +285,7 @@ class ResourceAuthorizerCommand(CkanCommand):
             'ignore_auth': True,
         }
         data_dict = {}
-        data_dict['resource_id'] = unicode(self.args[1])
+        data_dict[self._scope_field()] = unicode(self.args[1])
         data_dict['auth_type'] = unicode(self.args[2])
         data_dict['auth_id'] = unicode(self.args[3])
         data_dict['permission'] = unicode(self.args[4])
@@ -160,9 +326,154 @@ class ResourceAuthorizerCommand(CkanCommand):
         acl = get_action('resource_acl_update')(context, data_dict)
         self.print_acl(acl)
 
+    def _open(self, mode):
+        if len(self.args) != 2:
+            print 'Please check arguments'
+            sys.exit(1)
+        if self.options.format not in transfer.FORMATS:
+            print 'Invalid format %s' % self.options.format
+            sys.exit(1)
+        if self.args[1] == '-':
+            return sys.stdout if 'w' in mode else sys.stdin
+        return open(self.args[1], mode)
+
+    def export_acl(self):
+        out = self._open('wb')
+        count = transfer.export_acls(
+            out,
+            self.options.format,
+            self.options.chunk_size,
+            progress=transfer.ProgressReport(sys.stderr))
+        if out is not sys.stdout:
+            out.close()
+            print '%d acls were exported.' % count
+
+    def import_acl(self):
+        input = self._open('rb')
+        totals = transfer.import_acls(
+            input,
+            self.options.format,
+            self.options.chunk_size,
+            dry_run=self.options.dry_run,
+            user=self.admin_user['name'],
+            progress=transfer.ProgressReport(sys.stderr))
+        if input is not sys.stdin:
+            input.close()
+        if self.options.dry_run:
+            print 'Dry run, nothing was written.'
+        for key in sorted(totals):
+            print '%10s: %d' % (key, totals[key])
+        print ''
+
+    def reindex_labels(self):
+        from ckanext.resourceauthorizer import indexing
+        package_ids = indexing.all_package_ids()
+        indexed = indexing.reindex_packages(package_ids)
+        print '%d datasets were reindexed.' % indexed
+        print ''
+
+    def reindex_acl_datasets(self):
+        from ckanext.resourceauthorizer import indexing
+        package_ids = indexing.acl_package_ids()
+        indexed = indexing.reindex_packages(package_ids)
+        print '%d datasets were reindexed.' % indexed
+        print ''
+
+    def reindex_pending(self):
+        from ckanext.resourceauthorizer import reindex
+        indexed = reindex.process(model.Session)
+        print '%d datasets were reindexed.' % indexed
+        print ''
+
+    def vacuum_acl(self):
+        from ckanext.resourceauthorizer import lifecycle
+        totals = lifecycle.vacuum(
+            model.Session,
+            self.options.chunk_size,
+            self.options.dry_run,
+            progress=transfer.ProgressReport(sys.stderr))
+        if self.options.dry_run:
+            print 'Dry run, nothing was deleted.'
+        for kind in sorted(totals):
+            print '%10s: %d orphan acls' % (kind, totals[kind])
+        print ''
+
+    def sweep_expired(self):
+        from ckanext.resourceauthorizer import lifecycle
+        swept = lifecycle.sweep_expired(
+            model.Session,
+            self.options.chunk_size,
+            self.options.archive,
+            progress=transfer.ProgressReport(sys.stderr))
+        print '%d expired acls were %s.' % (
+            swept, 'archived' if self.options.archive else 'deleted')
+        print ''
+
+    def prune_history(self):
+        if len(self.args) != 2 or not self.args[1].isdigit():
+            print 'Please check arguments'
+            sys.exit(1)
+        from ckanext.resourceauthorizer import lifecycle
+        before = datetime.datetime.utcnow() - datetime.timedelta(
+            days=int(self.args[1]))
+        dropped, deleted = lifecycle.prune_history(
+            model.Session,
+            before,
+            self.options.chunk_size,
+            progress=transfer.ProgressReport(sys.stderr))
+        print '%d partitions were dropped and %d changes deleted.' % (
+            dropped, deleted)
+        print ''
+
+    def run_jobs(self):
+        from ckanext.resourceauthorizer import jobs
+        jobs.work(burst=True)
+        print ''
+
+    def rebuild_effective(self):
+        from ckanext.resourceauthorizer import effective
+        count = effective.rebuild(model.Session)
+        print '%d effective permissions were stored.' % count
+        print ''
+
+    def benchmark(self):
+        from ckanext.resourceauthorizer import benchmark
+        sizes = {}
+        for arg in self.args[1:]:
+            key, _, value = arg.partition('=')
+            if key not in benchmark.DEFAULT_SIZES or not value.isdigit():
+                print 'Please check arguments'
+                sys.exit(1)
+            sizes[key] = int(value)
+        results = benchmark.benchmark(sizes, self.options.repeat,
+                                      self.options.cache)
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if self.options.output:
+            with open(self.options.output, 'w') as f:
+                f.write(output)
+        print output
+
+    def benchmark_compare(self):
+        if len(self.args) != 3:
+            print 'Please check arguments'
+            sys.exit(1)
+        from ckanext.resourceauthorizer.benchmark import compare
+        with open(self.args[1]) as baseline, open(self.args[2]) as current:
+            ratios = compare(json.load(baseline), json.load(current))
+        print json.dumps(ratios, indent=2, sort_keys=True)
+
+    def benchmark_labels(self):
+        if len(self.args) < 2:
+            print 'Please check arguments'
+            sys.exit(1)
+        from ckanext.resourceauthorizer.benchmark import benchmark_label_modes
+        results = benchmark_label_modes(self.args[1:])
+        print json.dumps(results, indent=2)
+
     def print_acl(self, acl):
         print '              id: %s' % acl.get('id')
         print '     resource id: %s' % acl.get('resource_id')
+        print '      dataset id: %s' % acl.get('package_id')
         print '       auth type: %s' % acl.get('auth_type')
         print '         auth id: %s' % acl.get('auth_id')
         print '      permission: %s' % acl.get('permission')
@@ -4,6 +4,11 @@ from ckan.logic import (ValidationError, NotAuthorized, NotFound, check_access,
                         get_action, clean_dict, tuplize_dict, parse_params)
 import ckan.lib.navl.dictization_functions as dict_fns
 import ckan.model as model
+from ckan.controllers.package import PackageController
+
+from ckanext.resourceauthorizer.helpers import ROLE_LABELS
+from ckanext.resourceauthorizer.helpers import resolve_acl_principals
+from ckanext.resourceauthorizer.model import PERMISSIONS, ROLE_AUTH_TYPES
 
 
 class ResourceAuthorizerController(BaseController):
@@ -18,20 +23,36 @@ class ResourceAuthorizerController(BaseController):
             c.resource = get_action('resource_show')(None, {'id': resource_id})
             rec = get_action('resource_acl_list')(None, {
                 'resource_id': resource_id,
-                'limit': 0
+                'cursor': request.params.get('cursor', u''),
+                'include_total': True
             })
         except NotAuthorized:
             abort(403)
         except NotFound:
             abort(404)
+        except ValidationError:
+            abort(400)
         return render(
             'resource-authorizer/acl.html',
             extra_vars={
-                'acls': rec,
+                'acls': rec['results'],
+                'principals': resolve_acl_principals(rec['results']),
+                'total': rec['count'],
+                'cursor': request.params.get('cursor'),
+                'next_cursor': rec['next_cursor'],
                 'dataset_id': dataset_id,
                 'resource_id': resource_id
             })
 
+    def resource_download(self, id, resource_id, filename=None):
+        context = {'model': model, 'session': model.Session, 'user': c.user}
+        try:
+            check_access('resource_download', context, {'id': resource_id})
+        except NotAuthorized:
+            abort(403, _('Unauthorized to download resource %s') % resource_id)
+        return PackageController().resource_download(id, resource_id,
+                                                     filename)
+
     def resource_acl_new(self, dataset_id, resource_id):
         context = {'model': model, 'session': model.Session, 'user': c.user}
         try:
@@ -44,12 +65,13 @@ class ResourceAuthorizerController(BaseController):
             c.pkg_dict = get_action('package_show')(None, {'id': dataset_id})
             c.resource = get_action('resource_show')(None, {'id': resource_id})
             c.permissions = [{
-                'text': u'None',
-                'value': 'none'
-            }, {
-                'text': u'Read',
-                'value': 'read'
-            }]
+                'text': permission.capitalize(),
+                'value': permission
+            } for permission in PERMISSIONS]
+            c.roles = [{'text': u'', 'value': u''}] + [{
+                'text': ROLE_LABELS[role],
+                'value': role
+            } for role in ROLE_AUTH_TYPES]
             if request.method == 'POST':
                 data_dict = clean_dict(
                     dict_fns.unflatten(
@@ -60,7 +82,20 @@ class ResourceAuthorizerController(BaseController):
                         'resource_id': resource_id,
                         'permission': data_dict['permission']
                     }
-                    if data_dict['organization']:
+                    if data_dict.get('role'):
+                        data['auth_type'] = data_dict['role']
+                    elif data_dict.get('group'):
+                        group = model.Group.get(data_dict['group'])
+                        if not group or group.is_organization:
+                            message = _(u'Group {group} does not exist.').format(
+                                group=data_dict['group'])
+                            raise ValidationError(
+                                {
+                                    'message': message
+                                }, error_summary=message)
+                        data['auth_type'] = 'group'
+                        data['auth_id'] = group.id
+                    elif data_dict['organization']:
                         group = model.Group.get(data_dict['organization'])
                         if not group:
                             message = _(u'Organization {org} does not exist.').format(
@@ -82,9 +117,14 @@ class ResourceAuthorizerController(BaseController):
                                 }, error_summary=message)
                         data['auth_type'] = 'user'
                         data['auth_id'] = user.id
+                    if data_dict.get('valid_until'):
+                        data['valid_until'] = data_dict['valid_until']
                     get_action('resource_acl_create')(None, data)
                 else:
                     data = {'id': acl, 'permission': data_dict['permission']}
+                    # an emptied field clears the end of the period
+                    if 'valid_until' in data_dict:
+                        data['valid_until'] = data_dict['valid_until']
                     get_action('resource_acl_patch')(None, data)
                 self._redirect_to_this_controller(
                     action='resource_acl',
@@ -101,6 +141,15 @@ class ResourceAuthorizerController(BaseController):
                             context, {
                                 'id': c.acl_dict['auth_id']
                             })
+                    elif c.acl_dict['auth_type'] == 'group':
+                        c.auth = get_action('group_show')(
+                            context, {
+                                'id': c.acl_dict['auth_id']
+                            })
+                    elif c.acl_dict['auth_type'] in ROLE_LABELS:
+                        c.auth = {
+                            'name': ROLE_LABELS[c.acl_dict['auth_type']]
+                        }
                     else:
                         c.auth = get_action('organization_show')(
                             context, {
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from sqlalchemy import and_, event, exists, func, or_, select, union_all
+from sqlalchemy.orm import object_session
+
+import ckan.model as model
+from ckan.common import config
+from ckan.plugins.toolkit import asbool
+
+from ckanext.resourceauthorizer.model import resource_acl_table
+from ckanext.resourceauthorizer.model import resource_acl_effective_table
+from ckanext.resourceauthorizer.model import bounded_clause
+from ckanext.resourceauthorizer.model import package_scope_clause
+from ckanext.resourceauthorizer.model import MEMBERSHIP_AUTH_TYPES
+from ckanext.resourceauthorizer.model import ROLE_AUTH_TYPES
+from ckanext.resourceauthorizer.util import chunks
+
+log = logging.getLogger(__name__)
+
+PENDING_USERS_KEY = 'resourceauthorizer.effective.users'
+COLUMNS = ['user_id', 'resource_id', 'permission_rank']
+
+
+def enabled():
+    '''Whether checks read the resource_acl_effective table, set with
+    ckanext.resourceauthorizer.effective_table.
+    '''
+    return asbool(
+        config.get('ckanext.resourceauthorizer.effective_table', False))
+
+
+def excluded_clause(table):
+    '''Match the acls of the table that resource_acl_effective leaves out:
+    those bounded in time, those given to roles, which apply to users that
+    cannot be listed, and those of datasets. The resources having some are
+    decided from resource_acl, see excluded_resources_clause.
+    '''
+    return or_(
+        bounded_clause(table), table.c.auth_type.in_(ROLE_AUTH_TYPES),
+        package_scope_clause(table))
+
+
+def excluded_resources_clause(resource):
+    '''Match the resources of the resource table having acls that
+    resource_acl_effective leaves out, their own or those of their dataset.
+    '''
+    acl = resource_acl_table.alias('excluded_acl')
+    return or_(
+        exists().where(
+            and_(acl.c.resource_id == resource.c.id, excluded_clause(acl))),
+        exists().where(
+            and_(package_scope_clause(acl),
+                 acl.c.package_id == resource.c.package_id)))
+
+
+def _effective_select(resource_ids=None, user_ids=None):
+    '''Select the effective permission of every (user, resource) having an
+    acl: the rank of the acl for the user if any, otherwise the highest rank
+    granted to the organizations and groups of the user.
+
+    The acls matched by excluded_clause are left out.
+    '''
+    acl = resource_acl_table
+    user_acl = acl.alias('user_acl')
+    member = model.member_table
+    group = model.group_table
+
+    user_rules = select(
+        [acl.c.auth_id, acl.c.resource_id,
+         acl.c.permission_rank]).where(
+             and_(acl.c.auth_type == 'user', ~excluded_clause(acl)))
+
+    memberships = acl.join(
+        member,
+        and_(member.c.group_id == acl.c.auth_id,
+             member.c.table_name == 'user', member.c.state == 'active')).join(
+                 group,
+                 and_(group.c.id == member.c.group_id,
+                      group.c.state == 'active',
+                      or_(and_(acl.c.auth_type == 'org',
+                               group.c.is_organization == True),
+                          and_(acl.c.auth_type == 'group',
+                               group.c.is_organization == False))))
+    has_user_rule = exists().where(
+        and_(user_acl.c.auth_type == 'user',
+             user_acl.c.auth_id == member.c.table_id,
+             user_acl.c.resource_id == acl.c.resource_id))
+    membership_rules = select([
+        member.c.table_id, acl.c.resource_id,
+        func.max(acl.c.permission_rank)
+    ]).select_from(memberships).where(
+        and_(acl.c.auth_type.in_(MEMBERSHIP_AUTH_TYPES),
+             ~excluded_clause(acl), ~has_user_rule)).group_by(
+                 member.c.table_id, acl.c.resource_id)
+
+    if resource_ids is not None:
+        user_rules = user_rules.where(acl.c.resource_id.in_(resource_ids))
+        membership_rules = membership_rules.where(
+            acl.c.resource_id.in_(resource_ids))
+    if user_ids is not None:
+        user_rules = user_rules.where(acl.c.auth_id.in_(user_ids))
+        membership_rules = membership_rules.where(
+            member.c.table_id.in_(user_ids))
+    return union_all(user_rules, membership_rules)
+
+
+def _insert(session, **filters):
+    session.execute(resource_acl_effective_table.insert().from_select(
+        COLUMNS, _effective_select(**filters)))
+
+
+def refresh_resources(session, resource_ids):
+    '''Re-derive the effective permissions on the resources, in the current
+    transaction, after their acls changed.
+    '''
+    table = resource_acl_effective_table
+    for chunk in chunks(set(resource_ids)):
+        session.execute(table.delete().where(table.c.resource_id.in_(chunk)))
+        _insert(session, resource_ids=chunk)
+
+
+def refresh_users(session, user_ids):
+    '''Re-derive the effective permissions of the users, in the current
+    transaction, after their memberships changed.
+    '''
+    table = resource_acl_effective_table
+    for chunk in chunks(set(user_ids)):
+        session.execute(table.delete().where(table.c.user_id.in_(chunk)))
+        _insert(session, user_ids=chunk)
+
+
+def rebuild(session):
+    '''Rebuild the whole resource_acl_effective table and commit.'''
+    session.execute(resource_acl_effective_table.delete())
+    _insert(session)
+    session.commit()
+    return session.query(func.count('*')).select_from(
+        resource_acl_effective_table).scalar()
+
+
+def _pending_users(session):
+    return session.info.setdefault(PENDING_USERS_KEY, set())
+
+
+def _member_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None and target.table_name == 'user':
+        _pending_users(session).add(target.table_id)
+
+
+def _group_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        member = model.member_table
+        _pending_users(session).update(row[0] for row in connection.execute(
+            select([member.c.table_id]).where(
+                and_(member.c.group_id == target.id,
+                     member.c.table_name == 'user'))))
+
+
+def _before_commit(session):
+    # the flush may record more membership changes
+    session.flush()
+    user_ids = session.info.pop(PENDING_USERS_KEY, None)
+    if user_ids:
+        refresh_users(session, user_ids)
+
+
+def listen():
+    '''Keep resource_acl_effective up to date when organization or group
+    memberships change, or organizations and groups are deleted.
+    '''
+    if event.contains(model.Session, 'before_commit', _before_commit):
+        return
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model.Member, name, _member_changed)
+    event.listen(model.Group, 'after_update', _group_changed)
+    event.listen(model.Group, 'after_delete', _group_changed)
+    event.listen(model.Session, 'before_commit', _before_commit)
@@ -2,8 +2,15 @@
 
 from webhelpers.html import tags
 import ckan.lib.helpers as helpers
+import ckan.model as model
 from routes import url_for
 
+ROLE_LABELS = {
+    'sysadmin': u'Sysadmins',
+    'authenticated': u'Logged-in users',
+    'anonymous': u'Anonymous users',
+}
+
 
 def linked_organization(org):
     organization = helpers.get_organization(org)
@@ -17,3 +24,63 @@ def linked_organization(org):
                                   action='read',
                                   id=organization['name']))))
     return 'Not Existed'
+
+
+def _organization_image_url(group):
+    image_url = group.image_url
+    if not image_url:
+        return helpers.url_for_static(
+            '/base/images/placeholder-organization.png')
+    if not image_url.startswith('http'):
+        return helpers.url_for_static(
+            'uploads/group/%s' % image_url, qualified=True)
+    return image_url
+
+
+def resolve_acl_principals(acls):
+    '''Load the users, and the organizations and groups, referenced by the
+    acls with one query each, for linked_acl_principal.
+    '''
+    user_ids = set(a['auth_id'] for a in acls if a['auth_type'] == 'user')
+    group_ids = set(a['auth_id'] for a in acls
+                    if a['auth_type'] in ('org', 'group'))
+    principals = {'user': {}, 'org': {}, 'group': {}, 'html': {}}
+    if user_ids:
+        principals['user'] = dict(
+            (u.id, u)
+            for u in model.Session.query(model.User).filter(
+                model.User.id.in_(user_ids)))
+    if group_ids:
+        for g in model.Session.query(model.Group).filter(
+                model.Group.id.in_(group_ids)):
+            principals['org' if g.is_organization else 'group'][g.id] = g
+    return principals
+
+
+def linked_acl_principal(acl, principals, maxlength=20):
+    '''Link to the user, organization or group of the acl, rendered once
+    per principal from the objects loaded by resolve_acl_principals. Acls
+    given to a role are labeled with the role.
+    '''
+    key = (acl['auth_type'], acl['auth_id'])
+    if key in principals['html']:
+        return principals['html'][key]
+
+    obj = principals.get(acl['auth_type'], {}).get(acl['auth_id'])
+    if acl['auth_type'] in ROLE_LABELS:
+        html = ROLE_LABELS[acl['auth_type']]
+    elif obj is None:
+        html = acl['auth_id'] if acl['auth_type'] == 'user' else 'Not Existed'
+    elif acl['auth_type'] == 'user':
+        html = helpers.linked_user(obj, maxlength=maxlength)
+    else:
+        html = tags.literal(u'{icon} {link}'.format(
+            icon=helpers.icon_html(
+                _organization_image_url(obj), alt='', inline=False),
+            link=tags.link_to(obj.title or obj.name,
+                              url_for(
+                                  controller=obj.type,
+                                  action='read',
+                                  id=obj.name))))
+    principals['html'][key] = html
+    return html
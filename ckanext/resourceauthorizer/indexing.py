@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+import ckan.model as model
+from ckan.logic import get_action
+from ckan.lib.search import commit, index_for
+
+from ckanext.resourceauthorizer.model import (package_scope_clause,
+                                              resource_acl_table)
+
+log = logging.getLogger(__name__)
+
+
+def all_package_ids():
+    '''Return the ids of the active packages having resources.'''
+    rows = model.Session.query(model.Resource.package_id).filter(
+        model.Resource.state == 'active').distinct()
+    return [row[0] for row in rows]
+
+
+def acl_package_ids():
+    '''Return the ids of the active packages having resources with acls, or
+    acls applying to all their resources.
+    '''
+    acl = resource_acl_table
+    resource_acls = model.Session.query(model.Resource.package_id).join(
+        acl, acl.c.resource_id == model.Resource.id).filter(
+            model.Resource.state == 'active')
+    package_acls = model.Session.query(acl.c.package_id).join(
+        model.Package, model.Package.id == acl.c.package_id).filter(
+            package_scope_clause(acl), model.Package.state == 'active')
+    rows = resource_acls.union(package_acls)
+    return [row[0] for row in rows]
+
+
+def reindex_packages(package_ids, batch_size=100, progress=None):
+    '''Rebuild the search index of the packages, committing to solr once
+    per batch rather than once per package. progress is called with the
+    number of packages reindexed after each batch.
+
+    Returns the number of packages that were reindexed.
+    '''
+    package_index = index_for(model.Package)
+    context = {
+        'model': model,
+        'session': model.Session,
+        'ignore_auth': True,
+        'validate': False,
+        'use_cache': False
+    }
+    package_ids = list(package_ids)
+    indexed = 0
+    for start in range(0, len(package_ids), batch_size):
+        for package_id in package_ids[start:start + batch_size]:
+            try:
+                package_dict = get_action('package_show')(dict(context), {
+                    'id': package_id
+                })
+            except Exception:
+                log.exception('Could not load package %s', package_id)
+                continue
+            package_index.update_dict(package_dict, defer_commit=True)
+            indexed += 1
+        commit()
+        log.info('Reindexed %d/%d packages', indexed, len(package_ids))
+        if progress:
+            progress(indexed)
+    return indexed
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+import ckan.model as model
+import ckan.lib.jobs as jobs
+from ckan.common import config
+from ckan.logic import ValidationError, get_action
+
+from ckanext.resourceauthorizer import reindex
+
+log = logging.getLogger(__name__)
+
+# the bulk action applying each chunk of a change set, and the key of the
+# change set in its data dict
+OPERATIONS = {
+    'create': ('resource_acl_bulk_create', 'acls'),
+    'update': ('resource_acl_bulk_update', 'acls'),
+    'delete': ('resource_acl_bulk_delete', 'ids'),
+}
+MAX_ERRORS = 100
+
+
+def queue_name():
+    return config.get('ckanext.resourceauthorizer.jobs.queue',
+                      jobs.DEFAULT_QUEUE_NAME)
+
+
+def _chunk_size():
+    return int(config.get('ckanext.resourceauthorizer.jobs.chunk_size', 500))
+
+
+class JobProgress(object):
+    '''Progress of an acl change set, kept in the meta of its job so that
+    resource_acl_job_status can read it from any process.
+    '''
+
+    def __init__(self, job, total):
+        self.job = job
+        self.meta = job.meta if job is not None else {}
+        self.meta.update({
+            'stage': 'applying',
+            'total': total,
+            'done': 0,
+            'failed': 0,
+            'reindexed': 0,
+            'datasets': 0,
+            'errors': []
+        })
+        self.save()
+
+    def save(self):
+        if self.job is not None:
+            # older versions of rq save the meta along with the job
+            getattr(self.job, 'save_meta', self.job.save)()
+
+    def applied(self, start, results):
+        '''Record the results of the chunk of the change set starting at
+        start, as returned by the bulk actions.
+        '''
+        for offset, result in enumerate(results):
+            if result.get('success'):
+                continue
+            self.meta['failed'] += 1
+            if len(self.meta['errors']) < MAX_ERRORS:
+                self.meta['errors'].append({
+                    'index': start + offset,
+                    'error': result.get('error')
+                })
+        self.meta['done'] += len(results)
+        self.save()
+
+    def reindexing(self, datasets):
+        self.meta['stage'] = 'reindexing'
+        self.meta['datasets'] = datasets
+        self.save()
+
+    def reindexed(self, count):
+        self.meta['reindexed'] = count
+        self.save()
+
+    def finished(self):
+        self.meta['stage'] = 'finished'
+        self.save()
+        return dict(self.meta)
+
+
+def _apply_chunk(action, key, context, chunk):
+    try:
+        return action(dict(context), {key: chunk})
+    except ValidationError:
+        model.Session.rollback()
+    # the bulk actions write nothing when an acl is invalid, apply the
+    # valid ones of the chunk one by one
+    results = []
+    for item in chunk:
+        try:
+            results.extend(action(dict(context), {key: [item]}))
+        except ValidationError as e:
+            model.Session.rollback()
+            error = e.error_dict.get('acls', [e.error_dict])[0]
+            results.append({'success': False, 'error': error})
+    return results
+
+
+def apply_acl_changes(operation, items, user):
+    '''Apply a change set of acls in chunks, one transaction per chunk, then
+    reindex the affected datasets in batches, see reindex.process. Runs as
+    a background job, see enqueue_acl_changes.
+    '''
+    from rq import get_current_job
+    progress = JobProgress(get_current_job(), len(items))
+    action_name, key = OPERATIONS[operation]
+    action = get_action(action_name)
+    context = {
+        'model': model,
+        'session': model.Session,
+        'user': user,
+        'ignore_auth': True
+    }
+    size = _chunk_size()
+    for start in range(0, len(items), size):
+        chunk = items[start:start + size]
+        progress.applied(start, _apply_chunk(action, key, context, chunk))
+        log.info('Applied %d/%d acl changes', progress.meta['done'],
+                 len(items))
+
+    # the datasets changed by the job, and by any other acl write meanwhile
+    progress.reindexing(reindex.pending_count(model.Session))
+    reindex.process(model.Session, progress=progress.reindexed)
+    return progress.finished()
+
+
+def enqueue_acl_changes(operation, items, user):
+    '''Queue a change set of acls, already authorized, to be applied by a
+    background worker. Returns the id of the job.
+    '''
+    job = jobs.enqueue(
+        apply_acl_changes,
+        kwargs={
+            'operation': operation,
+            'items': items,
+            'user': user
+        },
+        title=u'resource acl bulk {0} of {1} acls'.format(
+            operation, len(items)),
+        queue=queue_name())
+    return job.id
+
+
+def get_job(id):
+    '''Return the acl job, or None when there is none with this id.'''
+    try:
+        job = jobs.job_from_id(id)
+    except KeyError:
+        return None
+    if job.func_name != '{0}.{1}'.format(__name__,
+                                         apply_acl_changes.__name__):
+        return None
+    return job
+
+
+def job_status(job):
+    '''Return the status of the acl job and its progress, once started.'''
+    status = jobs.dictize_job(job)
+    status['status'] = job.get_status()
+    status['user'] = job.kwargs.get('user')
+    status.update(job.meta)
+    if job.is_failed:
+        status['stage'] = 'failed'
+    return status
+
+
+def work(burst=True):
+    '''Run the acl jobs in the current process, without forking, e.g. in
+    tests or for local development. With burst, return once the queue is
+    empty.
+    '''
+    from rq import SimpleWorker
+    queue = jobs.get_queue(queue_name())
+    SimpleWorker([queue], connection=queue.connection).work(burst=burst)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from ckan.common import config
+
+from ckanext.resourceauthorizer.logic import auth
+
+LABEL_MODES = ['resource', 'dataset']
+
+
+def label_mode():
+    '''Return the configured labeling mode.
+
+    ``resource`` (default) labels every dataset with one ``acl-<id>`` label
+    per resource, ``dataset`` with a single ``acl-dataset-<id>`` label, so
+    that the labels of a user grow with the number of datasets, not
+    resources, they are granted.
+    '''
+    mode = config.get('ckanext.resourceauthorizer.label_mode', 'resource')
+    if mode not in LABEL_MODES:
+        raise ValueError('Invalid ckanext.resourceauthorizer.label_mode %s' %
+                         mode)
+    return mode
+
+
+def dataset_labels(dataset_obj, mode=None):
+    if (mode or label_mode()) == 'dataset':
+        return [u'acl-dataset-%s' % dataset_obj.id]
+    # the acls of the dataset are matched by a single label
+    labels = [u'acl-dataset-%s' % dataset_obj.id]
+    return labels + [u'acl-%s' % o.id for o in dataset_obj.resources]
+
+
+def user_labels(principal, mode=None):
+    if (mode or label_mode()) == 'dataset':
+        return [
+            u'acl-dataset-%s' % package_id
+            for package_id in auth.granted_package_ids(principal)
+        ]
+    # one label per dataset granted by its own acls, rather than one per
+    # resource
+    return [
+        u'acl-dataset-%s' % package_id
+        for package_id in auth.granted_dataset_acl_package_ids(principal)
+    ] + [
+        u'acl-%s' % resource_id
+        for resource_id in auth.granted_resource_acl_ids(principal)
+    ]
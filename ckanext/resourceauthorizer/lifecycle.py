@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from sqlalchemy import and_, event, exists, func, select
+from sqlalchemy.orm import object_session
+
+import ckan.model as model
+
+from ckanext.resourceauthorizer.changes import commit_acl_changes
+from ckanext.resourceauthorizer.model import resource_acl_table
+from ckanext.resourceauthorizer.model import resource_acl_archive_table
+from ckanext.resourceauthorizer.model import resource_acl_history_table
+from ckanext.resourceauthorizer.model import record_history
+from ckanext.resourceauthorizer.model import package_scope_clause
+from ckanext.resourceauthorizer.model import month_start
+from ckanext.resourceauthorizer.model import history_partitioned
+from ckanext.resourceauthorizer.model import history_partitions
+from ckanext.resourceauthorizer.model import create_history_partitions
+from ckanext.resourceauthorizer.model import drop_history_partition
+
+PENDING_KEY = 'resourceauthorizer.lifecycle.principals'
+
+
+def _delete_where(session, clause):
+    '''Delete the acls matching the clause in the current transaction and
+    return the ids of their resources and of their datasets.
+    '''
+    acl = resource_acl_table
+    rows = session.execute(
+        select([acl.c.resource_id, acl.c.package_id]).where(
+            clause).distinct()).fetchall()
+    if rows:
+        record_history('delete', clause, u'', session)
+        session.execute(acl.delete().where(clause))
+    return (set(row[0] for row in rows), set(row[1] for row in rows))
+
+
+def forget_resources(session, resource_ids, commit=False):
+    '''Delete the acls of purged resources.'''
+    resource_ids = list(resource_ids)
+    if not resource_ids:
+        return
+    _delete_where(session, resource_acl_table.c.resource_id.in_(resource_ids))
+    commit_acl_changes(resource_ids, session, commit)
+
+
+def forget_packages(session, package_ids, commit=False):
+    '''Delete the acls of purged datasets applying to all their resources.
+    The acls of their resources go with the resources, which are purged
+    along.
+    '''
+    package_ids = list(package_ids)
+    if not package_ids:
+        return
+    acl = resource_acl_table
+    _delete_where(session, and_(package_scope_clause(acl),
+                                acl.c.package_id.in_(package_ids)))
+    commit_acl_changes([], session, commit, package_ids)
+
+
+def forget_principals(session, auth_type, auth_ids, commit=False):
+    '''Delete the acls of purged users, organizations or groups.'''
+    auth_ids = list(auth_ids)
+    if not auth_ids:
+        return
+    acl = resource_acl_table
+    resource_ids, package_ids = _delete_where(
+        session, and_(acl.c.auth_type == auth_type,
+                      acl.c.auth_id.in_(auth_ids)))
+    commit_acl_changes(resource_ids, session, commit, package_ids)
+
+
+def _pending(session):
+    return session.info.setdefault(PENDING_KEY, {
+        'user': set(),
+        'org': set(),
+        'group': set(),
+        'resource': set(),
+        'package': set()
+    })
+
+
+def _principal_type(target):
+    if isinstance(target, model.User):
+        return 'user'
+    if isinstance(target, model.Group):
+        return 'org' if target.is_organization else 'group'
+
+
+def _purged(mapper, connection, target):
+    # the deletes of the actions only change the state, which can be
+    # reverted, the acls are kept until the purge
+    session = object_session(target)
+    if session is None:
+        return
+    if isinstance(target, model.Package):
+        kind = 'package'
+    elif isinstance(target, model.Resource):
+        kind = 'resource'
+    else:
+        kind = _principal_type(target)
+    _pending(session)[kind].add(target.id)
+
+
+def _before_commit(session):
+    session.flush()
+    pending = session.info.pop(PENDING_KEY, None)
+    if pending:
+        for auth_type in ('user', 'org', 'group'):
+            forget_principals(session, auth_type, pending[auth_type])
+        forget_resources(session, pending['resource'])
+        forget_packages(session, pending['package'])
+
+
+def listen():
+    '''Delete the acls of users, organizations, groups, datasets and
+    resources when they are purged. Deleted ones keep their acls, which no
+    longer apply, until they are purged or vacuum is run, so that they get
+    them back when restored.
+    '''
+    if event.contains(model.Session, 'before_commit', _before_commit):
+        return
+    for domain_object in (model.User, model.Group, model.Package,
+                          model.Resource):
+        event.listen(domain_object, 'after_delete', _purged)
+    event.listen(model.Session, 'before_commit', _before_commit)
+
+
+def orphan_clauses():
+    '''Return, by kind, the clauses matching the acls left behind by deleted
+    or purged resources, datasets, users, organizations and groups.
+    '''
+    acl = resource_acl_table
+    resource = model.resource_table
+    package = model.package_table
+    user = model.user_table
+    group = model.group_table
+    live_resource = exists().where(
+        and_(resource.c.id == acl.c.resource_id, resource.c.state == 'active',
+             package.c.id == resource.c.package_id,
+             package.c.state != 'deleted'))
+    live_package = exists().where(
+        and_(package.c.id == acl.c.package_id, package.c.state != 'deleted'))
+    live_user = exists().where(
+        and_(user.c.id == acl.c.auth_id, user.c.state != 'deleted'))
+    live_organization = exists().where(
+        and_(group.c.id == acl.c.auth_id, group.c.state != 'deleted',
+             group.c.is_organization == True))
+    live_group = exists().where(
+        and_(group.c.id == acl.c.auth_id, group.c.state != 'deleted',
+             group.c.is_organization == False))
+    return [
+        ('resource', and_(acl.c.resource_id != None, ~live_resource)),
+        ('package', and_(package_scope_clause(acl), ~live_package)),
+        ('user', and_(acl.c.auth_type == 'user', ~live_user)),
+        ('org', and_(acl.c.auth_type == 'org', ~live_organization)),
+        ('group', and_(acl.c.auth_type == 'group', ~live_group)),
+    ]
+
+
+def vacuum(session, batch_size=1000, dry_run=False, progress=None):
+    '''Delete the orphan acls, batch_size at a time with a commit after each
+    batch, so that existing deployments can be cleaned up while in use.
+
+    Returns the number of orphans found per kind.
+    '''
+    acl = resource_acl_table
+    totals = {}
+    for kind, clause in orphan_clauses():
+        totals[kind] = 0
+        if dry_run:
+            totals[kind] = session.execute(
+                select([func.count()]).where(clause)).scalar()
+            continue
+        while True:
+            rows = session.execute(
+                select([acl.c.id, acl.c.resource_id,
+                        acl.c.package_id]).where(clause).limit(
+                            batch_size)).fetchall()
+            if not rows:
+                break
+            batch = acl.c.id.in_([row[0] for row in rows])
+            record_history('delete', batch, u'', session)
+            session.execute(acl.delete().where(batch))
+            commit_acl_changes([row[1] for row in rows], session,
+                               package_ids=[row[2] for row in rows])
+            totals[kind] += len(rows)
+            if progress:
+                progress(sum(totals.values()), totals)
+    return totals
+
+
+def sweep_expired(session, batch_size=1000, archive=False, progress=None):
+    '''Delete the acls whose validity period is over, batch_size at a time
+    with a commit after each batch, moving them to resource_acl_archive
+    first when archive is set.
+
+    Returns the number of swept acls.
+    '''
+    acl = resource_acl_table
+    expired = and_(acl.c.valid_until != None,
+                   acl.c.valid_until <= datetime.datetime.utcnow())
+    swept = 0
+    while True:
+        rows = session.execute(
+            select([acl.c.id, acl.c.resource_id,
+                    acl.c.package_id]).where(expired).limit(
+                        batch_size)).fetchall()
+        if not rows:
+            break
+        ids = [row[0] for row in rows]
+        if archive:
+            columns = [c.name for c in acl.columns]
+            session.execute(resource_acl_archive_table.insert().from_select(
+                columns, select(list(acl.columns)).where(acl.c.id.in_(ids))))
+        record_history('expire', acl.c.id.in_(ids), u'', session)
+        session.execute(acl.delete().where(acl.c.id.in_(ids)))
+        commit_acl_changes([row[1] for row in rows], session,
+                           package_ids=[row[2] for row in rows])
+        swept += len(rows)
+        if progress:
+            progress(swept, {'swept': swept})
+    return swept
+
+
+def prune_history(session, before, batch_size=1000, progress=None):
+    '''Delete the history of the acl changes made before the given time.
+
+    When resource_acl_history is partitioned, the partitions of the months
+    ending before that time are dropped, whatever their size, and the
+    partitions of the coming months are created. The older changes left,
+    all in a single partition then, are deleted batch_size at a time with
+    a commit after each batch.
+
+    Returns the number of dropped partitions and of deleted changes.
+    '''
+    history = resource_acl_history_table
+    dropped = 0
+    if history_partitioned(session):
+        for name, start in history_partitions(session):
+            if month_start(start, 1) <= before:
+                drop_history_partition(session, name)
+                dropped += 1
+        create_history_partitions(session, datetime.datetime.utcnow())
+        session.commit()
+    deleted = 0
+    while True:
+        rows = session.execute(
+            select([history.c.id]).where(history.c.changed < before).limit(
+                batch_size)).fetchall()
+        if not rows:
+            break
+        session.execute(history.delete().where(
+            and_(history.c.changed < before,
+                 history.c.id.in_([row[0] for row in rows]))))
+        session.commit()
+        deleted += len(rows)
+        if progress:
+            progress(deleted, {'deleted': deleted})
+    return dropped, deleted
@@ -1,43 +1,230 @@
+import base64
 import datetime
+import json
 
+from sqlalchemy import and_, or_, select
+
+from ckan.common import config
+from ckan.plugins.toolkit import asbool
 from ckan.logic import side_effect_free, check_access, get_or_bust
 from ckan.logic import NotFound, ValidationError
 
 from ckan.lib.navl.dictization_functions import validate
+import ckan.lib.datapreview as datapreview
+import ckan.lib.dictization.model_dictize as model_dictize
 
 from ckanext.resourceauthorizer.logic.schema import resource_acl_create_schema
 from ckanext.resourceauthorizer.logic.schema import resource_acl_update_schema
 from ckanext.resourceauthorizer.logic.schema import resource_acl_patch_schema
-
+from ckanext.resourceauthorizer.logic.schema import resource_acl_list_schema
+from ckanext.resourceauthorizer.logic.schema import (
+    resource_acl_history_list_schema)
+from ckanext.resourceauthorizer.logic.schema import (
+    resource_authorize_many_schema)
+from ckanext.resourceauthorizer.logic.schema import (
+    resource_view_list_many_schema)
+from ckanext.resourceauthorizer.logic.auth import READ_RANK
+from ckanext.resourceauthorizer.logic.auth import PRINCIPAL_TIERS
+from ckanext.resourceauthorizer.logic.auth import principal_clause
+from ckanext.resourceauthorizer.logic.auth import resource_authorizations
+from ckanext.resourceauthorizer.logic.auth import memoized_authorizations
+
+from ckanext.resourceauthorizer import jobs
+from ckanext.resourceauthorizer import metrics
+from ckanext.resourceauthorizer.changes import commit_acl_changes
 from ckanext.resourceauthorizer.model import ResourceAcl
+from ckanext.resourceauthorizer.model import resource_acl_table
+from ckanext.resourceauthorizer.model import resource_acl_history_table
+from ckanext.resourceauthorizer.model import valid_clause
+from ckanext.resourceauthorizer.model import package_scope_clause
+from ckanext.resourceauthorizer.model import principal_key
+from ckanext.resourceauthorizer.model import insert_acls
+from ckanext.resourceauthorizer.model import update_acls
+from ckanext.resourceauthorizer.model import delete_acls
+from ckanext.resourceauthorizer.model import record_history
+from ckanext.resourceauthorizer.principal import (cache_stats, get_principal,
+                                                  reset_cache_stats)
+
+
+def _check_unique_principal(resource_id, auth_type, auth_id, acl=None,
+                            package_id=None):
+    existing = ResourceAcl.find(resource_id, auth_type, auth_id, package_id)
+    if existing and existing is not acl:
+        raise ValidationError({
+            'auth_id': [
+                'acl <{id}> already exists for this {auth_type}.'.format(
+                    id=existing.id, auth_type=auth_type)
+            ]
+        })
+
+
+CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _encode_cursor(time, id):
+    return base64.urlsafe_b64encode(
+        json.dumps([time.strftime(CURSOR_DATE_FORMAT), id]))
+
+
+def _decode_cursor(cursor):
+    try:
+        time, id = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        time = datetime.datetime.strptime(time, CURSOR_DATE_FORMAT)
+    except (TypeError, ValueError):
+        raise ValidationError({'cursor': ['Invalid cursor']})
+    return time, id
+
+
+def _max_limit():
+    return int(
+        config.get('ckanext.resourceauthorizer.acl_list_max_limit', 1000))
 
 
 @side_effect_free
 def resource_acl_list(context, data_dict):
-    '''Return the list of acls for a particular resource
+    '''Return the list of acls for a particular resource, ordered by
+    creation time
+
+    Without ``cursor`` nor ``include_total``, the result is the list of
+    all the matching acls, or of the first ``limit`` ones. Pass ``cursor``
+    (empty for the first page) to page through the acls with a cursor, the
+    result is then a dictionary with the ``results``, the ``next_cursor``
+    to request the following page (None on the last page) and, when
+    ``include_total`` is true, the total ``count``.
 
     :param resource_id: the id of the resource
-    :param limit: the number of returning results
-    :param offset: the offset to start returning results from
+    :param package_id: the id of the dataset, to list the acls applying to
+        all its resources instead
+    :param auth_type: only return the acls of this auth type (optional)
+    :param auth_id: only return the acls of this user or organization
+        (optional)
+    :param permission: only return the acls with this permission (optional)
+    :param limit: the number of returning results; pages hold at most
+        ``ckanext.resourceauthorizer.acl_list_max_limit`` (default: 1000)
+        acls
+    :param offset: the offset to start returning results from, prefer
+        ``cursor`` which does not slow down on deep pages
+    :param cursor: the ``next_cursor`` returned with the previous page
+    :param include_total: also return the total number of matching acls
     '''
     check_access('resource_acl_list', context, data_dict)
 
-    resource_id = data_dict.get('resource_id')
-    limit = data_dict.get('limit')
-    offset = data_dict.get('offset')
+    data, errors = validate(data_dict, resource_acl_list_schema(), context)
+
+    if errors:
+        raise ValidationError(errors)
+
     session = context['session']
     query = session.query(ResourceAcl)
 
-    if resource_id:
-        query = query.filter(ResourceAcl.resource_id == resource_id)
-    if limit:
-        query = query.limit(int(limit))
-    if offset:
-        query = query.offset(int(offset))
+    for field in ('resource_id', 'package_id', 'auth_type', 'auth_id',
+                  'permission'):
+        if data.get(field):
+            query = query.filter(
+                getattr(ResourceAcl, field) == data[field])
+
+    total = query.count() if data.get('include_total') else None
+    paged = 'cursor' in data_dict or total is not None
+
+    cursor = data.get('cursor')
+    if cursor:
+        created, id = _decode_cursor(cursor)
+        query = query.filter(
+            or_(ResourceAcl.created > created,
+                and_(ResourceAcl.created == created, ResourceAcl.id > id)))
+    query = query.order_by(ResourceAcl.created, ResourceAcl.id)
+    if data.get('offset'):
+        query = query.offset(data['offset'])
+
+    if not paged:
+        # the whole list, unless the caller limits it
+        if data.get('limit'):
+            query = query.limit(data['limit'])
+        return [acl.as_dict() for acl in query]
+
+    max_limit = _max_limit()
+    limit = min(data.get('limit') or max_limit, max_limit)
+    acls = query.limit(limit + 1).all()
+    has_more = len(acls) > limit
+    acls = acls[:limit]
+    results = [acl.as_dict() for acl in acls]
+
+    result = {
+        'results': results,
+        'next_cursor':
+        _encode_cursor(acls[-1].created, acls[-1].id) if has_more else None
+    }
+    if total is not None:
+        result['count'] = total
+    return result
 
-    acls = query.all()
 
-    return [acl.as_dict() for acl in acls]
+@side_effect_free
+def resource_acl_history_list(context, data_dict):
+    '''Return the recorded changes of the resource acls, oldest first, by
+    pages
+
+    Every creation, update and deletion of an acl is recorded with the
+    values of the acl after the change (before it for deletions). The
+    result is a dictionary with the ``results`` and the ``next_cursor`` to
+    request the following page (None on the last page).
+
+    :param resource_id: only return the changes of the acls of this
+        resource, required unless sysadmin (optional)
+    :param package_id: only return the changes of the acls applying to all
+        the resources of this dataset, required unless sysadmin (optional)
+    :param acl_id: only return the changes of this acl (optional)
+    :param auth_type: only return the changes of acls of this auth type
+        (optional)
+    :param auth_id: only return the changes of acls of this user,
+        organization or group (optional)
+    :param since: only return the changes made at or after this UTC time
+        (optional)
+    :param until: only return the changes made before this UTC time
+        (optional)
+    :param limit: the number of returning results, at most
+        ``ckanext.resourceauthorizer.acl_list_max_limit`` (default: 1000)
+    :param cursor: the ``next_cursor`` returned with the previous page
+    '''
+    check_access('resource_acl_history_list', context, data_dict)
+
+    data, errors = validate(data_dict, resource_acl_history_list_schema(),
+                            context)
+
+    if errors:
+        raise ValidationError(errors)
+
+    max_limit = _max_limit()
+    limit = min(data.get('limit') or max_limit, max_limit)
+    history = resource_acl_history_table
+    clauses = []
+
+    for field in ('resource_id', 'package_id', 'acl_id', 'auth_type',
+                  'auth_id'):
+        if data.get(field):
+            clauses.append(history.c[field] == data[field])
+    if data.get('since'):
+        clauses.append(history.c.changed >= data['since'])
+    if data.get('until'):
+        clauses.append(history.c.changed < data['until'])
+
+    if data.get('cursor'):
+        changed, id = _decode_cursor(data['cursor'])
+        clauses.append(
+            or_(history.c.changed > changed,
+                and_(history.c.changed == changed, history.c.id > id)))
+
+    rows = context['session'].execute(
+        select([history]).where(and_(*clauses)).order_by(
+            history.c.changed, history.c.id).limit(limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return {
+        'results': [_row_dict(dict(row)) for row in rows],
+        'next_cursor':
+        _encode_cursor(rows[-1].changed, rows[-1].id) if has_more else None
+    }
 
 
 @side_effect_free
@@ -48,36 +235,29 @@ def resource_list_for_user(context, data_dict):
     '''
     check_access('resource_list_for_user', context, data_dict)
 
-    user = context['user']
     model = context['model']
-    userobj = model.User.get(user)
-
-    if userobj:
-        user_id = userobj.id
-        user_acls = model.Session.query(ResourceAcl).filter(
-            ResourceAcl.auth_id == user_id).all()
-        user_acl = [acl.as_dict() for acl in user_acls]
-
-        org_ids = userobj.get_group_ids('organization')
-        org_acls = model.Session.query(ResourceAcl).filter(
-            ResourceAcl.auth_id.in_(org_ids),
-            ResourceAcl.permission != 'none').all()
-
-        resources = []
-        none_resources = []
-        for user_acl in user_acls:
-            if user_acl.permission != 'none':
-                resources.append(user_acl)
-            else:
-                none_resources.append(user_acl.resource_id)
-
-        for org_acl in org_acls:
-            if org_acl.resource_id not in none_resources:
-                resources.append(org_acl)
-
-        return [acl.as_dict() for acl in resources]
-
-    return []
+    principal = get_principal(context)
+
+    acls = model.Session.query(ResourceAcl).filter(
+        principal_clause(principal),
+        valid_clause(resource_acl_table, datetime.datetime.utcnow())).all()
+    by_resource = {}
+    for acl in acls:
+        # the acls of a dataset are grouped apart from those of its resources
+        by_resource.setdefault((acl.resource_id, acl.package_id),
+                               []).append(acl)
+
+    # the acls of the first tier having some for the resource decide
+    resources = []
+    for resource_acls in by_resource.values():
+        for tier in PRINCIPAL_TIERS:
+            tier_acls = [a for a in resource_acls if a.auth_type in tier]
+            if tier_acls:
+                resources.extend(a for a in tier_acls
+                                 if a.permission_rank >= READ_RANK)
+                break
+
+    return [acl.as_dict() for acl in resources]
 
 
 @side_effect_free
@@ -92,6 +272,7 @@ def resource_acl_show(context, data_dict):
     if not acl: raise NotFound('acl <{id}> was not found.'.format(id=reference))
 
     data_dict['resource_id'] = acl.resource_id
+    data_dict['package_id'] = acl.package_id
     check_access('resource_acl_show', context, data_dict)
 
     return acl.as_dict()
@@ -101,9 +282,16 @@ def resource_acl_create(context, data_dict):
     '''Append a new resource acl to the list of resource acls
 
     :param resource_id: the id of the resource
-    :param auth_type: user, org
-    :param auth_id: the id of user or organization
-    :param permission: none, read
+    :param package_id: the id of the dataset, instead of resource_id, for
+        an acl applying to all its resources; the acls of a resource take
+        precedence over those of its dataset
+    :param auth_type: user, org, group, sysadmin, authenticated or
+        anonymous
+    :param auth_id: the id of the user, organization or group, not needed
+        for the roles (sysadmin, authenticated and anonymous)
+    :param permission: none, read, download, write, manage
+    :param valid_from: the UTC time the acl starts applying at (optional)
+    :param valid_until: the UTC time the acl stops applying at (optional)
     '''
     check_access('resource_acl_create', context, data_dict)
 
@@ -112,14 +300,24 @@ def resource_acl_create(context, data_dict):
     if errors:
         raise ValidationError(errors)
 
+    _check_unique_principal(
+        data.get('resource_id'), data.get('auth_type'), data.get('auth_id'),
+        package_id=data.get('package_id'))
+
     acl = ResourceAcl(
         resource_id=data.get('resource_id'),
+        package_id=data.get('package_id'),
         auth_type=data.get('auth_type'),
         auth_id=data.get('auth_id'),
         permission=data.get('permission'),
+        valid_from=data.get('valid_from'),
+        valid_until=data.get('valid_until'),
         creator_user_id=context.get('user'))
 
-    acl.save()
+    acl.add()
+    context['session'].flush()
+    record_history('create', resource_acl_table.c.id == acl.id)
+    commit_acl_changes([acl.resource_id], package_ids=[acl.package_id])
 
     return acl.as_dict()
 
@@ -135,20 +333,27 @@ def resource_acl_delete(context, data_dict):
     if not acl: raise NotFound('acl <{id}> was not found.'.format(id=reference))
 
     data_dict['resource_id'] = acl.resource_id
+    data_dict['package_id'] = acl.package_id
 
     check_access('resource_acl_delete', context, data_dict)
 
+    record_history('delete', resource_acl_table.c.id == acl.id,
+                   context.get('user'))
     acl.delete()
-    acl.commit()
+    commit_acl_changes([acl.resource_id], package_ids=[acl.package_id])
 
 
 def resource_acl_update(context, data_dict):
     '''Update the resource acl
 
     :param id: the id of the resource acl
-    :param auth_type: user, org
-    :param auth_id: the id of user or organization
-    :param permission: none, read
+    :param auth_type: user, org, group, sysadmin, authenticated or
+        anonymous
+    :param auth_id: the id of the user, organization or group, not needed
+        for the roles (sysadmin, authenticated and anonymous)
+    :param permission: none, read, download, write, manage
+    :param valid_from: the UTC time the acl starts applying at (optional)
+    :param valid_until: the UTC time the acl stops applying at (optional)
     '''
     reference = get_or_bust(data_dict, 'id')
     acl = ResourceAcl.get(reference)
@@ -156,6 +361,7 @@ def resource_acl_update(context, data_dict):
     if not acl: raise NotFound('acl <{id}> was not found.'.format(id=reference))
 
     data_dict['resource_id'] = acl.resource_id
+    data_dict['package_id'] = acl.package_id
 
     check_access('resource_acl_update', context, data_dict)
 
@@ -164,13 +370,20 @@ def resource_acl_update(context, data_dict):
     if errors:
         raise ValidationError(errors)
 
+    _check_unique_principal(acl.resource_id, data.get('auth_type'),
+                            data.get('auth_id'), acl, acl.package_id)
+
     acl.auth_type = data.get('auth_type')
     acl.auth_id = data.get('auth_id')
     acl.permission = data.get('permission')
+    acl.valid_from = data.get('valid_from')
+    acl.valid_until = data.get('valid_until')
     acl.last_modified = datetime.datetime.utcnow()
     acl.modifier_user_id = context.get('user')
+    context['session'].flush()
+    record_history('update', resource_acl_table.c.id == acl.id)
 
-    acl.commit()
+    commit_acl_changes([acl.resource_id], package_ids=[acl.package_id])
 
     return acl.as_dict()
 
@@ -179,9 +392,15 @@ def resource_acl_patch(context, data_dict):
     '''Patch the resource acl
 
     :param id: the id of the resource acl
-    :param auth_type: user, org
-    :param auth_id: the id of user or organization
-    :param permission: none, read
+    :param auth_type: user, org, group, sysadmin, authenticated or
+        anonymous
+    :param auth_id: the id of the user, organization or group, not needed
+        for the roles (sysadmin, authenticated and anonymous)
+    :param permission: none, read, download, write, manage
+    :param valid_from: the UTC time the acl starts applying at (optional,
+        an empty string clears it)
+    :param valid_until: the UTC time the acl stops applying at (optional,
+        an empty string clears it)
     '''
     reference = get_or_bust(data_dict, 'id')
     acl = ResourceAcl.get(reference)
@@ -189,6 +408,7 @@ def resource_acl_patch(context, data_dict):
     if not acl: raise NotFound('acl <{id}> was not found.'.format(id=reference))
 
     data_dict['resource_id'] = acl.resource_id
+    data_dict['package_id'] = acl.package_id
 
     check_access('resource_acl_patch', context, data_dict)
 
@@ -197,12 +417,393 @@ def resource_acl_patch(context, data_dict):
     if errors:
         raise ValidationError(errors)
 
+    _check_unique_principal(acl.resource_id,
+                            data.get('auth_type', acl.auth_type),
+                            data.get('auth_id', acl.auth_id), acl,
+                            acl.package_id)
+
     acl.auth_type = data.get('auth_type', acl.auth_type)
     acl.auth_id = data.get('auth_id', acl.auth_id)
     acl.permission = data.get('permission', acl.permission)
+    acl.valid_from = data.get('valid_from', acl.valid_from)
+    acl.valid_until = data.get('valid_until', acl.valid_until)
     acl.last_modified = datetime.datetime.utcnow()
     acl.modifier_user_id = context.get('user')
+    context['session'].flush()
+    record_history('update', resource_acl_table.c.id == acl.id)
 
-    acl.commit()
+    commit_acl_changes([acl.resource_id], package_ids=[acl.package_id])
 
     return acl.as_dict()
+
+
+@side_effect_free
+def resource_authorize_many(context, data_dict):
+    '''Return whether the user has a permission, read by default, on each
+    resource, in a fixed number of queries, as a dict mapping resource ids
+    to true or false.
+
+    :param resource_ids: the ids of the resources (optional)
+    :param package_ids: the ids of datasets, to check all of their
+        resources (optional)
+    :param user: the name or id of the user to check the access of, other
+        users than oneself require sysadmin rights (optional)
+    :param permission: the permission to check, one of read (default),
+        download, write and manage
+    '''
+    check_access('resource_authorize_many', context, data_dict)
+
+    data, errors = validate(data_dict, resource_authorize_many_schema(),
+                            context)
+
+    if errors:
+        raise ValidationError(errors)
+
+    if not data.get('resource_ids') and not data.get('package_ids'):
+        raise ValidationError({'resource_ids': ['Missing value']})
+
+    model = context['model']
+    user = data.get('user') or context.get('user')
+    if user != context.get('user') and not model.User.get(user):
+        raise NotFound('user <{user}> was not found.'.format(user=user))
+
+    user_context = {
+        'model': model,
+        'session': context['session'],
+        'user': user
+    }
+    return resource_authorizations(
+        user_context, data.get('resource_ids', []),
+        data.get('package_ids', []), data.get('permission', 'read'))
+
+
+@side_effect_free
+def resource_view_list_many(context, data_dict):
+    '''Return the views of many resources as a dict mapping resource ids to
+    lists of views, like resource_view_list, leaving out the resources the
+    user is not allowed to see.
+
+    The resources are authorized together and their views loaded by a
+    single query, whatever their number.
+
+    :param resource_ids: the ids of the resources (optional)
+    :param package_ids: the ids of datasets, to list the views of all of
+        their resources (optional)
+    '''
+    check_access('resource_view_list_many', context, data_dict)
+
+    data, errors = validate(data_dict, resource_view_list_many_schema(),
+                            context)
+
+    if errors:
+        raise ValidationError(errors)
+
+    if not data.get('resource_ids') and not data.get('package_ids'):
+        raise ValidationError({'resource_ids': ['Missing value']})
+
+    model = context['model']
+    authorizations = memoized_authorizations(
+        context, data.get('resource_ids', []), data.get('package_ids', []))
+    views = dict((resource_id, []) for resource_id, allowed in
+                 authorizations.items() if allowed)
+    if not views:
+        return views
+
+    # the resources are loaded along, resource_view_dictize looks them up
+    rows = model.Session.query(model.ResourceView, model.Resource).join(
+        model.Resource,
+        model.Resource.id == model.ResourceView.resource_id).filter(
+            model.ResourceView.resource_id.in_(list(views))).order_by(
+                model.ResourceView.resource_id,
+                model.ResourceView.order).all()
+    for view, _ in rows:
+        if datapreview.get_view_plugin(view.view_type):
+            views[view.resource_id].append(view)
+    return dict(
+        (resource_id,
+         model_dictize.resource_view_list_dictize(resource_views, context))
+        for resource_id, resource_views in views.items())
+
+
+@side_effect_free
+def resource_acl_job_status(context, data_dict):
+    '''Return the status of a background job applying acls, queued by a
+    bulk action called with background
+
+    :param id: the id of the job
+    :returns: the ``id``, ``title``, ``created`` time, ``status`` (queued,
+        started, finished or failed) and ``user`` of the job and, once it
+        started, its progress: the ``stage`` (applying, reindexing,
+        finished or failed), the ``total`` number of acls, the number
+        ``done`` and ``failed``, the ``errors`` of the first failed ones,
+        and the number of ``datasets`` to reindex and ``reindexed``
+    '''
+    id = get_or_bust(data_dict, 'id')
+    job = jobs.get_job(id)
+
+    if not job: raise NotFound('job <{id}> was not found.'.format(id=id))
+
+    status = jobs.job_status(job)
+    check_access('resource_acl_job_status', context, {
+        'id': id,
+        'user': status['user']
+    })
+    return status
+
+
+@side_effect_free
+def resource_authorizer_metrics(context, data_dict):
+    '''Return the metrics recorded by this process since it started, or
+    since the last reset. Requires ckanext.resourceauthorizer.metrics,
+    except for the hits and misses of the principal cache.
+
+    :param format: ``json`` (default) or ``prometheus`` for the text format
+    :param reset: reset the metrics after reading them (optional)
+    '''
+    check_access('resource_authorizer_metrics', context, data_dict)
+
+    snapshot = metrics.registry.snapshot()
+    principal_stats = cache_stats()
+    snapshot['counters']['principal_cache_hits'] = principal_stats['hits']
+    snapshot['counters']['principal_cache_misses'] = principal_stats['misses']
+    if asbool(data_dict.get('reset', False)):
+        metrics.registry.reset()
+        reset_cache_stats()
+    snapshot['enabled'] = metrics.enabled()
+    if data_dict.get('format') == 'prometheus':
+        return metrics.prometheus_text(snapshot)
+    return snapshot
+
+
+def _get_list(data_dict, key):
+    items = data_dict.get(key)
+    if not isinstance(items, list) or not items:
+        raise ValidationError({key: ['Missing value']})
+    return items
+
+
+def _check_dicts(items):
+    errors = [{} if isinstance(item, dict) else {'acl': ['Not a dictionary']}
+              for item in items]
+    if any(errors):
+        raise ValidationError({'acls': errors})
+
+
+def _validate_many(items, schema, context):
+    rows = []
+    errors = []
+    for item in items:
+        if not isinstance(item, dict):
+            rows.append({})
+            errors.append({'acl': ['Not a dictionary']})
+            continue
+        data, error = validate(item, schema, context)
+        rows.append(data)
+        errors.append(error)
+    return rows, errors
+
+
+def _check_unique_principals(rows, errors, session):
+    '''Flag the rows conflicting with an existing acl or with each other'''
+    resource_ids = set(row.get('resource_id') for row in rows)
+    package_ids = set(row.get('package_id') for row in rows)
+    existing = dict((principal_key(acl), acl.id) for acl in session.query(
+        ResourceAcl.id, ResourceAcl.resource_id, ResourceAcl.package_id,
+        ResourceAcl.auth_type, ResourceAcl.auth_id).filter(
+            or_(ResourceAcl.resource_id.in_(resource_ids - set([None])),
+                and_(package_scope_clause(resource_acl_table),
+                     ResourceAcl.package_id.in_(package_ids - set([None]))))))
+    seen = set()
+    for row, error in zip(rows, errors):
+        key = principal_key(row)
+        if existing.get(key, row.get('id')) != row.get('id') or key in seen:
+            error.setdefault('auth_id', []).append(
+                'an acl already exists for this {auth_type}.'.format(
+                    auth_type=row['auth_type']))
+        seen.add(key)
+
+
+def _row_dict(row):
+    return dict((key, value.isoformat()
+                 if isinstance(value, datetime.datetime) else value)
+                for key, value in row.items())
+
+
+def _finish_bulk(context, rows):
+    commit_acl_changes([row.get('resource_id') for row in rows],
+                       context['session'], not context.get('defer_commit'),
+                       [row.get('package_id') for row in rows])
+
+
+def _in_background(data_dict):
+    return asbool(data_dict.get('background', False))
+
+
+def _enqueue(context, operation, items):
+    return {
+        'job_id': jobs.enqueue_acl_changes(operation, items,
+                                           context.get('user')),
+        'total': len(items)
+    }
+
+
+def resource_acl_bulk_create(context, data_dict):
+    '''Append many resource acls at once, in a single transaction
+
+    The whole batch is validated first, nothing is written when an acl is
+    invalid or conflicts with an existing one.
+
+    :param acls: the acls to create, dictionaries with the resource_id or
+        package_id, auth_type, auth_id and permission as in
+        resource_acl_create
+    :param background: queue the acls to be applied by a background job,
+        in chunks of one transaction each, followed by the reindexing of
+        the datasets; invalid acls are then skipped and reported by
+        resource_acl_job_status (optional, default: false)
+    :returns: per acl, in the same order, ``{'id', 'success', 'acl'}``,
+        or ``{'job_id', 'total'}`` with background
+    '''
+    items = _get_list(data_dict, 'acls')
+    check_access('resource_acl_bulk_create', context, data_dict)
+
+    if _in_background(data_dict):
+        return _enqueue(context, 'create', items)
+
+    rows, errors = _validate_many(items, resource_acl_create_schema(),
+                                  context)
+    if not any(errors):
+        _check_unique_principals(rows, errors, context['session'])
+    if any(errors):
+        raise ValidationError({'acls': errors})
+
+    for row in rows:
+        row['creator_user_id'] = context.get('user')
+    insert_acls(rows)
+    _finish_bulk(context, rows)
+
+    return [{
+        'id': row['id'],
+        'success': True,
+        'acl': _row_dict(row)
+    } for row in rows]
+
+
+def resource_acl_bulk_update(context, data_dict):
+    '''Update many resource acls at once, in a single transaction
+
+    The whole batch is validated first, nothing is written when an acl is
+    invalid or conflicts with an existing one. Acls that do not exist are
+    reported in the results and skipped.
+
+    :param acls: dictionaries with the id of the acl and its new
+        auth_type, auth_id and permission as in resource_acl_update
+    :param background: queue the acls to be applied by a background job,
+        in chunks of one transaction each, followed by the reindexing of
+        the datasets; invalid acls are then skipped and reported by
+        resource_acl_job_status (optional, default: false)
+    :returns: per acl, in the same order, ``{'id', 'success', 'acl'}``, or
+        ``{'id', 'success', 'error'}`` for missing acls, or
+        ``{'job_id', 'total'}`` with background
+    '''
+    items = _get_list(data_dict, 'acls')
+    _check_dicts(items)
+    ids = [get_or_bust(item, 'id') for item in items]
+    session = context['session']
+    acls = dict((acl.id, acl) for acl in session.query(ResourceAcl).filter(
+        ResourceAcl.id.in_(set(ids))))
+
+    check_access('resource_acl_bulk_update', context, {
+        'acls': [{
+            'resource_id': acl.resource_id,
+            'package_id': acl.package_id
+        } for acl in acls.values()]
+    })
+
+    if _in_background(data_dict):
+        return _enqueue(context, 'update', items)
+
+    found = [item for item in items if item['id'] in acls]
+    rows, errors = _validate_many(found, resource_acl_update_schema(),
+                                  context)
+    for item, row in zip(found, rows):
+        row['id'] = item['id']
+        row['resource_id'] = acls[item['id']].resource_id
+        row['package_id'] = acls[item['id']].package_id
+    if not any(errors):
+        _check_unique_principals(rows, errors, session)
+    if any(errors):
+        raise ValidationError({'acls': errors})
+
+    now = datetime.datetime.utcnow()
+    changes = dict((row['id'], {
+        'id': row['id'],
+        'auth_type': row['auth_type'],
+        'auth_id': row['auth_id'],
+        'permission': row['permission'],
+        'valid_from': row.get('valid_from'),
+        'valid_until': row.get('valid_until'),
+        'last_modified': now,
+        'modifier_user_id': context.get('user')
+    }) for row in rows)
+    update_acls(changes.values())
+    _finish_bulk(context, rows)
+
+    results = []
+    for id in ids:
+        if id in changes:
+            acl = _row_dict(dict(acls[id].as_dict(), **changes[id]))
+            results.append({'id': id, 'success': True, 'acl': acl})
+        else:
+            results.append({
+                'id': id,
+                'success': False,
+                'error': 'acl <{id}> was not found.'.format(id=id)
+            })
+    return results
+
+
+def resource_acl_bulk_delete(context, data_dict):
+    '''Delete many resource acls at once, in a single transaction
+
+    Acls that do not exist are reported in the results and skipped.
+
+    :param ids: the ids of the resource acls
+    :param background: queue the acls to be applied by a background job,
+        in chunks of one transaction each, followed by the reindexing of
+        the datasets; invalid acls are then skipped and reported by
+        resource_acl_job_status (optional, default: false)
+    :returns: per id, in the same order, ``{'id', 'success'}``, with an
+        ``error`` for missing acls, or ``{'job_id', 'total'}`` with
+        background
+    '''
+    ids = _get_list(data_dict, 'ids')
+    if not all(isinstance(id, basestring) for id in ids):
+        raise ValidationError({'ids': ['Not a list of strings']})
+    session = context['session']
+    acls = dict((acl.id, {
+        'resource_id': acl.resource_id,
+        'package_id': acl.package_id
+    }) for acl in session.query(ResourceAcl.id, ResourceAcl.resource_id,
+                                ResourceAcl.package_id).filter(
+                                    ResourceAcl.id.in_(set(ids))))
+
+    check_access('resource_acl_bulk_delete', context,
+                 {'acls': acls.values()})
+
+    if _in_background(data_dict):
+        return _enqueue(context, 'delete', ids)
+
+    delete_acls(acls.keys(), user=context.get('user'))
+    _finish_bulk(context, acls.values())
+
+    results = []
+    for id in ids:
+        if id in acls:
+            results.append({'id': id, 'success': True})
+        else:
+            results.append({
+                'id': id,
+                'success': False,
+                'error': 'acl <{id}> was not found.'.format(id=id)
+            })
+    return results
@@ -1,3 +1,7 @@
+import datetime
+
+from sqlalchemy import and_, or_, case, func
+
 from ckan.plugins.toolkit import auth_allow_anonymous_access
 import ckan.plugins as p
 import ckan.authz as authz
@@ -5,71 +9,387 @@ import ckan.model as model
 import ckan.lib.dictization.model_dictize as model_dictize
 from ckan.logic.auth import (get_package_object, get_group_object,
                              get_resource_object)
-from ckanext.resourceauthorizer.model import ResourceAcl
+from ckanext.resourceauthorizer import effective
+from ckanext.resourceauthorizer import metrics
+from ckanext.resourceauthorizer.cache import get_cache
+from ckanext.resourceauthorizer.cache import request_authorizations
+from ckanext.resourceauthorizer.model import resource_acl_effective_table
+from ckanext.resourceauthorizer.model import permission_rank
+from ckanext.resourceauthorizer.model import resource_acl_table
+from ckanext.resourceauthorizer.model import bounded_clause, valid_clause
+from ckanext.resourceauthorizer.model import package_scope_clause
+from ckanext.resourceauthorizer.model import AUTH_TYPES
+from ckanext.resourceauthorizer.model import MEMBERSHIP_AUTH_TYPES
+from ckanext.resourceauthorizer.model import ROLE_AUTH_TYPES
+from ckanext.resourceauthorizer.principal import get_principal
 from ckan.logic.auth.get import package_show as ckan_package_show
 from ckan.logic.auth.get import resource_show as ckan_resource_show
+from ckan.logic.auth.update import package_update as ckan_package_update
 from ckan.logic.auth.update import resource_update as ckan_resource_update
 
 
-def has_user_record_for_resource(resource_id, user):
-    userobj = model.User.get(user)
+ACL_ALLOW = 'allow'
+ACL_DENY = 'deny'
+ACL_NO_RULE = 'no-rule'
+
+READ_RANK = permission_rank('read')
+
+# the acls of the first tier having some for the principal decide: the user
+# before their organizations and groups, before their roles
+PRINCIPAL_TIERS = [['user'], MEMBERSHIP_AUTH_TYPES, ROLE_AUTH_TYPES]
+
+# the acls of a resource decide before those of its dataset, whatever their
+# principals
+SCOPES = ['resource', 'package']
+
+
+def principal_clause(principal, table=resource_acl_table):
+    '''Match the acls of the table given to the principal, to its
+    organizations, groups or roles.
+    '''
+    clauses = []
+    for auth_type in AUTH_TYPES:
+        auth_ids = principal.auth_ids(auth_type)
+        if auth_ids:
+            clauses.append(
+                and_(table.c.auth_type == auth_type,
+                     table.c.auth_id.in_(auth_ids)))
+    return or_(*clauses)
+
+
+def acl_resource_join(resource=model.resource_table):
+    '''Join the resources with the acls applying to them, their own and
+    those of their dataset; both are found through an index.
+    '''
+    acl = resource_acl_table
+    return resource.join(
+        acl,
+        or_(acl.c.resource_id == resource.c.id,
+            and_(package_scope_clause(acl),
+                 acl.c.package_id == resource.c.package_id)))
+
+
+def _level_columns(permission, now, scopes=SCOPES):
+    # per scope and tier, 0: no acl applying now, 1: acl without the
+    # permission, 2: acl granting it
+    table = resource_acl_table
+    valid = valid_clause(table, now)
+    level = case(
+        [(and_(valid, table.c.permission_rank >= permission_rank(permission)),
+          2), (valid, 1)],
+        else_=0)
+    columns = []
+    for scope in scopes:
+        if scope == 'package':
+            in_scope = package_scope_clause(table)
+        else:
+            in_scope = ~package_scope_clause(table)
+        columns.extend(
+            func.max(
+                case([(and_(in_scope, table.c.auth_type.in_(tier)), level)],
+                     else_=0)) for tier in PRINCIPAL_TIERS)
+    return columns
+
+
+def _boundary_columns(now):
+    # the next times an acl starts and stops applying
+    table = resource_acl_table
+    return [
+        func.min(case([(table.c.valid_from > now, table.c.valid_from)])),
+        func.min(case([(table.c.valid_until > now, table.c.valid_until)])),
+    ]
+
+
+def _next_boundary(*times):
+    times = [t for t in times if t is not None]
+    return min(times) if times else None
+
+
+def _decide(*levels):
+    # the first scope and tier having an acl decides
+    for level in levels:
+        if level:
+            return ACL_ALLOW if level == 2 else ACL_DENY
+    return ACL_NO_RULE
+
+
+def resource_acl_decision(resource_id, principal, permission='read'):
+    '''Return whether the acls of a resource allow or deny the permission
+    to the principal, or ACL_NO_RULE when none of them applies.
+
+    The acls of the resource and of its dataset are evaluated together by
+    a single aggregate query.
+    '''
+    return resource_acl_decisions([resource_id], principal,
+                                  permission)[resource_id]
+
+
+def _effective_decisions(resource_ids, principal, permission):
+    # a single primary key lookup per resource in resource_acl_effective
+    table = resource_acl_effective_table
+    granted = table.c.permission_rank >= permission_rank(permission)
+    rows = model.Session.query(table.c.resource_id, granted).filter(
+        table.c.user_id == principal.id, table.c.resource_id.in_(resource_ids))
+    return dict((resource_id, ACL_ALLOW if allowed else ACL_DENY)
+                for resource_id, allowed in rows)
+
+
+def resource_acl_decisions(resource_ids, principal, permission='read'):
+    '''Batched resource_acl_decision, returns a dict keyed by resource id.
+
+    Decisions are served from the decision cache when it is enabled.
+    '''
+    decisions = dict.fromkeys(resource_ids, ACL_NO_RULE)
+    if principal is None or not decisions:
+        return decisions
+
+    cache = get_cache()
+    pending = list(decisions)
+    if cache is not None:
+        cached, keys = cache.get_decisions(principal.key, pending,
+                                           permission)
+        decisions.update(cached)
+        pending = list(keys)
+        metrics.record_cache(len(cached), len(pending))
+        if not pending:
+            return decisions
+
+    fresh = dict.fromkeys(pending, ACL_NO_RULE)
+    resource = model.resource_table
+    if effective.enabled() and principal.id:
+        # the resources having acls the effective table leaves out are
+        # decided from resource_acl
+        excluded = set(row[0] for row in model.Session.query(
+            resource.c.id).filter(
+                resource.c.id.in_(pending),
+                effective.excluded_resources_clause(resource)))
+        fresh.update(
+            _effective_decisions([r for r in pending if r not in excluded],
+                                 principal, permission))
+        pending = list(excluded)
+
+    boundaries = {}
+    if pending:
+        now = datetime.datetime.utcnow()
+        levels = _level_columns(permission, now)
+        rows = model.Session.query(
+            resource.c.id, *(levels + _boundary_columns(now))).select_from(
+                acl_resource_join(resource)).filter(
+                    resource.c.id.in_(pending),
+                    principal_clause(principal)).group_by(resource.c.id)
+        for row in rows:
+            resource_id = row[0]
+            fresh[resource_id] = _decide(*row[1:len(levels) + 1])
+            boundaries[resource_id] = _next_boundary(*row[len(levels) + 1:])
+    decisions.update(fresh)
 
-    if not userobj: return False
-    
-    user_id = userobj.id
-    org_ids = userobj.get_group_ids('organization')
-    acls = model.Session.query(ResourceAcl).filter(
-        ResourceAcl.resource_id == resource_id).all()
+    if cache is not None:
+        cache.set_decisions(keys, fresh, boundaries)
+    return decisions
 
-    for acl in acls:
-        if acl.auth_id == user_id and acl.auth_type == 'user':
-            return True
-        if acl.auth_id in org_ids and acl.auth_type == 'org':
-            return True
 
-    return False
+def _granted_resources_query(principal):
+    resource = model.resource_table
+    levels = [
+        func.nullif(level, 0)
+        for level in _level_columns('read', datetime.datetime.utcnow())
+    ]
+    query = model.Session.query(resource.c.id).select_from(
+        acl_resource_join(resource)).filter(
+            principal_clause(principal),
+            resource.c.state == 'active').group_by(resource.c.id).having(
+                func.coalesce(*levels) == 2)
+    if not effective.enabled() or not principal.id:
+        return query
 
+    # the effective table, completed for the resources having acls it
+    # leaves out
+    table = resource_acl_effective_table
+    excluded = effective.excluded_resources_clause(resource)
+    return model.Session.query(table.c.resource_id).join(
+        resource, resource.c.id == table.c.resource_id).filter(
+            table.c.user_id == principal.id,
+            table.c.permission_rank >= READ_RANK,
+            resource.c.state == 'active', ~excluded).union(
+                query.filter(excluded))
 
-def has_user_permission_for_resource(resource_id, user, permission):
-    userobj = model.User.get(user)
-    
-    if not userobj: return False
-    
-    user_id = userobj.id
-    org_ids = userobj.get_group_ids('organization')
-    permissions = ['read']
-    permissions = permissions[permissions.index(permission):]
-    acls = model.Session.query(ResourceAcl).filter(
-        ResourceAcl.resource_id == resource_id).all()
 
-    for acl in acls:
-        if acl.auth_id == user_id and acl.auth_type == 'user' and acl.permission in permissions:
-            return True
-        if acl.auth_id in org_ids and acl.auth_type == 'org' and acl.permission in permissions:
-            return True
+def _next_grant_boundary(principal):
+    table = resource_acl_table
+    starts, ends = model.Session.query(
+        *_boundary_columns(datetime.datetime.utcnow())).filter(
+            principal_clause(principal), bounded_clause(table)).one()
+    return _next_boundary(starts, ends)
 
-    return False
+
+def _cached_grants(principal, scope, query):
+    cache = get_cache()
+    if cache is not None:
+        ids, key = cache.get_grants(principal.key, scope)
+        if ids is not None:
+            return set(ids)
+
+    ids = set(row[0] for row in query(principal).distinct())
+
+    if cache is not None:
+        cache.set_grants(key, ids, _next_grant_boundary(principal))
+    return ids
+
+
+def granted_resource_ids(principal):
+    '''Return the ids of the resources the principal is granted by an acl,
+    leaving out those denied by an acl for the user.
+
+    Only distinct ids are selected, and the result is cached per user.
+    '''
+    return _cached_grants(principal, 'resources', _granted_resources_query)
+
+
+def granted_package_ids(principal):
+    '''Return the ids of the packages having at least one resource granted
+    to the principal, see granted_resource_ids.
+    '''
+
+    def query(principal):
+        granted = _granted_resources_query(principal).subquery()
+        return model.Session.query(model.Resource.package_id).filter(
+            model.Resource.id.in_(granted),
+            model.Resource.state == 'active')
+
+    return _cached_grants(principal, 'packages', query)
+
+
+def _granted_dataset_acls_query(principal):
+    table = resource_acl_table
+    levels = [
+        func.nullif(level, 0) for level in _level_columns(
+            'read', datetime.datetime.utcnow(), ['package'])
+    ]
+    return model.Session.query(table.c.package_id).filter(
+        package_scope_clause(table),
+        principal_clause(principal)).group_by(table.c.package_id).having(
+            func.coalesce(*levels) == 2)
+
+
+def granted_dataset_acl_package_ids(principal):
+    '''Return the ids of the packages whose own acls, those applying to all
+    their resources, grant the principal read, whatever the acls of their
+    resources.
+    '''
+    return _cached_grants(principal, 'dataset-acls',
+                          _granted_dataset_acls_query)
+
+
+def granted_resource_acl_ids(principal):
+    '''Return the ids of the resources granted to the principal, see
+    granted_resource_ids, but those of the packages granted by their own
+    acls, see granted_dataset_acl_package_ids.
+    '''
+
+    def query(principal):
+        granted = _granted_resources_query(principal).subquery()
+        dataset_acls = _granted_dataset_acls_query(principal).subquery()
+        return model.Session.query(model.Resource.id).filter(
+            model.Resource.id.in_(granted),
+            ~model.Resource.package_id.in_(dataset_acls))
+
+    return _cached_grants(principal, 'resource-acls', query)
+
+
+def has_user_record_for_resource(resource_id, user, context=None):
+    principal = get_principal(context, user)
+    return resource_acl_decision(resource_id, principal) != ACL_NO_RULE
+
+
+def has_user_permission_for_resource(resource_id, user, permission,
+                                     context=None):
+    principal = get_principal(context, user)
+    return resource_acl_decision(resource_id, principal,
+                                 permission) == ACL_ALLOW
 
 
 def resource_acl_create(context, data_dict):
-    '''Authorization check for creating a acl for a resource
+    '''Authorization check for creating a acl for a resource, allowed to
+    the editors of the dataset and to the users granted manage on it; the
+    acls of a whole dataset are allowed to its editors
     '''
     resource_id = data_dict.get('resource_id')
+    if not resource_id and data_dict.get('package_id'):
+        return ckan_package_update(context, {'id': data_dict['package_id']})
+    if resource_acl_decision(resource_id, get_principal(context),
+                             'manage') == ACL_ALLOW:
+        return {'success': True}
     return ckan_resource_update(context, {'id': resource_id})
 
 
+def resource_acl_bulk_create(context, data_dict):
+    '''Authorization check for creating acls for many resources, checked
+    once per distinct resource or dataset
+    '''
+    scopes = set((acl.get('resource_id'), acl.get('package_id'))
+                 for acl in data_dict.get('acls', [])
+                 if isinstance(acl, dict))
+    for resource_id, package_id in scopes:
+        # the objects cached in the context belong to a single resource
+        resource_context = dict(context)
+        resource_context.pop('resource', None)
+        resource_context.pop('package', None)
+        authorization = resource_acl_create(resource_context, {
+            'resource_id': resource_id,
+            'package_id': package_id
+        })
+        if not authorization['success']:
+            return authorization
+    return {'success': True}
+
+
+def resource_acl_bulk_update(context, data_dict):
+    '''Authorization check for updating acls of many resources
+    '''
+    return resource_acl_bulk_create(context, data_dict)
+
+
+def resource_acl_bulk_delete(context, data_dict):
+    '''Authorization check for deleting acls of many resources
+    '''
+    return resource_acl_bulk_create(context, data_dict)
+
+
 def resource_acl_list(context, data_dict):
     '''Authorization check for getting a list of acls for a resource
     '''
     return resource_acl_create(context, data_dict)
 
 
+def resource_acl_history_list(context, data_dict):
+    '''Authorization check for reading the history of the acls, allowed to
+    the managers of the resource or dataset when one is given, otherwise to
+    sysadmins
+    '''
+    if data_dict.get('resource_id') or data_dict.get('package_id'):
+        return resource_acl_create(context, data_dict)
+    return {'success': False}
+
+
+def resource_acl_job_status(context, data_dict):
+    '''Authorization check for following a background acl job, allowed to
+    the user who queued it
+    '''
+    return {'success': data_dict.get('user') == context.get('user')}
+
+
 def resource_list_for_user(context, data_dict):
     '''Authorization check for getting a list of resources for a user
     '''
     return {'success': True}
 
 
+def resource_authorizer_metrics(context, data_dict):
+    '''Authorization check for reading the metrics, only sysadmins
+    '''
+    return {'success': False}
+
+
 def resource_acl_show(context, data_dict):
     '''Authorization check for getting the information of the resource acl
     '''
@@ -101,30 +421,274 @@ def resource_show(context, data_dict):
     resource_id = data_dict.get('id')
     user = context.get('user')
 
-    if has_user_record_for_resource(resource_id, user):
-        if has_user_permission_for_resource(resource_id, user, 'read'):
-            return {'success': True}
-        return {'success': False}
+    decision = resource_acl_decision(resource_id,
+                                     get_principal(context, user), 'read')
+    if decision != ACL_NO_RULE:
+        return {'success': decision == ACL_ALLOW}
 
     resourceObj = get_resource_object(context, data_dict)
     packageObj = get_package_object(context, {'id': resourceObj.package_id})
     if packageObj.private:
-        userobj = model.User.get(user)
-        if userobj:
-            org_ids = userobj.get_group_ids('organization')
-            if packageObj.owner_org in org_ids:
+        principal = get_principal(context, user)
+        if principal:
+            if packageObj.owner_org in principal.org_ids:
                 return {'success': True}
             return {'success': False}
 
     return ckan_package_show(context, {'id': resourceObj.package_id})
 
+
+def _package_authorization(context, principal, package_id,
+                           package_dict=None):
+    # whether the resources without an acl for the user are visible, as
+    # resource_show decides it; public and organization datasets are
+    # decided from the package dict when there is one, like package_show
+    if package_dict:
+        if package_dict.get('state') == 'active':
+            if not package_dict.get('private'):
+                return True
+            if principal:
+                return package_dict.get('owner_org') in principal.org_ids
+        # the package cached in the context may be another one
+        context = dict(context)
+        context.pop('package', None)
+    packageObj = get_package_object(context, {'id': package_id})
+    if packageObj.private and principal:
+        return packageObj.owner_org in principal.org_ids
+    return ckan_package_show(context, {'id': package_id})['success']
+
+
+def _filter_resources(context, principal, packages, permission='read'):
+    # packages: (package_id, package_dict or None, resource_dicts) tuples,
+    # returns the visible resource dicts of every package, in order
+    if context.get('ignore_auth'):
+        return [resource_dicts for _, _, resource_dicts in packages]
+    if principal:
+        if principal.userobj.is_deleted():
+            return [[] for _ in packages]
+        if principal.sysadmin:
+            return [resource_dicts for _, _, resource_dicts in packages]
+
+    decisions = resource_acl_decisions(
+        [r['id'] for _, _, resource_dicts in packages for r in resource_dicts],
+        principal, permission)
+
+    results = []
+    for package_id, package_dict, resource_dicts in packages:
+        fallback = []
+        resources = []
+        for resource_dict in resource_dicts:
+            decision = decisions[resource_dict['id']]
+            if decision != ACL_NO_RULE:
+                if decision == ACL_ALLOW:
+                    resources.append(resource_dict)
+                continue
+            if not fallback:
+                fallback.append(
+                    _package_authorization(context, principal, package_id,
+                                           package_dict))
+            if fallback[0]:
+                resources.append(resource_dict)
+        results.append(resources)
+    return results
+
+
+def authorized_resources(context, package_id, resource_dicts):
+    '''Return the resources of a package that the user is allowed to see
+
+    This is the batched equivalent of calling ``authz.is_authorized`` with
+    ``resource_show`` for every resource of the package: the user, their
+    organizations and the acl decisions of all resources are loaded once.
+    '''
+    resource_dicts = list(resource_dicts)
+    if not resource_dicts:
+        return resource_dicts
+    resources = _filter_resources(context, get_principal(context),
+                                  [(package_id, None, resource_dicts)])[0]
+    memo = request_authorizations()
+    if memo is not None and not context.get('ignore_auth'):
+        # the views of the resources are checked next on dataset pages
+        user = context.get('user')
+        visible = set(resource_dict['id'] for resource_dict in resources)
+        for resource_dict in resource_dicts:
+            memo[(user, 'read', resource_dict['id'])] = \
+                resource_dict['id'] in visible
+    return resources
+
+
+def authorized_search_results(context, package_dicts):
+    '''Remove the resources the user is not allowed to see from the
+    package dicts of a search result page
+
+    The acl decisions of the resources of all the packages are taken at
+    once, and the package level fallback is decided from the package dicts.
+    '''
+    package_dicts = [
+        package_dict for package_dict in package_dicts
+        if package_dict.get('resources')
+    ]
+    if not package_dicts:
+        return
+    packages = [(package_dict['id'], package_dict, package_dict['resources'])
+                for package_dict in package_dicts]
+    results = _filter_resources(context, get_principal(context), packages)
+    for package_dict, resources in zip(package_dicts, results):
+        package_dict['resources'] = resources
+        package_dict['num_resources'] = len(resources)
+
+
+def resource_authorizations(context, resource_ids=(), package_ids=(),
+                            permission='read'):
+    '''Return whether the user has the permission on each resource, given
+    by id or through the id of its package, as a dict keyed by resource id
+
+    The resources and their packages are loaded by one query and the acl
+    decisions by another, whatever the number of resources; resources that
+    do not exist are not allowed, deleted ones are decided as resource_show
+    does and only the active resources of the packages are included.
+    '''
+    resource_ids = list(resource_ids)
+    package_ids = list(package_ids)
+    clauses = []
+    if resource_ids:
+        clauses.append(model.Resource.id.in_(resource_ids))
+    if package_ids:
+        clauses.append(and_(model.Resource.package_id.in_(package_ids),
+                            model.Resource.state == 'active'))
+    authorizations = dict.fromkeys(resource_ids, False)
+    if not clauses:
+        return authorizations
+
+    rows = model.Session.query(
+        model.Resource.id, model.Package.id, model.Package.state,
+        model.Package.private, model.Package.owner_org).join(
+            model.Package,
+            model.Package.id == model.Resource.package_id).filter(
+                or_(*clauses)).order_by(
+                    model.Resource.package_id, model.Resource.position)
+    packages = []
+    for resource_id, package_id, state, private, owner_org in rows:
+        authorizations[resource_id] = False
+        if not packages or packages[-1][0] != package_id:
+            package_dict = {
+                'id': package_id,
+                'state': state,
+                'private': private,
+                'owner_org': owner_org
+            }
+            packages.append((package_id, package_dict, []))
+        packages[-1][2].append({'id': resource_id})
+
+    results = _filter_resources(context, get_principal(context), packages,
+                                permission)
+    for resources in results:
+        for resource_dict in resources:
+            authorizations[resource_dict['id']] = True
+    return authorizations
+
+
+def memoized_authorizations(context, resource_ids=(), package_ids=(),
+                            permission='read'):
+    '''resource_authorizations, memoized for the current web request
+
+    Only the resources not checked yet for the user during the request are
+    loaded, so that the views of a resource or of a dataset are authorized
+    once however many of them are shown.
+    '''
+    memo = request_authorizations()
+    if memo is None:
+        return resource_authorizations(context, resource_ids, package_ids,
+                                       permission)
+    user = context.get('user')
+    resource_ids = list(resource_ids)
+    missing = [
+        resource_id for resource_id in resource_ids
+        if (user, permission, resource_id) not in memo
+    ]
+    authorizations = {}
+    if missing or package_ids:
+        authorizations = resource_authorizations(context, missing,
+                                                 package_ids, permission)
+        for resource_id, allowed in authorizations.items():
+            memo[(user, permission, resource_id)] = allowed
+    for resource_id in resource_ids:
+        authorizations[resource_id] = memo[(user, permission, resource_id)]
+    return authorizations
+
+
+def memoized_dataset_authorization(context, resource_id):
+    '''Return whether the user can see the dataset of the resource, as
+    package_show decides it, memoized for the current web request like
+    memoized_authorizations; None when there is no such resource.
+    '''
+    memo = request_authorizations()
+    key = (context.get('user'), 'package_show', resource_id)
+    if memo is not None and key in memo:
+        return memo[key]
+    resourceObj = model.Resource.get(resource_id) if resource_id else None
+    if resourceObj is None:
+        return None
+    # the package cached in the context may be another one
+    package_context = dict(context)
+    package_context.pop('package', None)
+    allowed = ckan_package_show(package_context,
+                                {'id': resourceObj.package_id})['success']
+    if memo is not None:
+        memo[key] = allowed
+    return allowed
+
+
+@p.toolkit.auth_allow_anonymous_access
+def resource_authorize_many(context, data_dict):
+    '''Authorization check for checking the access to many resources, for
+    oneself or, for sysadmins only, another user
+    '''
+    user = data_dict.get('user')
+    if user and user != context.get('user'):
+        return {'success': False}
+    return {'success': True}
+
+
+@p.toolkit.auth_allow_anonymous_access
+def resource_download(context, data_dict):
+    '''Authorization check for downloading the file of a resource, which
+    needs the download permission when an acl applies to the user
+    '''
+    decision = resource_acl_decision(data_dict.get('id'),
+                                     get_principal(context), 'download')
+    if decision != ACL_NO_RULE:
+        return {'success': decision == ACL_ALLOW}
+    return resource_show(context, data_dict)
+
+
 @p.toolkit.auth_allow_anonymous_access
 def resource_view_show(context, data_dict):
+    '''Authorization check for showing a view, allowed to the users who
+    can see its resource
+    '''
+    # resource_view_show puts the resource of the view in the context
     resourceObj = get_resource_object(context, data_dict)
-    return resource_show(context, {'id': resourceObj.id})
+    resource_id = resourceObj.id
+    return {
+        'success': memoized_authorizations(context, [resource_id])[resource_id]
+    }
 
 
 @p.toolkit.auth_allow_anonymous_access
 def resource_view_list(context, data_dict):
-    resourceObj = model.Resource.get(data_dict['id'])
-    return ckan_package_show(context, {'id': resourceObj.package_id})
+    '''Authorization check for listing the views of a resource, allowed to
+    the users who can see its dataset, as package_show decides it
+    '''
+    resource_id = data_dict.get('id')
+    allowed = memoized_dataset_authorization(context, resource_id)
+    if allowed is None:
+        return {'success': False, 'msg': 'Resource %s not found' % resource_id}
+    return {'success': allowed}
+
+
+@p.toolkit.auth_allow_anonymous_access
+def resource_view_list_many(context, data_dict):
+    '''Authorization check for listing the views of many resources, which
+    only lists those of the resources the user can see
+    '''
+    return {'success': True}
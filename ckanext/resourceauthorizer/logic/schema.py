@@ -1,16 +1,26 @@
-from ckan.logic.validators import resource_id_exists
+from ckan.logic.validators import (resource_id_exists, package_id_exists,
+                                   boolean_validator, natural_number_validator,
+                                   list_of_strings, isodate)
 from ckan.lib.navl.validators import not_empty, ignore_missing
 
 from ckanext.resourceauthorizer.logic.validators import auth_type_validator
+from ckanext.resourceauthorizer.logic.validators import acl_scope_validator
 from ckanext.resourceauthorizer.logic.validators import permission_validator
+from ckanext.resourceauthorizer.logic.validators import role_auth_id
+from ckanext.resourceauthorizer.logic.validators import (
+    validity_period_validator)
 
 
 def resource_acl_create_schema():
     schema = {
-        'resource_id': [resource_id_exists],
+        'resource_id': [ignore_missing, resource_id_exists],
+        'package_id': [ignore_missing, package_id_exists],
         'auth_type': [auth_type_validator, unicode],
-        'auth_id': [not_empty, unicode],
+        'auth_id': [role_auth_id, not_empty, unicode],
         'permission': [permission_validator, unicode],
+        'valid_from': [ignore_missing, isodate],
+        'valid_until': [ignore_missing, isodate],
+        '__after': [validity_period_validator, acl_scope_validator],
     }
     return schema
 
@@ -18,8 +28,11 @@ def resource_acl_create_schema():
 def resource_acl_update_schema():
     schema = {
         'auth_type': [auth_type_validator, unicode],
-        'auth_id': [not_empty, unicode],
+        'auth_id': [role_auth_id, not_empty, unicode],
         'permission': [permission_validator, unicode],
+        'valid_from': [ignore_missing, isodate],
+        'valid_until': [ignore_missing, isodate],
+        '__after': [validity_period_validator],
     }
     return schema
 
@@ -27,7 +40,58 @@ def resource_acl_update_schema():
 def resource_acl_patch_schema():
     schema = {
         'auth_type': [ignore_missing, auth_type_validator, unicode],
-        'auth_id': [ignore_missing, not_empty, unicode],
+        'auth_id': [role_auth_id, ignore_missing, not_empty, unicode],
         'permission': [ignore_missing, permission_validator, unicode],
+        'valid_from': [ignore_missing, isodate],
+        'valid_until': [ignore_missing, isodate],
+        '__after': [validity_period_validator],
+    }
+    return schema
+
+
+def resource_acl_list_schema():
+    schema = {
+        'resource_id': [ignore_missing, unicode],
+        'package_id': [ignore_missing, unicode],
+        'auth_type': [ignore_missing, auth_type_validator, unicode],
+        'auth_id': [ignore_missing, unicode],
+        'permission': [ignore_missing, permission_validator, unicode],
+        'limit': [ignore_missing, natural_number_validator],
+        'offset': [ignore_missing, natural_number_validator],
+        'cursor': [ignore_missing, unicode],
+        'include_total': [ignore_missing, boolean_validator],
+    }
+    return schema
+
+
+def resource_acl_history_list_schema():
+    schema = {
+        'resource_id': [ignore_missing, unicode],
+        'package_id': [ignore_missing, unicode],
+        'acl_id': [ignore_missing, unicode],
+        'auth_type': [ignore_missing, auth_type_validator, unicode],
+        'auth_id': [ignore_missing, unicode],
+        'since': [ignore_missing, isodate],
+        'until': [ignore_missing, isodate],
+        'limit': [ignore_missing, natural_number_validator],
+        'cursor': [ignore_missing, unicode],
+    }
+    return schema
+
+
+def resource_authorize_many_schema():
+    schema = {
+        'resource_ids': [ignore_missing, list_of_strings],
+        'package_ids': [ignore_missing, list_of_strings],
+        'permission': [ignore_missing, permission_validator, unicode],
+        'user': [ignore_missing, unicode],
+    }
+    return schema
+
+
+def resource_view_list_many_schema():
+    schema = {
+        'resource_ids': [ignore_missing, list_of_strings],
+        'package_ids': [ignore_missing, list_of_strings],
     }
     return schema
@@ -1,13 +1,39 @@
 from ckan.plugins.toolkit import Invalid
 
+from ckanext.resourceauthorizer.model import AUTH_TYPES, PERMISSIONS
+from ckanext.resourceauthorizer.model import ROLE_AUTH_ID, ROLE_AUTH_TYPES
+
 
 def auth_type_validator(value):
-    if not value in ['user', 'org']:
+    if not value in AUTH_TYPES:
         raise Invalid('Invalid auth_type %s' % (value))
     return value
 
 
+def role_auth_id(key, data, errors, context):
+    '''Set the auth_id of the acls given to a role, which have none.'''
+    if data.get(('auth_type', )) in ROLE_AUTH_TYPES:
+        data[key] = ROLE_AUTH_ID
+
+
+def validity_period_validator(key, data, errors, context):
+    valid_from = data.get(('valid_from', ))
+    valid_until = data.get(('valid_until', ))
+    if valid_from and valid_until and valid_from >= valid_until:
+        errors.setdefault(('valid_until', ), []).append(
+            'valid_until must be later than valid_from')
+
+
+def acl_scope_validator(key, data, errors, context):
+    '''Require either the resource or, for the acls applying to all its
+    resources, the dataset of the acl.
+    '''
+    if bool(data.get(('resource_id', ))) == bool(data.get(('package_id', ))):
+        errors.setdefault(('resource_id', ), []).append(
+            'Either resource_id or package_id is required')
+
+
 def permission_validator(value):
-    if not value in ['none', 'read']:
+    if not value in PERMISSIONS:
         raise Invalid('Invalid permission %s' % (value))
     return value
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+
+import ckan.model as model
+from ckan.common import config
+from ckan.plugins.toolkit import asbool
+
+from ckanext.resourceauthorizer.util import request_store
+
+log = logging.getLogger(__name__)
+
+ENVIRON_KEY = 'ckanext.resourceauthorizer.metrics'
+
+_state = {}
+
+
+def enabled():
+    '''Whether ckanext.resourceauthorizer.metrics is switched on.'''
+    if 'enabled' not in _state:
+        _state['enabled'] = asbool(
+            config.get('ckanext.resourceauthorizer.metrics', False))
+    return _state['enabled']
+
+
+class MetricsRegistry(object):
+    '''In-process counters and timing summaries, shared by all threads.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timings = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timing = self._timings.setdefault(name, {
+                'count': 0,
+                'sum': 0.0,
+                'max': 0.0
+            })
+            timing['count'] += 1
+            timing['sum'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'timings': dict((k, dict(v)) for k, v in self._timings.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+registry = MetricsRegistry()
+
+
+class RequestMetrics(object):
+    '''What the plugin cost a single request.'''
+
+    def __init__(self):
+        self.acl_queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.resources_filtered = 0
+        self.timings = {}
+
+    def as_dict(self):
+        return {
+            'acl_queries': self.acl_queries,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'resources_filtered': self.resources_filtered,
+            'auth_ms': dict((name, round(seconds * 1000, 3))
+                            for name, seconds in self.timings.items()),
+        }
+
+
+def current():
+    '''Return the metrics of the current web request, or None outside of
+    one: paster commands and background jobs only add to the registry, a
+    request never ends for them.
+    '''
+    return request_store(ENVIRON_KEY, RequestMetrics)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if 'resource_acl' in statement:
+        metrics = current()
+        if metrics is not None:
+            metrics.acl_queries += 1
+        registry.incr('acl_queries')
+
+
+def _listen():
+    if 'listening' not in _state:
+        event.listen(model.meta.engine, 'before_cursor_execute',
+                     _count_query)
+        _state['listening'] = True
+
+
+def instrumented(name, func):
+    '''Wrap an auth or action function to record the time spent in it and
+    the acl queries it issues. Attributes such as side_effect_free or
+    auth_allow_anonymous_access are preserved.
+    '''
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _listen()
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            metrics = current()
+            if metrics is not None:
+                metrics.timings[name] = metrics.timings.get(name,
+                                                            0.0) + elapsed
+            registry.observe(name, elapsed)
+
+    return wrapper
+
+
+def record_cache(hits, misses):
+    if enabled():
+        metrics = current()
+        if metrics is not None:
+            metrics.cache_hits += hits
+            metrics.cache_misses += misses
+        registry.incr('cache_hits', hits)
+        registry.incr('cache_misses', misses)
+
+
+def record_filtered(dataset_id, total, kept):
+    '''Record the resources filtered out of a dataset and, in a web
+    request, log a structured line with the metrics of the request so far.
+    '''
+    if not enabled():
+        return
+    registry.incr('resources_filtered', total - kept)
+    metrics = current()
+    if metrics is None:
+        return
+    metrics.resources_filtered += total - kept
+    line = metrics.as_dict()
+    line.update({'dataset': dataset_id, 'resources': total, 'kept': kept})
+    log.info('resourceauthorizer %s', json.dumps(line, sort_keys=True))
+
+
+def prometheus_text(snapshot):
+    '''Format a registry snapshot in the Prometheus text format.'''
+    lines = []
+    for name, value in sorted(snapshot['counters'].items()):
+        lines.append('resourceauthorizer_%s_total %s' % (name, value))
+    for name, timing in sorted(snapshot['timings'].items()):
+        labels = '{function="%s"}' % name
+        lines.append('resourceauthorizer_seconds_count%s %d' %
+                     (labels, timing['count']))
+        lines.append('resourceauthorizer_seconds_sum%s %f' %
+                     (labels, timing['sum']))
+        lines.append('resourceauthorizer_seconds_max%s %f' %
+                     (labels, timing['max']))
+    return '\n'.join(lines) + '\n'
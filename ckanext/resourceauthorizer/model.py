@@ -1,9 +1,26 @@
 import datetime
 import uuid
 
+import logging
+
 from sqlalchemy import Table
+from sqlalchemy import event
 from sqlalchemy import Column
+from sqlalchemy import Index
+from sqlalchemy import MetaData
+from sqlalchemy import PrimaryKeyConstraint
+from sqlalchemy import UniqueConstraint
+from sqlalchemy import func
+from sqlalchemy import and_
+from sqlalchemy import or_
+from sqlalchemy import inspect
+from sqlalchemy import literal
+from sqlalchemy import select
+from sqlalchemy import text
 from sqlalchemy import types
+from sqlalchemy.orm import Session, scoped_session
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.schema import CreateTable
 
 import ckan.model as model
 
@@ -11,6 +28,31 @@ from ckan.model.domain_object import DomainObject
 from ckan.model.meta import metadata, mapper
 from ckan.model.types import make_uuid
 
+from ckanext.resourceauthorizer.util import chunks
+
+log = logging.getLogger(__name__)
+
+# ordered from the weakest to the strongest, each level includes the ones
+# before it; acls store the rank next to the name so that a check is a
+# single comparison
+PERMISSIONS = ['none', 'read', 'download', 'write', 'manage']
+PERMISSION_RANKS = dict((name, rank) for rank, name in enumerate(PERMISSIONS))
+
+
+def permission_rank(permission):
+    return PERMISSION_RANKS[permission]
+
+
+# principals an acl can be given to: a user, the members of an organization
+# or of a group, or every user having a role, whose acls use ROLE_AUTH_ID
+MEMBERSHIP_AUTH_TYPES = ['org', 'group']
+ROLE_AUTH_TYPES = ['sysadmin', 'authenticated', 'anonymous']
+AUTH_TYPES = ['user'] + MEMBERSHIP_AUTH_TYPES + ROLE_AUTH_TYPES
+ROLE_AUTH_ID = u'*'
+
+# what resource_acl_history records about each change
+HISTORY_ACTIONS = ['create', 'update', 'delete', 'expire']
+
 
 class ResourceAcl(DomainObject):
 
@@ -23,23 +65,605 @@ class ResourceAcl(DomainObject):
         return model.Session.query(cls).filter(
             cls.resource_id == resource_id).count()
 
+    @classmethod
+    def find(cls, resource_id, auth_type, auth_id, package_id=None):
+        if resource_id is None:
+            scope = and_(cls.resource_id == None, cls.package_id == package_id)
+        else:
+            scope = cls.resource_id == resource_id
+        return model.Session.query(cls).filter(
+            scope, cls.auth_type == auth_type,
+            cls.auth_id == auth_id).first()
+
 
 resource_acl_table = Table(
     'resource_acl',
     metadata,
     Column('id', types.UnicodeText, primary_key=True, default=make_uuid),
+    # acls apply to a resource, or to all the resources of a dataset when
+    # only the package_id is set
     Column('resource_id', types.UnicodeText),
+    Column('package_id', types.UnicodeText),
     Column('auth_type', types.UnicodeText),
     Column('auth_id', types.UnicodeText),
     Column('permission', types.UnicodeText),
+    Column('permission_rank', types.SmallInteger),
     Column('created', types.DateTime, default=datetime.datetime.utcnow),
     Column('last_modified', types.DateTime, default=datetime.datetime.utcnow),
     Column('creator_user_id', types.UnicodeText, default=u''),
     Column('modifier_user_id', types.UnicodeText, default=u''),
+    # optional bounds of the period the acl applies in, in UTC
+    Column('valid_from', types.DateTime),
+    Column('valid_until', types.DateTime),
+    # also serves lookups by resource_id, the leading column
+    UniqueConstraint(
+        'resource_id', 'auth_type', 'auth_id',
+        name='resource_acl_principal_key'),
 )
 
+# pages of the acls of a resource, ordered by creation
+Index('idx_resource_acl_resource_created', resource_acl_table.c.resource_id,
+      resource_acl_table.c.created, resource_acl_table.c.id)
+
+# acls granted to a user or to the organizations of a user
+Index('idx_resource_acl_auth', resource_acl_table.c.auth_type,
+      resource_acl_table.c.auth_id, resource_acl_table.c.resource_id)
+
+# expired acls, for the sweeper
+Index('idx_resource_acl_valid_until', resource_acl_table.c.valid_until)
+
+# one dataset acl per principal, also serves the lookups of the dataset
+# acls of resources
+Index('resource_acl_package_principal_key', resource_acl_table.c.package_id,
+      resource_acl_table.c.auth_type, resource_acl_table.c.auth_id,
+      unique=True, postgresql_where=resource_acl_table.c.resource_id == None)
+
 mapper(ResourceAcl, resource_acl_table)
 
 
+def _set_permission_rank(mapper, connection, target):
+    target.permission_rank = permission_rank(target.permission)
+
+
+event.listen(ResourceAcl, 'before_insert', _set_permission_rank)
+event.listen(ResourceAcl, 'before_update', _set_permission_rank)
+
+# the permission every user effectively has on every resource they have an
+# acl for, derived from resource_acl and the organization memberships
+resource_acl_effective_table = Table(
+    'resource_acl_effective',
+    metadata,
+    Column('user_id', types.UnicodeText, primary_key=True),
+    Column('resource_id', types.UnicodeText, primary_key=True),
+    Column('permission_rank', types.SmallInteger),
+)
+
+Index('idx_resource_acl_effective_resource',
+      resource_acl_effective_table.c.resource_id)
+
+# expired acls moved away by the sweeper
+resource_acl_archive_table = Table(
+    'resource_acl_archive',
+    metadata,
+    *([c.copy() for c in resource_acl_table.columns] +
+      [Column('archived', types.DateTime, default=datetime.datetime.utcnow)]))
+
+
+# sequential ids, an alias of the rowid on SQLite
+BigSerial = types.BigInteger().with_variant(types.Integer, 'sqlite')
+
+# every change of an acl, appended in the transaction of the change; on
+# PostgreSQL 11 and later the table is partitioned by month of the change,
+# see create_history_partitions
+resource_acl_history_table = Table(
+    'resource_acl_history',
+    metadata,
+    Column('id', BigSerial, primary_key=True, autoincrement=True),
+    Column('changed', types.DateTime, nullable=False),
+    Column('action', types.UnicodeText),
+    Column('changed_by', types.UnicodeText),
+    Column('acl_id', types.UnicodeText),
+    Column('resource_id', types.UnicodeText),
+    Column('package_id', types.UnicodeText),
+    Column('auth_type', types.UnicodeText),
+    Column('auth_id', types.UnicodeText),
+    Column('permission', types.UnicodeText),
+    Column('valid_from', types.DateTime),
+    Column('valid_until', types.DateTime),
+)
+
+# pages of the whole history, ordered by change; the primary key of the
+# partitioned table serves them instead
+Index('idx_resource_acl_history_changed',
+      resource_acl_history_table.c.changed, resource_acl_history_table.c.id)
+
+# pages of the history of a resource or of an acl
+Index('idx_resource_acl_history_resource',
+      resource_acl_history_table.c.resource_id,
+      resource_acl_history_table.c.changed, resource_acl_history_table.c.id)
+Index('idx_resource_acl_history_acl', resource_acl_history_table.c.acl_id,
+      resource_acl_history_table.c.changed, resource_acl_history_table.c.id)
+
+HISTORY_PARTITION_PREFIX = 'resource_acl_history_'
+
+# datasets waiting to be reindexed after their acls changed, a dataset is
+# listed once per change until it is reindexed, see reindex.py
+resource_acl_reindex_table = Table(
+    'resource_acl_reindex',
+    metadata,
+    Column('id', BigSerial, primary_key=True, autoincrement=True),
+    Column('package_id', types.UnicodeText, nullable=False),
+    Column('requested', types.DateTime, default=datetime.datetime.utcnow),
+)
+
+Index('idx_resource_acl_reindex_requested',
+      resource_acl_reindex_table.c.requested)
+
+_history = {'months': set()}
+HISTORY_MONTHS_KEY = 'resourceauthorizer.history.months'
+
+
+def valid_clause(table, now):
+    '''Match the acls of the table that apply at the given time.'''
+    return and_(
+        or_(table.c.valid_from == None, table.c.valid_from <= now),
+        or_(table.c.valid_until == None, table.c.valid_until > now))
+
+
+def bounded_clause(table):
+    '''Match the acls of the table that only apply for a period.'''
+    return or_(table.c.valid_from != None, table.c.valid_until != None)
+
+
+def package_scope_clause(table):
+    '''Match the acls of the table that apply to all the resources of a
+    dataset.
+    '''
+    return table.c.resource_id == None
+
+
 def setup():
     resource_acl_table.create(checkfirst=True)
+    resource_acl_effective_table.create(checkfirst=True)
+    resource_acl_archive_table.create(checkfirst=True)
+    resource_acl_reindex_table.create(checkfirst=True)
+    create_history_table(model.meta.engine)
+
+
+def insert_acls(rows, chunk_size=1000):
+    '''Insert the acls with multi-row INSERT statements, in the current
+    transaction. Missing ids and timestamps are filled in the rows.
+    '''
+    now = datetime.datetime.utcnow()
+    for row in rows:
+        row.setdefault('id', make_uuid())
+        row.setdefault('created', now)
+        row.setdefault('last_modified', now)
+        row.setdefault('creator_user_id', u'')
+        row.setdefault('modifier_user_id', u'')
+        row.setdefault('resource_id', None)
+        row.setdefault('package_id', None)
+        row.setdefault('valid_from', None)
+        row.setdefault('valid_until', None)
+        row['permission_rank'] = permission_rank(row['permission'])
+    for chunk in chunks(rows, chunk_size):
+        model.Session.execute(resource_acl_table.insert().values(chunk))
+        record_history('create',
+                       resource_acl_table.c.id.in_([r['id'] for r in chunk]))
+    return rows
+
+
+def update_acls(changes, chunk_size=1000):
+    '''Apply the changes, dicts holding the id of the acl and the new
+    values of its columns, in the current transaction. Acls receiving the
+    same values are updated by a single statement.
+    '''
+    groups = {}
+    for change in changes:
+        if 'permission' in change:
+            change['permission_rank'] = permission_rank(change['permission'])
+        values = tuple(sorted((k, v) for k, v in change.items() if k != 'id'))
+        groups.setdefault(values, []).append(change['id'])
+    for values, ids in groups.items():
+        for chunk in chunks(ids, chunk_size):
+            model.Session.execute(resource_acl_table.update().where(
+                resource_acl_table.c.id.in_(chunk)).values(dict(values)))
+            record_history('update', resource_acl_table.c.id.in_(chunk))
+
+
+def principal_key(acl):
+    '''Return what an acl is unique on: its resource, or its dataset for
+    the acls of datasets, and its principal. acl is a dict or a row.
+    '''
+    if not isinstance(acl, dict):
+        acl = dict((name, getattr(acl, name))
+                   for name in ('resource_id', 'package_id', 'auth_type',
+                                'auth_id'))
+    resource_id = acl.get('resource_id')
+    return (resource_id, None if resource_id else acl.get('package_id'),
+            acl.get('auth_type'), acl.get('auth_id'))
+
+
+def upsert_acls(rows, user=u''):
+    '''Insert the acls or, when an acl already exists for the same
+    resource (or dataset) and principal, update its permission and validity
+    period, in the current transaction.
+
+    Returns the number of inserted and updated acls.
+    '''
+    table = resource_acl_table
+    rows = dict((principal_key(r), r) for r in rows).values()
+    resource_ids = set(r['resource_id'] for r in rows if r.get('resource_id'))
+    package_ids = set(
+        r['package_id'] for r in rows
+        if r.get('package_id') and not r.get('resource_id'))
+    existing = dict((principal_key(acl), acl) for acl in model.Session.query(
+        table.c.id, table.c.resource_id, table.c.package_id,
+        table.c.auth_type, table.c.auth_id, table.c.permission,
+        table.c.valid_from, table.c.valid_until).filter(
+            or_(table.c.resource_id.in_(resource_ids),
+                and_(package_scope_clause(table),
+                     table.c.package_id.in_(package_ids)))))
+    taken_ids = set(row[0] for row in model.Session.query(table.c.id).filter(
+        table.c.id.in_([r['id'] for r in rows if r.get('id')])))
+
+    now = datetime.datetime.utcnow()
+    inserts = []
+    changes = []
+    for row in rows:
+        acl = existing.get(principal_key(row))
+        if acl is None:
+            if row.get('id') in taken_ids:
+                del row['id']
+            inserts.append(row)
+        elif (acl.permission, acl.valid_from, acl.valid_until) != (
+                row['permission'], row.get('valid_from'),
+                row.get('valid_until')):
+            changes.append({
+                'id': acl.id,
+                'permission': row['permission'],
+                'valid_from': row.get('valid_from'),
+                'valid_until': row.get('valid_until'),
+                'last_modified': now,
+                'modifier_user_id': user
+            })
+    insert_acls(inserts)
+    update_acls(changes)
+    return len(inserts), len(changes)
+
+
+def delete_acls(ids, chunk_size=1000, user=u''):
+    '''Delete the acls in the current transaction.'''
+    for chunk in chunks(ids, chunk_size):
+        clause = resource_acl_table.c.id.in_(chunk)
+        record_history('delete', clause, user)
+        model.Session.execute(resource_acl_table.delete().where(clause))
+
+
+def record_history(action, clause, changed_by=None, session=None):
+    '''Append the acls matching the clause to resource_acl_history, as
+    changed by the action, with a single INSERT ... SELECT in the current
+    transaction. Deletions must be recorded before the acls are deleted.
+
+    changed_by defaults to the creator of the acls for 'create' and to
+    their last modifier otherwise.
+    '''
+    session = session or model.Session
+    table = resource_acl_table
+    now = datetime.datetime.utcnow()
+    if history_partitioned(session):
+        create_history_partitions(session, now)
+    if changed_by is None:
+        changed_by = (table.c.creator_user_id
+                      if action == 'create' else table.c.modifier_user_id)
+    else:
+        changed_by = literal(changed_by, types.UnicodeText)
+    rows = select([
+        literal(now, types.DateTime),
+        literal(action, types.UnicodeText), changed_by, table.c.id,
+        table.c.resource_id, table.c.package_id, table.c.auth_type,
+        table.c.auth_id, table.c.permission, table.c.valid_from,
+        table.c.valid_until
+    ]).where(clause)
+    session.execute(resource_acl_history_table.insert().from_select([
+        'changed', 'action', 'changed_by', 'acl_id', 'resource_id',
+        'package_id', 'auth_type', 'auth_id', 'permission', 'valid_from',
+        'valid_until'
+    ], rows))
+
+
+def month_start(moment, offset=0):
+    '''Return the start of the month of the given time, or of the month
+    offset months away from it.
+    '''
+    month = moment.year * 12 + moment.month - 1 + offset
+    return datetime.datetime(month // 12, month % 12 + 1, 1)
+
+
+def _partitioning_supported(bind):
+    # bind: an engine, a connection or a session
+    dialect = bind.dialect if hasattr(bind, 'dialect') else \
+        bind.get_bind().dialect
+    return dialect.name == 'postgresql' and \
+        dialect.server_version_info >= (11, )
+
+
+def history_partitioned(bind):
+    '''Whether resource_acl_history is partitioned by month.'''
+    if 'partitioned' not in _history:
+        _history['partitioned'] = _partitioning_supported(bind) and bool(
+            bind.execute(
+                text('SELECT 1 FROM pg_partitioned_table p '
+                     'JOIN pg_class c ON c.oid = p.partrelid '
+                     'WHERE c.relname = :name'),
+                {'name': resource_acl_history_table.name}).scalar())
+    return _history['partitioned']
+
+
+def history_partitions(bind):
+    '''Return the (name, start of the month) of the partitions of
+    resource_acl_history, oldest first.
+    '''
+    rows = bind.execute(
+        text('SELECT c.relname FROM pg_inherits i '
+             'JOIN pg_class c ON c.oid = i.inhrelid '
+             'JOIN pg_class p ON p.oid = i.inhparent '
+             'WHERE p.relname = :name'),
+        {'name': resource_acl_history_table.name})
+    partitions = []
+    for (name, ) in rows:
+        suffix = name[len(HISTORY_PARTITION_PREFIX):]
+        if name.startswith(HISTORY_PARTITION_PREFIX) and suffix.isdigit():
+            partitions.append((name, datetime.datetime(
+                int(suffix[:4]), int(suffix[4:]), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def _remember_history_months(session):
+    _history['months'].update(session.info.pop(HISTORY_MONTHS_KEY, ()))
+
+
+def _forget_history_months(session):
+    session.info.pop(HISTORY_MONTHS_KEY, None)
+
+
+def create_history_partitions(bind, moment, months=2):
+    '''Create the partitions of resource_acl_history for the month of the
+    given time and the following ones, unless they exist. Partitions are
+    only looked up once per process; those created in the transaction of a
+    session are only remembered once it is committed, they are gone if it
+    is rolled back.
+    '''
+    in_session = isinstance(bind, (Session, scoped_session))
+    created = bind.info.get(HISTORY_MONTHS_KEY, ()) if in_session else ()
+    for offset in range(months):
+        start = month_start(moment, offset)
+        if start in _history['months'] or start in created:
+            continue
+        name = '{0}{1:%Y%m}'.format(HISTORY_PARTITION_PREFIX, start)
+        exists = bind.execute(
+            text('SELECT to_regclass(:name)'), {'name': name}).scalar()
+        if exists is None:
+            log.info('Creating partition %s', name)
+            bind.execute(
+                'CREATE TABLE IF NOT EXISTS {0} PARTITION OF {1} '
+                "FOR VALUES FROM ('{2:%Y-%m-%d}') TO ('{3:%Y-%m-%d}')".format(
+                    name, resource_acl_history_table.name, start,
+                    month_start(start, 1)))
+            if in_session:
+                if not event.contains(bind, 'after_commit',
+                                      _remember_history_months):
+                    event.listen(bind, 'after_commit',
+                                 _remember_history_months)
+                    event.listen(bind, 'after_rollback',
+                                 _forget_history_months)
+                bind.info.setdefault(HISTORY_MONTHS_KEY, set()).add(start)
+                continue
+        _history['months'].add(start)
+
+
+def drop_history_partition(bind, name):
+    bind.execute('DROP TABLE IF EXISTS {0}'.format(name))
+    _history['months'].clear()
+
+
+def _partitioned_history_table():
+    # the primary key of a partitioned table includes the partition key,
+    # it also serves the pages of the whole history
+    columns = [c.copy() for c in resource_acl_history_table.columns]
+    for column in columns:
+        column.primary_key = False
+    table = Table(
+        resource_acl_history_table.name, MetaData(), *(columns + [
+            PrimaryKeyConstraint(
+                'changed', 'id', name='resource_acl_history_pkey')
+        ]))
+    for index in resource_acl_history_table.indexes:
+        if index.name != 'idx_resource_acl_history_changed':
+            Index(index.name, *[table.c[c.name] for c in index.columns])
+    return table
+
+
+def create_history_table(engine):
+    '''Create resource_acl_history, partitioned by month on PostgreSQL 11
+    and later.
+    '''
+    table = resource_acl_history_table
+    if table.exists(bind=engine):
+        return
+    if not _partitioning_supported(engine):
+        table.create(bind=engine)
+        return
+    partitioned = _partitioned_history_table()
+    ddl = str(CreateTable(partitioned).compile(dialect=engine.dialect)).strip()
+    engine.execute(ddl + ' PARTITION BY RANGE (changed)')
+    for index in partitioned.indexes:
+        engine.execute(CreateIndex(index))
+    _history.pop('partitioned', None)
+    create_history_partitions(engine, datetime.datetime.utcnow())
+
+
+def migrate():
+    '''Upgrade an existing resource_acl table to the current schema
+
+    Rows conflicting on (resource_id, auth_type, auth_id) are removed,
+    keeping the most recently modified one, then the missing indexes and
+    the uniqueness constraint are built. On PostgreSQL the indexes are
+    built concurrently so that writes are not blocked.
+    '''
+    engine = model.meta.engine
+    resource_acl_table.create(bind=engine, checkfirst=True)
+    _migrate_permission_ranks(engine)
+    _migrate_validity(engine)
+    _migrate_effective_table(engine)
+    resource_acl_archive_table.create(bind=engine, checkfirst=True)
+    resource_acl_reindex_table.create(bind=engine, checkfirst=True)
+    create_history_table(engine)
+    _migrate_package_scope(engine)
+
+    removed = _deduplicate()
+    if removed:
+        log.info('Removed %d conflicting resource acls', removed)
+
+    unique_key = [
+        c for c in resource_acl_table.constraints
+        if isinstance(c, UniqueConstraint)
+    ][0]
+    unique_ddl = 'CREATE UNIQUE INDEX {0} ON resource_acl ({1})'.format(
+        unique_key.name, ', '.join(c.name for c in unique_key.columns))
+    indexes = [(unique_key.name, unique_ddl)] + [
+        (index.name, str(CreateIndex(index).compile(dialect=engine.dialect)))
+        for index in sorted(resource_acl_table.indexes, key=lambda i: i.name)
+    ]
+
+    if engine.dialect.name == 'postgresql':
+        _create_indexes_concurrently(engine, indexes)
+        _attach_unique_constraint(engine, unique_key.name)
+    else:
+        inspector = inspect(engine)
+        existing = set(i['name'] for i in inspector.get_indexes('resource_acl'))
+        existing.update(
+            c['name']
+            for c in inspector.get_unique_constraints('resource_acl'))
+        for name, ddl in indexes:
+            if name not in existing:
+                engine.execute(ddl)
+
+
+def _migrate_permission_ranks(engine):
+    columns = [c['name'] for c in inspect(engine).get_columns('resource_acl')]
+    if 'permission_rank' not in columns:
+        engine.execute(
+            'ALTER TABLE resource_acl ADD COLUMN permission_rank SMALLINT')
+        # read used to include downloading the resource, keep it that way
+        rewritten = engine.execute(resource_acl_table.update().where(
+            resource_acl_table.c.permission == 'read').values(
+                permission='download')).rowcount
+        log.info('Changed %d read resource acls to download, which read '
+                 'used to include', rewritten)
+    table = resource_acl_table
+    for permission in PERMISSIONS:
+        engine.execute(table.update().where(
+            table.c.permission == permission).where(
+                or_(table.c.permission_rank == None,
+                    table.c.permission_rank != permission_rank(permission))
+            ).values(permission_rank=permission_rank(permission)))
+
+
+def _migrate_validity(engine):
+    columns = [c['name'] for c in inspect(engine).get_columns('resource_acl')]
+    for name in ('valid_from', 'valid_until'):
+        if name not in columns:
+            engine.execute(
+                'ALTER TABLE resource_acl ADD COLUMN {0} {1}'.format(
+                    name, types.DateTime().compile(dialect=engine.dialect)))
+
+
+def _column_names(engine, name):
+    if engine.dialect.name == 'postgresql':
+        # also covers partitioned tables
+        return [
+            row[0] for row in engine.execute(
+                text('SELECT column_name FROM information_schema.columns '
+                     'WHERE table_name = :name'), {'name': name})
+        ]
+    return [c['name'] for c in inspect(engine).get_columns(name)]
+
+
+def _migrate_package_scope(engine):
+    # the tables holding copies of the acls get the column too
+    for table in (resource_acl_table, resource_acl_archive_table,
+                  resource_acl_history_table):
+        if 'package_id' not in _column_names(engine, table.name):
+            engine.execute(
+                'ALTER TABLE {0} ADD COLUMN package_id {1}'.format(
+                    table.name,
+                    types.UnicodeText().compile(dialect=engine.dialect)))
+
+
+def _migrate_effective_table(engine):
+    # the table is derived from resource_acl, it is rebuilt rather than
+    # migrated when its columns changed
+    inspector = inspect(engine)
+    if 'resource_acl_effective' in inspector.get_table_names():
+        columns = [
+            c['name'] for c in inspector.get_columns('resource_acl_effective')
+        ]
+        if 'permission_rank' not in columns:
+            resource_acl_effective_table.drop(bind=engine)
+    resource_acl_effective_table.create(bind=engine, checkfirst=True)
+
+
+def _deduplicate():
+    table = resource_acl_table
+    duplicates = model.Session.query(
+        table.c.resource_id, table.c.package_id, table.c.auth_type,
+        table.c.auth_id).group_by(
+            table.c.resource_id, table.c.package_id, table.c.auth_type,
+            table.c.auth_id).having(func.count(table.c.id) > 1).all()
+
+    removed = 0
+    for resource_id, package_id, auth_type, auth_id in duplicates:
+        ids = [
+            row.id for row in model.Session.query(table.c.id).filter(
+                table.c.resource_id == resource_id,
+                table.c.package_id == package_id,
+                table.c.auth_type == auth_type,
+                table.c.auth_id == auth_id).order_by(
+                    table.c.last_modified.desc(), table.c.id)
+        ]
+        model.Session.execute(table.delete().where(table.c.id.in_(ids[1:])))
+        removed += len(ids) - 1
+    model.Session.commit()
+    return removed
+
+
+def _create_indexes_concurrently(engine, indexes):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    connection = engine.connect().execution_options(
+        isolation_level='AUTOCOMMIT')
+    try:
+        for name, ddl in indexes:
+            valid = connection.execute(
+                'SELECT i.indisvalid FROM pg_index i '
+                'JOIN pg_class c ON c.oid = i.indexrelid '
+                'WHERE c.relname = %s', (name, )).scalar()
+            if valid:
+                continue
+            if valid is not None:
+                # left behind by an interrupted concurrent build
+                connection.execute('DROP INDEX CONCURRENTLY %s' % name)
+            log.info('Building index %s', name)
+            connection.execute(
+                ddl.replace(' INDEX ', ' INDEX CONCURRENTLY ', 1))
+    finally:
+        connection.close()
+
+
+def _attach_unique_constraint(engine, name):
+    exists = engine.execute(
+        'SELECT 1 FROM pg_constraint WHERE conname = %s', (name, )).scalar()
+    if not exists:
+        engine.execute(
+            'ALTER TABLE resource_acl ADD CONSTRAINT {0} '
+            'UNIQUE USING INDEX {0}'.format(name))
@@ -1,17 +1,31 @@
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as toolkit
+import ckan.model as model
 import ckanext.resourceauthorizer.helpers as resourceauthorizer_helpers
-import ckan.authz as authz
-from ckan.plugins.toolkit import get_action
+import ckanext.resourceauthorizer.labels as resourceauthorizer_labels
 from ckan.lib.plugins import DefaultPermissionLabels
 from ckanext.resourceauthorizer.logic import action
 from ckanext.resourceauthorizer.logic import auth
+from ckanext.resourceauthorizer.principal import get_principal
+from ckanext.resourceauthorizer import changes
+from ckanext.resourceauthorizer import effective
+from ckanext.resourceauthorizer import lifecycle
+from ckanext.resourceauthorizer import metrics
+from ckanext.resourceauthorizer import reindex
+
+
+def _instrumented(kind, functions):
+    if not metrics.enabled():
+        return functions
+    return dict((name, metrics.instrumented(kind + '.' + name, function))
+                for name, function in functions.items())
 
 
 class ResourceAuthorizerPlugin(plugins.SingletonPlugin,
                                DefaultPermissionLabels):
 
     plugins.implements(plugins.IConfigurer)
+    plugins.implements(plugins.IConfigurable)
     plugins.implements(plugins.IRoutes, inherit=True)
     plugins.implements(plugins.IActions)
     plugins.implements(plugins.IAuthFunctions)
@@ -26,43 +40,71 @@ class ResourceAuthorizerPlugin(plugins.SingletonPlugin,
         toolkit.add_public_directory(config_, 'public')
         toolkit.add_resource('fanstatic', 'resourceauthorizer')
 
+    # IConfigurable
+
+    def configure(self, config_):
+        changes.listen()
+        lifecycle.listen()
+        reindex.listen()
+        if effective.enabled():
+            effective.listen()
+
     def get_helpers(self):
-        '''Register the linked_organization() function above as a template
-        helper function.
+        '''Register the linked_organization() and linked_acl_principal()
+        functions of the helpers module as template helper functions.
         '''
         return {
             'linked_organization':
-            resourceauthorizer_helpers.linked_organization
+            resourceauthorizer_helpers.linked_organization,
+            'linked_acl_principal':
+            resourceauthorizer_helpers.linked_acl_principal
         }
 
     # IActions
 
     def get_actions(self):
-        return {
+        return _instrumented('action', {
             'resource_list_for_user': action.resource_list_for_user,
             'resource_acl_list': action.resource_acl_list,
+            'resource_acl_history_list': action.resource_acl_history_list,
             'resource_acl_show': action.resource_acl_show,
             'resource_acl_create': action.resource_acl_create,
             'resource_acl_delete': action.resource_acl_delete,
             'resource_acl_update': action.resource_acl_update,
             'resource_acl_patch': action.resource_acl_patch,
-        }
+            'resource_acl_bulk_create': action.resource_acl_bulk_create,
+            'resource_acl_bulk_update': action.resource_acl_bulk_update,
+            'resource_acl_bulk_delete': action.resource_acl_bulk_delete,
+            'resource_authorize_many': action.resource_authorize_many,
+            'resource_acl_job_status': action.resource_acl_job_status,
+            'resource_view_list_many': action.resource_view_list_many,
+            'resource_authorizer_metrics': action.resource_authorizer_metrics,
+        })
 
     # IAuthFunctions
 
     def get_auth_functions(self):
-        return {
+        return _instrumented('auth', {
             'resource_list_for_user': auth.resource_list_for_user,
             'resource_acl_list': auth.resource_acl_list,
+            'resource_acl_history_list': auth.resource_acl_history_list,
             'resource_acl_show': auth.resource_acl_show,
             'resource_acl_create': auth.resource_acl_create,
             'resource_acl_delete': auth.resource_acl_delete,
             'resource_acl_update': auth.resource_acl_update,
             'resource_acl_patch': auth.resource_acl_patch,
+            'resource_acl_bulk_create': auth.resource_acl_bulk_create,
+            'resource_acl_bulk_update': auth.resource_acl_bulk_update,
+            'resource_acl_bulk_delete': auth.resource_acl_bulk_delete,
             'resource_show': auth.resource_show,
+            'resource_download': auth.resource_download,
             'resource_view_show': auth.resource_view_show,
-            'resource_view_list': auth.resource_view_list
-        }
+            'resource_view_list': auth.resource_view_list,
+            'resource_authorize_many': auth.resource_authorize_many,
+            'resource_acl_job_status': auth.resource_acl_job_status,
+            'resource_view_list_many': auth.resource_view_list_many,
+            'resource_authorizer_metrics': auth.resource_authorizer_metrics,
+        })
 
     # IRoutes
 
@@ -86,32 +128,48 @@ class ResourceAuthorizerPlugin(plugins.SingletonPlugin,
             controller=
             'ckanext.resourceauthorizer.controller:ResourceAuthorizerController',
             action='resource_acl_delete')
+        # downloads need the download permission, when an acl applies
+        for path in ('/dataset/{id}/resource/{resource_id}/download',
+                     '/dataset/{id}/resource/{resource_id}/download/{filename}'):
+            m.connect(
+                path,
+                controller=
+                'ckanext.resourceauthorizer.controller:ResourceAuthorizerController',
+                action='resource_download')
         return m
 
     # IPackageController
 
-    def after_show(item, context, data_dict):
-        resources = []
-        for resource_dict in data_dict['resources']:
-            logic_authorization = authz.is_authorized('resource_show', context,
-                                                      resource_dict)
-            if logic_authorization['success']:
-                resources.append(resource_dict)
-        data_dict['resources'] = resources
+    def after_show(self, context, data_dict):
+        total = len(data_dict['resources'])
+        data_dict['resources'] = auth.authorized_resources(
+            context, data_dict['id'], data_dict['resources'])
+        metrics.record_filtered(data_dict['id'], total,
+                                len(data_dict['resources']))
         return
 
+    def after_search(self, search_results, search_params):
+        try:
+            user = toolkit.c.user
+        except (TypeError, AttributeError):
+            # not inside a web request, no user to filter the results for
+            return search_results
+        context = {'model': model, 'session': model.Session, 'user': user}
+        auth.authorized_search_results(context, search_results['results'])
+        return search_results
+
     # IPermissionLabels
 
     def get_dataset_labels(self, dataset_obj):
         labels = super(ResourceAuthorizerPlugin,
                        self).get_dataset_labels(dataset_obj)
-        labels.extend(u'acl-%s' % o.id for o in dataset_obj.resources)
+        labels.extend(resourceauthorizer_labels.dataset_labels(dataset_obj))
         return labels
 
     def get_user_dataset_labels(self, user_obj):
         labels = super(ResourceAuthorizerPlugin,
                        self).get_user_dataset_labels(user_obj)
-        if user_obj:
-            resources = get_action(u'resource_list_for_user')()
-            labels.extend(u'acl-%s' % o[u'resource_id'] for o in resources)
+        # anonymous users may be granted resources through their role
+        principal = get_principal({}, user_obj.name if user_obj else None)
+        labels.extend(resourceauthorizer_labels.user_labels(principal))
         return labels
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+
+import ckan.model as model
+
+from ckanext.resourceauthorizer.model import ROLE_AUTH_ID
+from ckanext.resourceauthorizer.util import request_store
+
+CONTEXT_KEY = '__resourceauthorizer_principals'
+ENVIRON_KEY = 'ckanext.resourceauthorizer.principals'
+
+_stats = {'hits': 0, 'misses': 0}
+
+
+class Principal(object):
+    '''The user on whose behalf resource acls are evaluated.
+
+    The user id, the ids of the organizations and groups the user is a
+    member of and the roles of the user are resolved once, when the
+    principal is created. Anonymous users have a principal too, which is
+    false and only has the anonymous role.
+    '''
+
+    def __init__(self, name, userobj):
+        self.name = name
+        self.userobj = userobj
+        self.id = userobj.id if userobj else None
+        self.sysadmin = bool(userobj and userobj.sysadmin)
+        org_ids, group_ids = _memberships(self.id) if userobj else ([], [])
+        self.org_ids = frozenset(org_ids)
+        self.group_ids = frozenset(group_ids)
+        if not userobj:
+            self.roles = frozenset(['anonymous'])
+        elif self.sysadmin:
+            self.roles = frozenset(['authenticated', 'sysadmin'])
+        else:
+            self.roles = frozenset(['authenticated'])
+        # changes whenever the memberships change, used in cache keys
+        self.key = '%s:%s' % (self.id, hashlib.md5(','.join(
+            sorted(self.org_ids) + sorted(self.group_ids) +
+            sorted(self.roles))).hexdigest()[:12])
+
+    def auth_ids(self, auth_type):
+        '''Return the ids the acls of the type must have to apply to the
+        principal.
+        '''
+        if auth_type == 'user':
+            return [self.id] if self.id else []
+        if auth_type == 'org':
+            return list(self.org_ids)
+        if auth_type == 'group':
+            return list(self.group_ids)
+        return [ROLE_AUTH_ID] if auth_type in self.roles else []
+
+    def __nonzero__(self):
+        return self.userobj is not None
+
+    def __repr__(self):
+        return '<Principal name=%r orgs=%d groups=%d>' % (
+            self.name, len(self.org_ids), len(self.group_ids))
+
+
+def _memberships(user_id):
+    # the organizations and groups of the user, in a single query
+    org_ids = []
+    group_ids = []
+    rows = model.Session.query(model.Group.id, model.Group.is_organization).join(
+        model.Member, model.Member.group_id == model.Group.id).filter(
+            model.Member.table_name == 'user',
+            model.Member.table_id == user_id, model.Member.state == 'active',
+            model.Group.state == 'active')
+    for group_id, is_organization in rows:
+        (org_ids if is_organization else group_ids).append(group_id)
+    return org_ids, group_ids
+
+
+def get_principal(context, user=None):
+    '''Return the principal of the user, resolving it at most once per
+    request (or per context outside of a web request).
+
+    :param context: the action context, used as a cache
+    :param user: the name or id of the user, defaults to ``context['user']``
+    '''
+    if context is None:
+        context = {}
+    if user is None:
+        user = context.get('user')
+
+    stores = [context.setdefault(CONTEXT_KEY, {})]
+    request_principals = request_store(ENVIRON_KEY)
+    if request_principals is not None:
+        stores.append(request_principals)
+
+    for store in stores:
+        principal = store.get(user)
+        if principal is not None:
+            _stats['hits'] += 1
+            for other in stores:
+                other.setdefault(user, principal)
+            return principal
+
+    _stats['misses'] += 1
+    principal = Principal(user, model.User.get(user) if user else None)
+    for store in stores:
+        store[user] = principal
+    return principal
+
+
+def cache_stats():
+    '''Return the hit/miss counters of the principal cache.'''
+    return dict(_stats)
+
+
+def reset_cache_stats():
+    for key in _stats:
+        _stats[key] = 0
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import logging
+import time
+
+from sqlalchemy import event, func, literal, select, types
+
+import ckan.model as model
+import ckan.lib.jobs as jobs
+from ckan.common import config
+from ckan.plugins.toolkit import asbool
+
+from ckanext.resourceauthorizer import indexing
+from ckanext.resourceauthorizer.model import resource_acl_reindex_table
+from ckanext.resourceauthorizer.util import chunks
+
+log = logging.getLogger(__name__)
+
+REINDEX_MODES = ['async', 'off']
+SCHEDULE_KEY = 'resourceauthorizer.reindex.schedule'
+# the statuses of the jobs that have not started yet
+WAITING_STATUSES = ('queued', 'deferred', 'scheduled')
+
+_state = {}
+
+
+def reindex_mode():
+    '''Return the configured reindexing mode.
+
+    ``async`` (default) queues a background job reindexing the datasets
+    whose acls changed, ``off`` leaves them to the reindex-pending command.
+    '''
+    mode = config.get('ckanext.resourceauthorizer.reindex', 'async')
+    if mode not in REINDEX_MODES:
+        raise ValueError('Invalid ckanext.resourceauthorizer.reindex %s' %
+                         mode)
+    return mode
+
+
+def _debounce():
+    # seconds without acl changes before the datasets are reindexed
+    return float(
+        config.get('ckanext.resourceauthorizer.reindex.debounce', 10))
+
+
+def _max_wait():
+    # the longest the reindexing is put off while the acl changes go on
+    return float(
+        config.get('ckanext.resourceauthorizer.reindex.max_wait', 300))
+
+
+def _delayed_jobs():
+    # delayed jobs need rq 1.2 or later and workers running its scheduler
+    return asbool(
+        config.get('ckanext.resourceauthorizer.reindex.delayed_jobs', False))
+
+
+def record(session, resource_ids):
+    '''Record, in the current transaction, that the datasets of the
+    resources have to be reindexed. Nothing is read, concurrent requests
+    for a dataset are coalesced when it is reindexed.
+    '''
+    table = resource_acl_reindex_table
+    now = datetime.datetime.utcnow()
+    for chunk in chunks(set(resource_ids)):
+        session.execute(table.insert().from_select(
+            ['package_id', 'requested'],
+            select([model.Resource.package_id,
+                    literal(now, types.DateTime)]).where(
+                        model.Resource.id.in_(chunk)).distinct()))
+    session.info[SCHEDULE_KEY] = True
+
+
+def record_packages(session, package_ids):
+    '''Record that the datasets have to be reindexed.'''
+    now = datetime.datetime.utcnow()
+    for chunk in chunks(set(package_ids)):
+        session.execute(resource_acl_reindex_table.insert().values(
+            [{'package_id': package_id, 'requested': now}
+             for package_id in chunk]))
+
+
+def _pending_query(session, cutoff):
+    table = resource_acl_reindex_table
+    return session.query(table.c.package_id).filter(
+        table.c.requested <= cutoff).distinct()
+
+
+def pending_count(session):
+    '''Return the number of datasets waiting to be reindexed.'''
+    return _pending_query(session, datetime.datetime.utcnow()).count()
+
+
+def _quiet_delay(session, started):
+    # the seconds left until no acl changed for the debounce delay, so that
+    # the datasets changed by a burst of writes are reindexed once, or
+    # until max_wait after the first change
+    table = resource_acl_reindex_table
+    latest = session.query(func.max(table.c.requested)).scalar()
+    session.rollback()
+    if latest is None:
+        return 0
+    quiet = (datetime.datetime.utcnow() - latest).total_seconds()
+    return min(_debounce() - quiet, _max_wait() - (time.time() - started))
+
+
+def process(session, batch_size=100, progress=None):
+    '''Reindex the datasets waiting for it, committing to solr once per
+    batch.
+
+    The requests of a batch are deleted before its datasets are reindexed,
+    so that changes committed meanwhile are reindexed by a later batch.
+    Returns the number of reindexed datasets.
+    '''
+    table = resource_acl_reindex_table
+    cutoff = datetime.datetime.utcnow()
+    reindexed = 0
+    while True:
+        package_ids = [
+            row[0]
+            for row in _pending_query(session, cutoff).limit(batch_size)
+        ]
+        if not package_ids:
+            break
+        session.execute(table.delete().where(
+            table.c.package_id.in_(package_ids)).where(
+                table.c.requested <= cutoff))
+        session.commit()
+        try:
+            indexing.reindex_packages(package_ids, batch_size)
+        except Exception:
+            # keep them for the next run
+            record_packages(session, package_ids)
+            session.commit()
+            raise
+        reindexed += len(package_ids)
+        if progress:
+            progress(reindexed)
+    return reindexed
+
+
+def _enqueue(delay, started):
+    from ckanext.resourceauthorizer.jobs import queue_name
+    if delay > 0 and _delayed_jobs():
+        return jobs.get_queue(queue_name()).enqueue_in(
+            datetime.timedelta(seconds=delay), reindex_pending, started)
+    else:
+        return jobs.enqueue(
+            reindex_pending, [started],
+            title=u'resource acl reindex',
+            queue=queue_name())
+
+
+def reindex_pending(started=None):
+    '''Background job reindexing the datasets waiting for it, queued by
+    schedule.
+
+    With delayed jobs, a job run while the acls are still changing queues
+    itself again for when they may have stopped, rather than holding the
+    worker; started is the time of the first job.
+    '''
+    session = model.Session
+    started = started or time.time()
+    delay = _quiet_delay(session, started) if _delayed_jobs() else 0
+    if delay > 0:
+        _enqueue(delay, started)
+        return 0
+    return process(session)
+
+
+def _waiting(job):
+    try:
+        return job.get_status() in WAITING_STATUSES
+    except Exception:
+        return False
+
+
+def schedule():
+    '''Queue a job reindexing the datasets waiting for it, unless the job
+    queued last by this process has not started yet: it reindexes every
+    change committed before it starts, so that a burst of acl changes is
+    reindexed by a single job.
+
+    With ckanext.resourceauthorizer.reindex.delayed_jobs, the job runs once
+    the acl changes stop for the debounce delay; otherwise it runs as soon
+    as a worker takes it.
+    '''
+    if reindex_mode() != 'async':
+        return
+    job = _state.get('job')
+    if job is not None and _waiting(job):
+        return
+    try:
+        _state['job'] = _enqueue(_debounce(), time.time())
+    except Exception:
+        # the acls are saved, the datasets are left to reindex-pending
+        log.exception('Could not queue the reindexing of the datasets')
+        _state.pop('job', None)
+
+
+def _after_commit(session):
+    if session.info.pop(SCHEDULE_KEY, None):
+        schedule()
+
+
+def _after_rollback(session):
+    session.info.pop(SCHEDULE_KEY, None)
+
+
+def listen():
+    '''Queue the reindexing of the datasets once their acl changes are
+    committed.
+    '''
+    if event.contains(model.Session, 'after_commit', _after_commit):
+        return
+    event.listen(model.Session, 'after_commit', _after_commit)
+    event.listen(model.Session, 'after_rollback', _after_rollback)
@@ -0,0 +1,57 @@
+"""Fixtures of the tests using the CKAN test database."""
+import ckan.model as model
+import ckan.plugins as plugins
+from ckan.tests import helpers
+
+from ckanext.resourceauthorizer import model as resourceauthorizer_model
+from ckanext.resourceauthorizer.model import insert_acls
+from ckanext.resourceauthorizer.principal import Principal
+
+
+class DatabaseTest(object):
+    '''Base of the tests reading and writing acls in the CKAN test
+    database, which is emptied before every test
+    '''
+
+    # load the plugin, for the tests calling its actions and auth functions
+    load_plugin = False
+
+    @classmethod
+    def setup_class(cls):
+        if cls.load_plugin and not plugins.plugin_loaded('resourceauthorizer'):
+            plugins.load('resourceauthorizer')
+
+    @classmethod
+    def teardown_class(cls):
+        if cls.load_plugin:
+            plugins.unload('resourceauthorizer')
+
+    def setup(self):
+        # reset_db empties every table of the metadata, the acl ones
+        # included, they must exist first
+        resourceauthorizer_model.setup()
+        helpers.reset_db()
+        resourceauthorizer_model.setup()
+
+
+def create_acls(*acls):
+    '''Insert the acls, dicts of their columns, and commit.'''
+    rows = insert_acls([dict(acl) for acl in acls])
+    model.Session.commit()
+    return rows
+
+
+def principal(user_dict=None):
+    '''Return the principal of the user, or of anonymous users.'''
+    if user_dict is None:
+        return Principal(u'', None)
+    return Principal(user_dict['name'], model.User.get(user_dict['id']))
+
+
+def user_context(user_dict=None, **extra):
+    '''Return an action context for the user, or for anonymous users.'''
+    return dict({
+        'model': model,
+        'session': model.Session,
+        'user': user_dict['name'] if user_dict else u''
+    }, **extra)
@@ -0,0 +1,264 @@
+"""Tests for the actions of logic/action.py."""
+import datetime
+
+from nose.tools import assert_equal, assert_raises
+
+import ckan.model as model
+from ckan.logic import NotAuthorized, NotFound, ValidationError
+from ckan.tests import factories, helpers
+
+from ckanext.resourceauthorizer import lifecycle
+from ckanext.resourceauthorizer.model import (ResourceAcl,
+                                              resource_acl_archive_table)
+from ckanext.resourceauthorizer.tests.fixtures import (DatabaseTest,
+                                                       create_acls,
+                                                       user_context)
+
+
+class TestAclList(DatabaseTest):
+
+    load_plugin = True
+
+    def setup(self):
+        super(TestAclList, self).setup()
+        dataset = factories.Dataset()
+        self.resource = factories.Resource(package_id=dataset['id'])
+        self.users = [factories.User() for _ in range(5)]
+        # created at the same time, the pages are ordered by id then
+        create_acls(*[{
+            'resource_id': self.resource['id'],
+            'auth_type': 'user',
+            'auth_id': user['id'],
+            'permission': 'read'
+        } for user in self.users])
+
+    def _list(self, **kwargs):
+        return helpers.call_action(
+            'resource_acl_list', resource_id=self.resource['id'], **kwargs)
+
+    @helpers.change_config('ckanext.resourceauthorizer.acl_list_max_limit',
+                           '2')
+    def test_whole_list_without_cursor(self):
+        acls = self._list()
+        assert_equal(len(acls), 5)
+        assert_equal([acl['id'] for acl in self._list(limit=3)],
+                     [acl['id'] for acl in acls[:3]])
+
+    @helpers.change_config('ckanext.resourceauthorizer.acl_list_max_limit',
+                           '2')
+    def test_cursor_pages(self):
+        ids = []
+        pages = 0
+        cursor = u''
+        while cursor is not None:
+            page = self._list(cursor=cursor)
+            ids.extend(acl['id'] for acl in page['results'])
+            cursor = page['next_cursor']
+            pages += 1
+        assert_equal(pages, 3)
+        assert_equal(ids, [acl['id'] for acl in self._list()])
+
+    def test_filters_and_total(self):
+        page = self._list(auth_id=self.users[0]['id'], include_total=True)
+        assert_equal(page['count'], 1)
+        assert_equal([acl['auth_id'] for acl in page['results']],
+                     [self.users[0]['id']])
+        assert_equal(page['next_cursor'], None)
+
+
+class TestBulkActions(DatabaseTest):
+
+    load_plugin = True
+
+    def setup(self):
+        super(TestBulkActions, self).setup()
+        dataset = factories.Dataset()
+        self.resources = [
+            factories.Resource(package_id=dataset['id']) for _ in range(2)
+        ]
+        self.users = [factories.User() for _ in range(2)]
+
+    def _acls(self, permission='read'):
+        return [{
+            'resource_id': resource['id'],
+            'auth_type': 'user',
+            'auth_id': user['id'],
+            'permission': permission
+        } for resource in self.resources for user in self.users]
+
+    def _permissions(self):
+        return sorted(
+            (acl['resource_id'], acl['auth_id'], acl['permission'])
+            for resource in self.resources
+            for acl in helpers.call_action(
+                'resource_acl_list', resource_id=resource['id']))
+
+    def test_create(self):
+        results = helpers.call_action('resource_acl_bulk_create',
+                                      acls=self._acls())
+        assert_equal([result['success'] for result in results], [True] * 4)
+        assert_equal(len(self._permissions()), 4)
+
+    def test_create_writes_nothing_when_an_acl_conflicts(self):
+        create_acls(self._acls()[1])
+        assert_raises(ValidationError, helpers.call_action,
+                      'resource_acl_bulk_create', acls=self._acls())
+        assert_equal(len(self._permissions()), 1)
+
+    def test_update(self):
+        ids = [row['id'] for row in create_acls(*self._acls())]
+        changes = [
+            dict(acl, id=id) for id, acl in zip(ids, self._acls('download'))
+        ]
+        results = helpers.call_action(
+            'resource_acl_bulk_update',
+            acls=changes + [dict(changes[0], id=u'missing')])
+        assert_equal([result['success'] for result in results],
+                     [True] * 4 + [False])
+        assert_equal(set(p for _, _, p in self._permissions()),
+                     set(['download']))
+
+    def test_update_rejects_items_that_are_not_dicts(self):
+        ids = [row['id'] for row in create_acls(*self._acls())]
+        assert_raises(ValidationError, helpers.call_action,
+                      'resource_acl_bulk_update',
+                      acls=[{'id': ids[0], 'permission': 'none'}, u'acl'])
+
+    def test_delete(self):
+        ids = [row['id'] for row in create_acls(*self._acls())]
+        results = helpers.call_action('resource_acl_bulk_delete',
+                                      ids=ids[:3] + [u'missing'])
+        assert_equal([result['success'] for result in results],
+                     [True] * 3 + [False])
+        assert_equal(len(self._permissions()), 1)
+        assert_raises(ValidationError, helpers.call_action,
+                      'resource_acl_bulk_delete', ids=[{'id': ids[3]}])
+
+
+class TestAuthorizeMany(DatabaseTest):
+
+    load_plugin = True
+
+    def setup(self):
+        super(TestAuthorizeMany, self).setup()
+        self.user = factories.User()
+        dataset = self.dataset = factories.Dataset()
+        self.granted = factories.Resource(package_id=dataset['id'])
+        self.denied = factories.Resource(package_id=dataset['id'])
+        self.private = factories.Resource(package_id=factories.Dataset(
+            owner_org=factories.Organization()['id'], private=True)['id'])
+        create_acls({
+            'resource_id': self.granted['id'],
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': 'download'
+        }, {
+            'resource_id': self.denied['id'],
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': 'none'
+        })
+
+    def _authorize(self, context=None, **kwargs):
+        return helpers.call_action(
+            'resource_authorize_many',
+            context or user_context(self.user, ignore_auth=False), **kwargs)
+
+    def test_permissions(self):
+        ids = [self.granted['id'], self.denied['id'], self.private['id'],
+               u'missing']
+        for permission, expected in [('read', [True, False, False, False]),
+                                     ('download', [True, False, False,
+                                                   False]),
+                                     ('write', [False, False, False, False])]:
+            authorizations = self._authorize(resource_ids=ids,
+                                             permission=permission)
+            assert_equal([authorizations[i] for i in ids], expected,
+                         permission)
+
+    def test_resources_of_datasets(self):
+        assert_equal(
+            self._authorize(package_ids=[self.dataset['id']]), {
+                self.granted['id']: True,
+                self.denied['id']: False
+            })
+
+    def test_other_users_need_sysadmin_rights(self):
+        other = factories.User()
+        assert_raises(NotAuthorized, self._authorize,
+                      user_context(other, ignore_auth=False),
+                      user=self.user['name'],
+                      resource_ids=[self.granted['id']])
+        sysadmin = user_context(factories.Sysadmin())
+        assert_equal(
+            self._authorize(sysadmin, user=self.user['name'],
+                            resource_ids=[self.denied['id']]),
+            {self.denied['id']: False})
+        assert_raises(NotFound, self._authorize, sysadmin, user=u'missing',
+                      resource_ids=[self.granted['id']])
+
+    def test_resources_are_required(self):
+        assert_raises(ValidationError, self._authorize)
+
+
+class TestValidity(DatabaseTest):
+
+    load_plugin = True
+
+    def setup(self):
+        super(TestValidity, self).setup()
+        dataset = factories.Dataset()
+        self.resource = factories.Resource(package_id=dataset['id'])
+        self.user = factories.User()
+
+    def _deny(self, **period):
+        # the dataset is public, only an applying acl denies the resource
+        return create_acls(
+            dict(resource_id=self.resource['id'], auth_type='user',
+                 auth_id=self.user['id'], permission='none', **period))[0]
+
+    def _allowed(self):
+        try:
+            helpers.call_auth('resource_show', user_context(self.user),
+                              id=self.resource['id'])
+        except NotAuthorized:
+            return False
+        return True
+
+    def test_acls_apply_within_their_period(self):
+        now = datetime.datetime.utcnow()
+        day = datetime.timedelta(days=1)
+        acl = self._deny(valid_from=now + day)
+        assert self._allowed()
+        helpers.call_action('resource_acl_patch', id=acl['id'],
+                            valid_from='', valid_until=now - day)
+        assert self._allowed()
+        helpers.call_action('resource_acl_patch', id=acl['id'],
+                            valid_until=now + day)
+        assert not self._allowed()
+
+    def test_patch_clears_the_period(self):
+        acl = self._deny(valid_from=datetime.datetime(2020, 1, 1),
+                         valid_until=datetime.datetime(2030, 1, 1))
+        helpers.call_action('resource_acl_patch', id=acl['id'],
+                            valid_until='')
+        acl = helpers.call_action('resource_acl_show', id=acl['id'])
+        assert_equal(acl['valid_from'], '2020-01-01T00:00:00')
+        assert_equal(acl['valid_until'], None)
+
+    def test_sweep_expired(self):
+        now = datetime.datetime.utcnow()
+        expired = self._deny(valid_until=now - datetime.timedelta(hours=1))
+        create_acls({
+            'resource_id': self.resource['id'],
+            'auth_type': 'authenticated',
+            'auth_id': u'*',
+            'permission': 'read',
+            'valid_until': now + datetime.timedelta(days=1)
+        })
+        assert_equal(lifecycle.sweep_expired(model.Session, archive=True), 1)
+        assert_equal([acl.auth_type for acl in
+                      model.Session.query(ResourceAcl)], ['authenticated'])
+        archived = model.Session.execute(
+            resource_acl_archive_table.select()).fetchall()
+        assert_equal([row['id'] for row in archived], [expired['id']])
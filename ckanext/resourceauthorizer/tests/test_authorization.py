@@ -0,0 +1,232 @@
+"""Tests for the batched acl decisions of logic/auth.py."""
+import datetime
+
+import mock
+from nose.tools import assert_equal, assert_raises
+
+import ckan.model as model
+from ckan.logic import NotAuthorized
+from ckan.tests import factories, helpers
+
+from ckanext.resourceauthorizer import effective
+from ckanext.resourceauthorizer.logic import auth
+from ckanext.resourceauthorizer.logic.auth import (ACL_ALLOW, ACL_DENY,
+                                                   ACL_NO_RULE)
+from ckanext.resourceauthorizer.model import (PERMISSIONS, ResourceAcl,
+                                              permission_rank)
+from ckanext.resourceauthorizer.tests.fixtures import (
+    DatabaseTest, create_acls, principal, user_context)
+
+
+def _reference_decision(acls, resource, principal, permission, now):
+    # the decision on a single resource, from its acls and then those of
+    # its dataset, each scope tier by tier
+    applying = [
+        acl for acl in acls
+        if (acl.valid_from is None or acl.valid_from <= now) and
+        (acl.valid_until is None or acl.valid_until > now) and
+        acl.auth_id in principal.auth_ids(acl.auth_type)
+    ]
+    scopes = [[acl for acl in applying if acl.resource_id == resource.id], [
+        acl for acl in applying
+        if acl.resource_id is None and acl.package_id == resource.package_id
+    ]]
+    for scoped in scopes:
+        for tier in auth.PRINCIPAL_TIERS:
+            ranks = [acl.permission_rank for acl in scoped
+                     if acl.auth_type in tier]
+            if ranks:
+                if max(ranks) >= permission_rank(permission):
+                    return ACL_ALLOW
+                return ACL_DENY
+    return ACL_NO_RULE
+
+
+class TestDecisions(DatabaseTest):
+
+    def setup(self):
+        super(TestDecisions, self).setup()
+        self.user = factories.User()
+        self.other = factories.User()
+        self.sysadmin = factories.Sysadmin()
+        member = [{'name': self.user['name'], 'capacity': 'member'}]
+        self.org = factories.Organization(users=member)
+        self.group = factories.Group(users=member)
+        owner = factories.Organization()
+        self.dataset = factories.Dataset(owner_org=owner['id'])
+        # its acls apply to all its resources
+        self.shared = factories.Dataset(owner_org=owner['id'])
+        self.private = factories.Dataset(owner_org=self.org['id'],
+                                         private=True)
+        self.resources = [
+            factories.Resource(package_id=self.dataset['id'])
+            for _ in range(6)
+        ] + [
+            factories.Resource(package_id=self.shared['id'])
+            for _ in range(4)
+        ] + [
+            factories.Resource(package_id=self.private['id'])
+            for _ in range(2)
+        ]
+        ids = self.ids = [r['id'] for r in self.resources]
+        now = datetime.datetime.utcnow()
+        day = datetime.timedelta(days=1)
+
+        def acl(resource_id, auth_type, auth_id, permission, **extra):
+            return dict(resource_id=resource_id, auth_type=auth_type,
+                        auth_id=auth_id, permission=permission, **extra)
+
+        create_acls(
+            acl(ids[0], 'user', self.user['id'], 'read'),
+            # the acl of the user before those of their organizations
+            acl(ids[1], 'user', self.user['id'], 'none'),
+            acl(ids[1], 'org', self.org['id'], 'manage'),
+            # the best acl of their organizations and groups
+            acl(ids[2], 'org', self.org['id'], 'read'),
+            acl(ids[2], 'group', self.group['id'], 'none'),
+            acl(ids[3], 'group', self.group['id'], 'download'),
+            acl(ids[4], 'authenticated', u'*', 'read'),
+            acl(ids[4], 'anonymous', u'*', 'none'),
+            # an expired acl does not apply any more
+            acl(ids[5], 'user', self.user['id'], 'manage',
+                valid_until=now - day),
+            acl(ids[5], 'org', self.org['id'], 'read'),
+            # the acls of the resource before those of the dataset
+            acl(ids[6], 'org', self.org['id'], 'none'),
+            # an acl that does not apply yet
+            acl(ids[7], 'user', self.user['id'], 'read',
+                valid_from=now + day),
+            acl(ids[8], 'user', self.other['id'], 'none'),
+            acl(None, 'user', self.user['id'], 'download',
+                package_id=self.shared['id']),
+            acl(ids[11], 'user', self.user['id'], 'none'))
+
+    def _check_reference(self):
+        now = datetime.datetime.utcnow()
+        acls = model.Session.query(ResourceAcl).all()
+        resources = model.Session.query(model.Resource).filter(
+            model.Resource.id.in_(self.ids)).all()
+        for user_dict in (self.user, self.other, self.sysadmin, None):
+            user = principal(user_dict)
+            for permission in PERMISSIONS[1:]:
+                decisions = auth.resource_acl_decisions(self.ids, user,
+                                                        permission)
+                for resource in resources:
+                    expected = _reference_decision(acls, resource, user,
+                                                   permission, now)
+                    assert_equal(decisions[resource.id], expected,
+                                 (user, permission, resource.id))
+                    assert_equal(
+                        auth.resource_acl_decision(resource.id, user,
+                                                   permission), expected)
+
+    def test_batched_decisions_match_the_reference(self):
+        self._check_reference()
+
+    @helpers.change_config('ckanext.resourceauthorizer.effective_table',
+                           'true')
+    def test_effective_table_decisions_match_the_reference(self):
+        effective.rebuild(model.Session)
+        self._check_reference()
+
+    def test_precedence(self):
+        A, D, N = ACL_ALLOW, ACL_DENY, ACL_NO_RULE
+        user = principal(self.user)
+        cases = [
+            (user, 'read', [A, D, A, A, A, A, D, A, A, A, N, D]),
+            (user, 'download', [D, D, D, A, D, D, D, A, A, A, N, D]),
+            (principal(self.other), 'read',
+             [N, N, N, N, A, N, N, N, D, N, N, N]),
+            (principal(), 'read', [N, N, N, N, D, N, N, N, N, N, N, N]),
+        ]
+        for user, permission, expected in cases:
+            decisions = auth.resource_acl_decisions(self.ids, user,
+                                                    permission)
+            assert_equal([decisions[i] for i in self.ids], expected,
+                         (user, permission))
+
+    def test_authorized_resources_match_resource_show(self):
+        for user_dict in (self.user, self.other, None):
+            for dataset in (self.dataset, self.shared, self.private):
+                resource_dicts = [
+                    r for r in self.resources
+                    if r['package_id'] == dataset['id']
+                ]
+                expected = [
+                    r for r in resource_dicts if auth.resource_show(
+                        user_context(user_dict), {'id': r['id']})['success']
+                ]
+                assert_equal(
+                    auth.authorized_resources(
+                        user_context(user_dict), dataset['id'],
+                        resource_dicts), expected)
+
+    def test_private_dataset_fallback(self):
+        visible = auth.authorized_resources(
+            user_context(self.user), self.private['id'], self.resources[10:])
+        assert_equal([r['id'] for r in visible], [self.ids[10]])
+        assert_equal(
+            auth.authorized_resources(
+                user_context(self.other), self.private['id'],
+                self.resources[10:]), [])
+
+
+class TestViews(DatabaseTest):
+
+    load_plugin = True
+
+    def setup(self):
+        super(TestViews, self).setup()
+        self.user = factories.User()
+        dataset = factories.Dataset()
+        self.denied = factories.Resource(package_id=dataset['id'])
+        self.deleted = factories.Resource(package_id=dataset['id'])
+        create_acls({
+            'resource_id': self.denied['id'],
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': 'none'
+        })
+        helpers.call_action('resource_delete', id=self.deleted['id'])
+
+    def _view_context(self, resource_dict):
+        # resource_view_show puts the resource of the view in the context
+        return user_context(self.user,
+                            resource=model.Resource.get(resource_dict['id']))
+
+    def test_view_list_follows_the_dataset(self):
+        assert helpers.call_auth('resource_view_list',
+                                 user_context(self.user),
+                                 id=self.denied['id'])
+        assert_raises(NotAuthorized, helpers.call_auth, 'resource_view_show',
+                      self._view_context(self.denied), id=u'view')
+
+    def test_view_list_is_memoized_for_the_request(self):
+        memo = {}
+        with mock.patch.object(auth, 'request_authorizations',
+                               return_value=memo), \
+                mock.patch.object(auth, 'ckan_package_show',
+                                  wraps=auth.ckan_package_show) as show:
+            for _ in range(2):
+                assert helpers.call_auth('resource_view_list',
+                                         user_context(self.user),
+                                         id=self.denied['id'])
+        assert_equal(show.call_count, 1)
+        assert_equal(memo.values(), [True])
+
+    def test_view_list_of_a_missing_resource(self):
+        assert_raises(NotAuthorized, helpers.call_auth, 'resource_view_list',
+                      user_context(self.user), id=u'missing')
+
+    def test_deleted_resources_fall_back_to_the_dataset(self):
+        assert helpers.call_auth('resource_show', user_context(self.user),
+                                 id=self.deleted['id'])
+        assert helpers.call_auth('resource_view_show',
+                                 self._view_context(self.deleted), id=u'view')
+        authorizations = helpers.call_action(
+            'resource_authorize_many', user_context(self.user),
+            resource_ids=[self.deleted['id'], self.denied['id']])
+        assert_equal(authorizations, {
+            self.deleted['id']: True,
+            self.denied['id']: False
+        })
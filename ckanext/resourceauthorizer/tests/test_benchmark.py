@@ -0,0 +1,43 @@
+"""Tests for benchmark.py."""
+from nose.tools import assert_equal
+
+import ckan.model as model
+
+from ckanext.resourceauthorizer.benchmark import (
+    DEFAULT_SIZES, compare, percentiles, rolled_back, seed)
+from ckanext.resourceauthorizer.model import ResourceAcl
+from ckanext.resourceauthorizer.tests.fixtures import DatabaseTest
+
+
+def test_percentiles():
+    timings = [i / 1000.0 for i in range(1, 101)]
+    assert_equal(percentiles(timings), {'p50': 51.0, 'p90': 90.0, 'p99': 99.0})
+    assert_equal(percentiles([]), {})
+
+
+def test_compare():
+    baseline = {'operations': {'resource_show': {'p50': 2.0, 'queries': 4}}}
+    current = {
+        'operations': {
+            'resource_show': {'p50': 1.0, 'queries': 1},
+            'after_show': {'p50': 1.0, 'queries': 1}
+        }
+    }
+    assert_equal(
+        compare(baseline, current),
+        {'resource_show': {'p50': 0.5, 'queries': 0.25}})
+
+
+class TestSeed(DatabaseTest):
+
+    def test_seeded_rows_are_rolled_back(self):
+        users = model.Session.query(model.User).count()
+        sizes = dict(DEFAULT_SIZES, datasets=1, resources_per_dataset=2,
+                     acls_per_resource=2, orgs_per_user=1, users_per_org=1)
+        with rolled_back():
+            data = seed(sizes)
+            assert model.User.by_name(data['user'])
+            assert_equal(model.Session.query(ResourceAcl).count(), 4)
+        assert_equal(model.User.by_name(data['user']), None)
+        assert_equal(model.Session.query(model.User).count(), users)
+        assert_equal(model.Session.query(ResourceAcl).count(), 0)
@@ -0,0 +1,99 @@
+"""Tests for cache.py."""
+import time
+
+from nose.tools import assert_equal
+
+from ckanext.resourceauthorizer.cache import (DecisionCache, MemoryBackend,
+                                              RedisBackend)
+
+
+class FakeRedis(object):
+    '''Local stand-in for the subset of the redis client that is used'''
+
+    def __init__(self):
+        self.data = {}
+
+    def mget(self, keys):
+        now = time.time()
+        return [
+            self.data[k][0]
+            if k in self.data and self.data[k][1] > now else None
+            for k in keys
+        ]
+
+    def setex(self, key, ttl, value):
+        self.data[key] = (value, time.time() + ttl)
+
+    def incr(self, key):
+        value = int(self.mget([key])[0] or 0) + 1
+        self.data[key] = (str(value), float('inf'))
+        return value
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        pass
+
+
+def _check_invalidation(backend):
+    cache = DecisionCache(backend, ttl=60)
+    cached, keys = cache.get_decisions(u'user', [u'r1', u'r2'], 'read')
+    assert_equal(cached, {})
+    cache.set_decisions(keys, {u'r1': u'allow', u'r2': u'deny'})
+
+    cached, keys = cache.get_decisions(u'user', [u'r1', u'r2'], 'read')
+    assert_equal(cached, {u'r1': u'allow', u'r2': u'deny'})
+    assert_equal(keys, {})
+
+    cache.invalidate([u'r1'])
+    cached, keys = cache.get_decisions(u'user', [u'r1', u'r2'], 'read')
+    assert_equal(cached, {u'r2': u'deny'})
+    assert_equal(list(keys), [u'r1'])
+
+
+def test_memory_backend_invalidation():
+    _check_invalidation(MemoryBackend())
+
+
+def test_redis_backend_invalidation():
+    _check_invalidation(RedisBackend(FakeRedis()))
+
+
+def test_memory_backend_lru_eviction():
+    backend = MemoryBackend(size=2)
+    backend.set_many({'a': 1, 'b': 2}, 60)
+    backend.get_many(['a'])
+    backend.set_many({'c': 3}, 60)
+    assert_equal(backend.get_many(['a', 'b', 'c']), [1, None, 3])
+
+
+def test_memory_backend_versions_are_bounded():
+    backend = MemoryBackend(size=3)
+    cache = DecisionCache(backend, ttl=60)
+    cache.set_decisions(
+        cache.get_decisions(u'user', [u'r1'], 'read')[1], {u'r1': u'allow'})
+    for resource_id in range(10):
+        cache.invalidate([u'other-%d' % resource_id])
+        assert len(backend._versions) <= 3
+    # the entries cached before the versions were dropped are unreachable
+    cached, keys = cache.get_decisions(u'user', [u'r1'], 'read')
+    assert_equal(cached, {})
+
+
+def test_memory_backend_ttl():
+    backend = MemoryBackend()
+    backend.set_many({'a': 1}, -1)
+    assert_equal(backend.get_many(['a']), [None])
+
+
+def test_granted_resources_invalidated_by_any_acl_write():
+    cache = DecisionCache(MemoryBackend(), ttl=60)
+    resource_ids, key = cache.get_grants(u'user', 'resources')
+    assert_equal(resource_ids, None)
+    cache.set_grants(key, set([u'r2', u'r1']))
+    assert_equal(cache.get_grants(u'user', 'resources')[0], [u'r1', u'r2'])
+    assert_equal(cache.get_grants(u'user', 'packages')[0], None)
+
+    cache.invalidate([u'r3'])
+    assert_equal(cache.get_grants(u'user', 'resources')[0], None)
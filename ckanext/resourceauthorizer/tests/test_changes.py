@@ -0,0 +1,40 @@
+"""Tests for changes.py."""
+import mock
+from nose.tools import assert_equal
+
+import ckan.model as model
+from ckan.tests import factories
+
+from ckanext.resourceauthorizer import changes
+from ckanext.resourceauthorizer.changes import commit_acl_changes
+from ckanext.resourceauthorizer.tests.fixtures import DatabaseTest
+
+
+@mock.patch('ckanext.resourceauthorizer.cache.invalidate')
+class TestCommitAclChanges(DatabaseTest):
+
+    def setup(self):
+        super(TestCommitAclChanges, self).setup()
+        changes.listen()
+        dataset = factories.Dataset()
+        self.resource_id = factories.Resource(package_id=dataset['id'])['id']
+
+    def test_invalidated_again_once_committed(self, invalidate):
+        commit_acl_changes([self.resource_id], commit=False)
+        assert_equal(invalidate.call_count, 1)
+        model.Session.commit()
+        assert_equal(invalidate.call_count, 2)
+        invalidate.assert_called_with(set([self.resource_id]))
+        # nothing is left for the next transaction
+        model.Session.commit()
+        assert_equal(invalidate.call_count, 2)
+
+    def test_not_invalidated_again_when_rolled_back(self, invalidate):
+        commit_acl_changes([self.resource_id], commit=False)
+        model.Session.rollback()
+        model.Session.commit()
+        assert_equal(invalidate.call_count, 1)
+
+    def test_committed_changes_are_invalidated_once(self, invalidate):
+        commit_acl_changes([self.resource_id])
+        assert_equal(invalidate.call_count, 1)
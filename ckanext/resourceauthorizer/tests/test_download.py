@@ -0,0 +1,97 @@
+"""Tests for the download permission: its auth function, the routes it
+overrides and their controller action.
+"""
+import mock
+from nose.tools import assert_equal, assert_raises
+from routes import Mapper
+
+import ckan.plugins as plugins
+from ckan.logic import NotAuthorized
+from ckan.tests import factories, helpers
+
+from ckanext.resourceauthorizer import controller
+from ckanext.resourceauthorizer.tests.fixtures import (DatabaseTest,
+                                                       create_acls,
+                                                       user_context)
+
+CONTROLLER = \
+    'ckanext.resourceauthorizer.controller:ResourceAuthorizerController'
+
+
+class TestDownload(DatabaseTest):
+
+    load_plugin = True
+
+    def setup(self):
+        super(TestDownload, self).setup()
+        self.user = factories.User()
+        dataset = factories.Dataset()
+        private = factories.Dataset(owner_org=factories.Organization()['id'],
+                                    private=True)
+        self.resources = dict(
+            (name, factories.Resource(package_id=package['id']))
+            for name, package in [('read', dataset), ('download', dataset),
+                                  ('public', dataset), ('private', private)])
+        create_acls(*[{
+            'resource_id': self.resources[permission]['id'],
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': permission
+        } for permission in ('read', 'download')])
+
+    def _allowed(self, name):
+        try:
+            return helpers.call_auth('resource_download',
+                                     user_context(self.user),
+                                     id=self.resources[name]['id'])
+        except NotAuthorized:
+            return False
+
+    def test_download_needs_the_download_permission(self):
+        assert not self._allowed('read')
+        assert self._allowed('download')
+        assert helpers.call_auth('resource_show', user_context(self.user),
+                                 id=self.resources['read']['id'])
+
+    def test_no_rule_falls_back_to_the_dataset(self):
+        assert self._allowed('public')
+        assert not self._allowed('private')
+
+    def test_download_routes(self):
+        mapper = Mapper()
+        plugins.get_plugin('resourceauthorizer').before_map(mapper)
+        for path in ('/dataset/d/resource/r/download',
+                     '/dataset/d/resource/r/download/data.csv'):
+            match = mapper.match(path)
+            assert_equal((match['controller'], match['action']),
+                         (CONTROLLER, 'resource_download'))
+
+
+class AbortError(Exception):
+    pass
+
+
+@mock.patch.object(controller, 'c', mock.Mock(user=u'someone'))
+@mock.patch.object(controller, '_', lambda message: message)
+@mock.patch.object(controller, 'abort', mock.Mock(side_effect=AbortError))
+@mock.patch.object(controller, 'PackageController')
+@mock.patch.object(controller, 'check_access')
+class TestDownloadController(object):
+
+    def test_allowed_downloads_go_to_ckan(self, check_access,
+                                          package_controller):
+        controller.ResourceAuthorizerController().resource_download(
+            'd', 'r', 'data.csv')
+        assert_equal(check_access.call_args[0][0], 'resource_download')
+        package_controller.return_value.resource_download.\
+            assert_called_once_with('d', 'r', 'data.csv')
+
+    def test_denied_downloads_are_refused(self, check_access,
+                                          package_controller):
+        check_access.side_effect = NotAuthorized
+        assert_raises(
+            AbortError,
+            controller.ResourceAuthorizerController().resource_download, 'd',
+            'r')
+        assert not package_controller.return_value.resource_download.called
+        assert_equal(controller.abort.call_args[0][0], 403)
@@ -0,0 +1,110 @@
+"""Tests for the resource_acl_effective maintenance of effective.py."""
+import datetime
+
+from nose.tools import assert_equal
+
+import ckan.model as model
+from ckan.tests import factories, helpers
+
+from ckanext.resourceauthorizer import effective
+from ckanext.resourceauthorizer.model import (permission_rank,
+                                              resource_acl_effective_table)
+from ckanext.resourceauthorizer.tests.fixtures import DatabaseTest, create_acls
+
+
+def _effective(user_dicts):
+    table = resource_acl_effective_table
+    return sorted(
+        tuple(row) for row in model.Session.execute(
+            table.select().with_only_columns(
+                [table.c.user_id, table.c.resource_id,
+                 table.c.permission_rank]).where(
+                     table.c.user_id.in_([u['id'] for u in user_dicts]))))
+
+
+class TestEffective(DatabaseTest):
+
+    load_plugin = True
+
+    def setup(self):
+        super(TestEffective, self).setup()
+        effective.listen()
+        self.user = factories.User()
+        self.member = factories.User()
+        self.org = factories.Organization(
+            users=[{'name': self.member['name'], 'capacity': 'member'}])
+        self.dataset = factories.Dataset()
+        self.resource = factories.Resource(package_id=self.dataset['id'])
+
+    def _effective(self):
+        # the creator of the organization is one of its admins too
+        return _effective([self.user, self.member])
+
+    def _row(self, user_dict, permission):
+        return (user_dict['id'], self.resource['id'],
+                permission_rank(permission))
+
+    @helpers.change_config('ckanext.resourceauthorizer.effective_table',
+                           'true')
+    def test_acl_changes_refresh_the_table(self):
+        acl = helpers.call_action(
+            'resource_acl_create', resource_id=self.resource['id'],
+            auth_type='user', auth_id=self.user['id'], permission='read')
+        helpers.call_action(
+            'resource_acl_create', resource_id=self.resource['id'],
+            auth_type='org', auth_id=self.org['id'], permission='download')
+        assert_equal(self._effective(), sorted([
+            self._row(self.user, 'read'),
+            self._row(self.member, 'download')
+        ]))
+        helpers.call_action('resource_acl_patch', id=acl['id'],
+                            permission='manage')
+        assert_equal(self._effective(), sorted([
+            self._row(self.user, 'manage'),
+            self._row(self.member, 'download')
+        ]))
+        helpers.call_action('resource_acl_delete', id=acl['id'])
+        assert_equal(self._effective(), [self._row(self.member, 'download')])
+
+    @helpers.change_config('ckanext.resourceauthorizer.effective_table',
+                           'true')
+    def test_membership_changes_refresh_the_table(self):
+        helpers.call_action(
+            'resource_acl_create', resource_id=self.resource['id'],
+            auth_type='org', auth_id=self.org['id'], permission='read')
+        helpers.call_action('organization_member_create', id=self.org['id'],
+                            username=self.user['name'], role='member')
+        assert_equal(self._effective(), sorted([
+            self._row(self.user, 'read'),
+            self._row(self.member, 'read')
+        ]))
+        helpers.call_action('organization_member_delete', id=self.org['id'],
+                            username=self.member['name'])
+        assert_equal(self._effective(), [self._row(self.user, 'read')])
+
+    def test_rebuild_leaves_out_the_excluded_acls(self):
+        other = factories.Resource(package_id=self.dataset['id'])
+        create_acls({
+            'resource_id': self.resource['id'],
+            'auth_type': 'org',
+            'auth_id': self.org['id'],
+            'permission': 'write'
+        }, {
+            'resource_id': self.resource['id'],
+            'auth_type': 'authenticated',
+            'auth_id': u'*',
+            'permission': 'read'
+        }, {
+            'resource_id': other['id'],
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': 'read',
+            'valid_until': datetime.datetime(2030, 1, 1)
+        }, {
+            'package_id': self.dataset['id'],
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': 'download'
+        })
+        effective.rebuild(model.Session)
+        assert_equal(self._effective(), [self._row(self.member, 'write')])
@@ -0,0 +1,67 @@
+"""Tests for the monthly partitions of the acl history."""
+import datetime
+
+import mock
+from nose.tools import assert_equal
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+from ckanext.resourceauthorizer import model
+from ckanext.resourceauthorizer.model import (
+    month_start, create_history_partitions, create_history_table,
+    resource_acl_table,
+    resource_acl_effective_table, resource_acl_archive_table,
+    resource_acl_reindex_table, resource_acl_history_table)
+
+
+def test_month_start():
+    moment = datetime.datetime(2019, 12, 31, 23, 59)
+    assert_equal(month_start(moment), datetime.datetime(2019, 12, 1))
+    assert_equal(month_start(moment, 1), datetime.datetime(2020, 1, 1))
+    assert_equal(month_start(moment, -12), datetime.datetime(2018, 12, 1))
+
+
+def test_tables_on_sqlite():
+    engine = create_engine('sqlite://')
+    for table in (resource_acl_table, resource_acl_effective_table,
+                  resource_acl_archive_table, resource_acl_reindex_table):
+        table.create(bind=engine)
+    create_history_table(engine)
+    assert_equal(
+        sorted(inspect(engine).get_table_names()), [
+            'resource_acl', 'resource_acl_archive', 'resource_acl_effective',
+            'resource_acl_history', 'resource_acl_reindex'
+        ])
+
+    # the ids are generated
+    now = datetime.datetime.utcnow()
+    engine.execute(resource_acl_history_table.insert().values(
+        [{'changed': now, 'action': u'create'},
+         {'changed': now, 'action': u'delete'}]))
+    assert_equal([row[0] for row in engine.execute(
+        resource_acl_history_table.select().order_by(
+            resource_acl_history_table.c.id))], [1, 2])
+
+
+@mock.patch.dict(model._history, {'months': set()})
+def test_partitions_are_remembered_once_committed():
+    session = sessionmaker(bind=create_engine('sqlite://'))()
+    moment = datetime.datetime(2030, 1, 15)
+    months = [datetime.datetime(2030, 1, 1), datetime.datetime(2030, 2, 1)]
+    # on PostgreSQL, to_regclass finds the partitions created by the
+    # transaction itself
+    with mock.patch.object(session, 'execute') as execute:
+        execute.return_value.scalar.return_value = None
+        create_history_partitions(session, moment)
+        assert_equal(execute.call_count, 4)
+        execute.return_value.scalar.return_value = 'partition'
+        create_history_partitions(session, moment)
+        assert_equal(execute.call_count, 4)
+        assert_equal(model._history['months'], set())
+        # rolled back with the acl write, they are created again
+        session.rollback()
+        execute.return_value.scalar.return_value = None
+        create_history_partitions(session, moment)
+        assert_equal(execute.call_count, 8)
+        session.commit()
+    assert_equal(model._history['months'], set(months))
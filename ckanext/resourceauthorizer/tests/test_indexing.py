@@ -0,0 +1,34 @@
+"""Tests for indexing.py."""
+from nose.tools import assert_equal
+
+from ckan.tests import factories, helpers
+
+from ckanext.resourceauthorizer import indexing
+from ckanext.resourceauthorizer.tests.fixtures import DatabaseTest, create_acls
+
+
+class TestAclPackageIds(DatabaseTest):
+
+    def test_datasets_with_resource_or_dataset_acls(self):
+        user = factories.User()
+        with_resource_acls = factories.Dataset()
+        with_dataset_acls = factories.Dataset()
+        deleted = factories.Dataset()
+        factories.Dataset()
+        resource = factories.Resource(package_id=with_resource_acls['id'])
+        for dataset in (with_dataset_acls, deleted):
+            factories.Resource(package_id=dataset['id'])
+        create_acls(*[
+            dict(resource_id=resource_id, package_id=package_id,
+                 auth_type='user', auth_id=user['id'], permission='read')
+            for resource_id, package_id in [
+                (resource['id'], with_resource_acls['id']),
+                (None, with_resource_acls['id']),
+                (None, with_dataset_acls['id']),
+                (None, deleted['id']),
+            ]
+        ])
+        helpers.call_action('package_delete', id=deleted['id'])
+        assert_equal(
+            sorted(indexing.acl_package_ids()),
+            sorted([with_resource_acls['id'], with_dataset_acls['id']]))
@@ -0,0 +1,95 @@
+"""Tests for jobs.py."""
+import mock
+from nose.tools import assert_equal
+
+import ckan.lib.jobs as ckan_jobs
+import ckan.model as model
+from ckan.tests import factories, helpers
+
+from ckanext.resourceauthorizer import jobs
+from ckanext.resourceauthorizer.jobs import JobProgress
+from ckanext.resourceauthorizer.model import ResourceAcl
+from ckanext.resourceauthorizer.tests.fixtures import (DatabaseTest,
+                                                       user_context)
+
+
+class FakeJob(object):
+    '''Local stand-in for an rq job'''
+
+    def __init__(self):
+        self.meta = {}
+        self.saved = 0
+
+    def save_meta(self):
+        self.saved += 1
+
+
+def test_progress():
+    job = FakeJob()
+    progress = JobProgress(job, 4)
+    progress.applied(0, [{'success': True}, {'success': True}])
+    progress.applied(2, [{'success': True}, {'success': False,
+                                             'error': 'not found'}])
+    assert_equal(job.meta['done'], 4)
+    assert_equal(job.meta['failed'], 1)
+    assert_equal(job.meta['errors'], [{'index': 3, 'error': 'not found'}])
+
+    progress.reindexing(2)
+    progress.reindexed(2)
+    summary = progress.finished()
+    assert_equal(summary['stage'], 'finished')
+    assert_equal(summary['reindexed'], 2)
+    assert_equal(job.saved, 6)
+
+
+class TestBackgroundBulkActions(DatabaseTest):
+
+    load_plugin = True
+
+    def setup(self):
+        super(TestBackgroundBulkActions, self).setup()
+        ckan_jobs.get_queue(jobs.queue_name()).empty()
+        self.context = user_context(factories.Sysadmin())
+        self.dataset = factories.Dataset()
+        self.resource = factories.Resource(package_id=self.dataset['id'])
+
+    def _run(self, action, **kwargs):
+        # queue the job, then run it with a worker in this process
+        job_id = helpers.call_action(action, dict(self.context),
+                                     background=True, **kwargs)['job_id']
+        status = helpers.call_action('resource_acl_job_status',
+                                     dict(self.context), id=job_id)
+        assert_equal(status['status'], 'queued')
+        jobs.work()
+        return helpers.call_action('resource_acl_job_status',
+                                   dict(self.context), id=job_id)
+
+    @mock.patch('ckanext.resourceauthorizer.indexing.reindex_packages')
+    def test_bulk_create_and_delete(self, reindex_packages):
+        users = [factories.User() for _ in range(2)]
+        acls = [{
+            'resource_id': self.resource['id'],
+            'auth_type': 'user',
+            'auth_id': user['id'],
+            'permission': 'read'
+        } for user in users] + [{
+            'resource_id': u'missing',
+            'auth_type': 'authenticated',
+            'permission': 'read'
+        }]
+        status = self._run('resource_acl_bulk_create', acls=acls)
+        assert_equal((status['status'], status['stage']),
+                     ('finished', 'finished'))
+        assert_equal((status['total'], status['done'], status['failed']),
+                     (3, 3, 1))
+        assert_equal(status['errors'][0]['index'], 2)
+        assert_equal(
+            sorted(acl.auth_id for acl in model.Session.query(ResourceAcl)),
+            sorted(user['id'] for user in users))
+        assert_equal(reindex_packages.call_args[0][0], [self.dataset['id']])
+
+        ids = [acl.id for acl in model.Session.query(ResourceAcl)]
+        status = self._run('resource_acl_bulk_delete', ids=ids)
+        assert_equal((status['status'], status['done'], status['failed']),
+                     ('finished', 2, 0))
+        assert_equal(model.Session.query(ResourceAcl).count(), 0)
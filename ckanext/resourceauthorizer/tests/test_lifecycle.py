@@ -0,0 +1,78 @@
+"""Tests for the acl cleanup of lifecycle.py."""
+from nose.tools import assert_equal
+
+import ckan.model as model
+from ckan.tests import factories, helpers
+
+from ckanext.resourceauthorizer import lifecycle
+from ckanext.resourceauthorizer.model import ResourceAcl
+from ckanext.resourceauthorizer.tests.fixtures import DatabaseTest, create_acls
+
+
+def _acl_count():
+    return model.Session.query(ResourceAcl).count()
+
+
+class TestLifecycle(DatabaseTest):
+
+    def setup(self):
+        super(TestLifecycle, self).setup()
+        lifecycle.listen()
+        self.user = factories.User()
+        self.dataset = factories.Dataset()
+        self.resource = factories.Resource(package_id=self.dataset['id'])
+        create_acls({
+            'resource_id': self.resource['id'],
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': 'read'
+        }, {
+            'package_id': self.dataset['id'],
+            'auth_type': 'authenticated',
+            'auth_id': u'*',
+            'permission': 'download'
+        })
+
+    def test_deleted_resources_and_datasets_keep_their_acls(self):
+        helpers.call_action('resource_delete', id=self.resource['id'])
+        assert_equal(_acl_count(), 2)
+        helpers.call_action('package_delete', id=self.dataset['id'])
+        assert_equal(_acl_count(), 2)
+
+    def test_vacuum_deletes_the_acls_of_deleted_datasets(self):
+        helpers.call_action('package_delete', id=self.dataset['id'])
+        totals = lifecycle.vacuum(model.Session)
+        assert_equal((totals['resource'], totals['package']), (1, 1))
+        assert_equal(_acl_count(), 0)
+
+    def test_purged_datasets_lose_their_acls(self):
+        helpers.call_action('dataset_purge', id=self.dataset['id'])
+        assert_equal(_acl_count(), 0)
+
+    def test_deleted_users_and_organizations_keep_their_acls(self):
+        org = factories.Organization()
+        create_acls({
+            'resource_id': self.resource['id'],
+            'auth_type': 'org',
+            'auth_id': org['id'],
+            'permission': 'read'
+        })
+        helpers.call_action('user_delete', id=self.user['id'])
+        helpers.call_action('organization_delete', id=org['id'])
+        assert_equal(_acl_count(), 3)
+        totals = lifecycle.vacuum(model.Session)
+        assert_equal((totals['user'], totals['org']), (1, 1))
+        assert_equal(_acl_count(), 1)
+
+    def test_purged_groups_lose_their_acls(self):
+        group = factories.Group()
+        create_acls({
+            'resource_id': self.resource['id'],
+            'auth_type': 'group',
+            'auth_id': group['id'],
+            'permission': 'read'
+        })
+        helpers.call_action('group_purge', id=group['id'])
+        acls = model.Session.query(ResourceAcl).all()
+        assert_equal(sorted(acl.auth_type for acl in acls),
+                     ['authenticated', 'user'])
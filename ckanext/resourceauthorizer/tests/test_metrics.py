@@ -0,0 +1,30 @@
+"""Tests for metrics.py."""
+import mock
+from nose.tools import assert_equal, assert_is_none
+
+from ckanext.resourceauthorizer import metrics
+
+
+class TestOutsideRequests(object):
+
+    def setup(self):
+        metrics.registry.reset()
+
+    def test_only_the_registry_counts_outside_requests(self):
+        counted = metrics.instrumented('counted', lambda: None)
+        with mock.patch.object(metrics, '_listen'), \
+                mock.patch.dict(metrics._state, {'enabled': True}):
+            for _ in range(3):
+                counted()
+                metrics.record_cache(2, 1)
+                metrics.record_filtered('dataset', 4, 1)
+            # a paster command or a background job is never over, nothing
+            # is kept for it between calls
+            assert_is_none(metrics.current())
+        snapshot = metrics.registry.snapshot()
+        assert_equal(snapshot['timings']['counted']['count'], 3)
+        assert_equal(snapshot['counters'], {
+            'cache_hits': 6,
+            'cache_misses': 3,
+            'resources_filtered': 9
+        })
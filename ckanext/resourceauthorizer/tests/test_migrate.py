@@ -0,0 +1,55 @@
+"""Tests for the migration of migrate-db."""
+import datetime
+
+from nose.tools import assert_equal, assert_raises
+from sqlalchemy.exc import IntegrityError
+
+import ckan.model as model
+from ckan.tests import factories
+
+from ckanext.resourceauthorizer import model as resourceauthorizer_model
+from ckanext.resourceauthorizer.model import ResourceAcl
+from ckanext.resourceauthorizer.model import insert_acls
+from ckanext.resourceauthorizer.tests.fixtures import DatabaseTest, create_acls
+
+
+class TestMigrate(DatabaseTest):
+
+    def setup(self):
+        super(TestMigrate, self).setup()
+        self.user = factories.User()
+        self.dataset = factories.Dataset()
+        self.resource = factories.Resource(package_id=self.dataset['id'])
+        # the tables of an installation predating the unique constraints
+        model.Session.execute('ALTER TABLE resource_acl '
+                              'DROP CONSTRAINT resource_acl_principal_key')
+        model.Session.execute('DROP INDEX resource_acl_package_principal_key')
+        model.Session.commit()
+
+    def _acl(self, scope, permission, days_ago):
+        modified = datetime.datetime.utcnow() - datetime.timedelta(days_ago)
+        return dict(scope, auth_type='user', auth_id=self.user['id'],
+                    permission=permission, last_modified=modified)
+
+    def test_migrate_removes_conflicting_acls(self):
+        for scope in ({'resource_id': self.resource['id']},
+                      {'package_id': self.dataset['id']}):
+            create_acls(self._acl(scope, 'read', 2),
+                        self._acl(scope, 'manage', 1),
+                        self._acl(scope, 'download', 3))
+
+        resourceauthorizer_model.migrate()
+
+        # the most recently modified acl remains
+        acls = model.Session.query(ResourceAcl).order_by(
+            ResourceAcl.package_id).all()
+        assert_equal([(acl.resource_id, acl.package_id, acl.permission)
+                      for acl in acls],
+                     [(None, self.dataset['id'], 'manage'),
+                      (self.resource['id'], None, 'manage')])
+
+        for scope in ({'resource_id': self.resource['id']},
+                      {'package_id': self.dataset['id']}):
+            assert_raises(IntegrityError, insert_acls,
+                          [self._acl(scope, 'read', 0)])
+            model.Session.rollback()
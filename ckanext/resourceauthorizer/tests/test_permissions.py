@@ -0,0 +1,73 @@
+"""Tests for the permission levels."""
+import mock
+from nose.tools import assert_equal, assert_raises
+from sqlalchemy import create_engine
+
+from ckan.plugins.toolkit import Invalid
+
+from ckanext.resourceauthorizer import model
+from ckanext.resourceauthorizer.logic.validators import acl_scope_validator
+from ckanext.resourceauthorizer.logic.validators import permission_validator
+from ckanext.resourceauthorizer.model import PERMISSIONS, permission_rank
+from ckanext.resourceauthorizer.model import principal_key
+
+
+def test_ranks_follow_the_levels():
+    ranks = [permission_rank(permission) for permission in PERMISSIONS]
+    assert_equal(ranks, sorted(ranks))
+    assert_equal(permission_rank('none'), 0)
+    assert permission_rank('manage') > permission_rank('write') > \
+        permission_rank('download') > permission_rank('read')
+
+
+def test_permission_validator():
+    for permission in PERMISSIONS:
+        assert_equal(permission_validator(permission), permission)
+    assert_raises(Invalid, permission_validator, 'admin')
+
+
+def test_acl_scope_validator():
+    for data, valid in (({('resource_id', ): 'r'}, True),
+                        ({('package_id', ): 'p'}, True),
+                        ({('resource_id', ): 'r', ('package_id', ): 'p'},
+                         False), ({}, False)):
+        errors = {}
+        acl_scope_validator(('__after', ), data, errors, {})
+        assert_equal(not errors, valid)
+
+
+def test_principal_key_of_dataset_acls():
+    assert_equal(
+        principal_key({'resource_id': 'r', 'package_id': 'p',
+                       'auth_type': 'user', 'auth_id': 'u'}),
+        ('r', None, 'user', 'u'))
+    assert_equal(
+        principal_key({'package_id': 'p', 'auth_type': 'user',
+                       'auth_id': 'u'}), (None, 'p', 'user', 'u'))
+
+
+def test_permission_rank_migration_runs_once():
+    engine = create_engine('sqlite://')
+    engine.execute(
+        'CREATE TABLE resource_acl (id TEXT PRIMARY KEY, resource_id TEXT, '
+        'auth_type TEXT, auth_id TEXT, permission TEXT)')
+    for acl_id, permission in (('a', 'read'), ('b', 'none')):
+        engine.execute(
+            "INSERT INTO resource_acl VALUES ('%s', 'r', 'user', '%s', '%s')"
+            % (acl_id, acl_id, permission))
+
+    def acls():
+        return engine.execute('SELECT id, permission, permission_rank '
+                              'FROM resource_acl ORDER BY id').fetchall()
+
+    with mock.patch.object(model.log, 'info') as info:
+        model._migrate_permission_ranks(engine)
+    # read used to include downloading
+    assert_equal(acls(), [('a', 'download', permission_rank('download')),
+                          ('b', 'none', 0)])
+    assert_equal(info.call_args[0][1], 1)
+
+    engine.execute("INSERT INTO resource_acl VALUES "
+                   "('c', 'r', 'user', 'c', 'read', NULL)")
+    model._migrate_permission_ranks(engine)
+    assert_equal(acls()[2], ('c', 'read', permission_rank('read')))
@@ -1,5 +1,60 @@
 """Tests for plugin.py."""
-import ckanext.resourceauthorizer.plugin as plugin
+import mock
+from nose.tools import assert_equal
 
-def test_plugin():
-    pass
\ No newline at end of file
+import ckan.plugins as plugins
+from ckan.tests import factories, helpers
+
+from ckanext.resourceauthorizer.tests.fixtures import (DatabaseTest,
+                                                       create_acls,
+                                                       user_context)
+
+
+class TestResourceFiltering(DatabaseTest):
+
+    load_plugin = True
+
+    def setup(self):
+        super(TestResourceFiltering, self).setup()
+        self.user = factories.User()
+        self.dataset = factories.Dataset()
+        self.visible = factories.Resource(package_id=self.dataset['id'])
+        self.hidden = factories.Resource(package_id=self.dataset['id'])
+        create_acls({
+            'resource_id': self.hidden['id'],
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': 'none'
+        })
+        self.plugin = plugins.get_plugin('resourceauthorizer')
+
+    def _search_results(self):
+        # as package_search returns them, with all the resources
+        package_dict = helpers.call_action('package_show',
+                                           id=self.dataset['id'])
+        return {'count': 1, 'results': [package_dict]}
+
+    def test_after_show(self):
+        package_dict = helpers.call_action(
+            'package_show', user_context(self.user, ignore_auth=False),
+            id=self.dataset['id'])
+        assert_equal([r['id'] for r in package_dict['resources']],
+                     [self.visible['id']])
+        package_dict = helpers.call_action(
+            'package_show', user_context(factories.User(),
+                                         ignore_auth=False),
+            id=self.dataset['id'])
+        assert_equal(len(package_dict['resources']), 2)
+
+    def test_after_search(self):
+        with mock.patch('ckanext.resourceauthorizer.plugin.toolkit') as tk:
+            tk.c.user = self.user['name']
+            results = self.plugin.after_search(self._search_results(), {})
+        package_dict = results['results'][0]
+        assert_equal([r['id'] for r in package_dict['resources']],
+                     [self.visible['id']])
+        assert_equal(package_dict['num_resources'], 1)
+
+    def test_after_search_outside_of_requests(self):
+        results = self.plugin.after_search(self._search_results(), {})
+        assert_equal(len(results['results'][0]['resources']), 2)
@@ -0,0 +1,85 @@
+"""Tests for principal.py and the acls of groups and roles."""
+import mock
+from nose.tools import assert_equal, assert_false, assert_is
+
+from ckan.tests import factories, helpers
+
+from ckanext.resourceauthorizer import principal as principal_module
+from ckanext.resourceauthorizer.principal import (get_principal,
+                                                  reset_cache_stats)
+from ckanext.resourceauthorizer.tests.fixtures import (DatabaseTest,
+                                                       principal,
+                                                       user_context)
+
+
+class TestPrincipal(DatabaseTest):
+
+    load_plugin = True
+
+    def setup(self):
+        super(TestPrincipal, self).setup()
+        self.user = factories.User()
+        member = [{'name': self.user['name'], 'capacity': 'member'}]
+        self.org = factories.Organization(users=member)
+        self.group = factories.Group(users=member)
+        deleted = factories.Group(users=member)
+        helpers.call_action('group_delete', id=deleted['id'])
+
+    def test_memberships_and_roles(self):
+        user = principal(self.user)
+        assert_equal(user.org_ids, frozenset([self.org['id']]))
+        assert_equal(user.group_ids, frozenset([self.group['id']]))
+        assert_equal(user.roles, frozenset(['authenticated']))
+        assert_equal(user.auth_ids('group'), [self.group['id']])
+        assert_equal(user.auth_ids('authenticated'), [u'*'])
+        assert_equal(user.auth_ids('anonymous'), [])
+        assert_equal(
+            principal(factories.Sysadmin()).roles,
+            frozenset(['authenticated', 'sysadmin']))
+        anonymous = principal()
+        assert_false(anonymous)
+        assert_equal(anonymous.roles, frozenset(['anonymous']))
+        assert_equal(anonymous.auth_ids('user'), [])
+
+    def test_principal_is_resolved_once_per_context(self):
+        context = {'user': self.user['name']}
+        assert_is(get_principal(context), get_principal(context))
+
+    def test_cache_hits_and_misses_of_a_request(self):
+        reset_cache_stats()
+        request_store = {}
+        with mock.patch.object(principal_module, 'request_store',
+                               return_value=request_store):
+            # two auth functions of the same request, each with a context
+            first = get_principal({'user': self.user['name']})
+            second = get_principal({'user': self.user['name']})
+        assert_is(first, second)
+        counters = helpers.call_action('resource_authorizer_metrics',
+                                       reset=True)['counters']
+        assert_equal(counters['principal_cache_hits'], 1)
+        assert_equal(counters['principal_cache_misses'], 1)
+        counters = helpers.call_action(
+            'resource_authorizer_metrics')['counters']
+        assert_equal(counters['principal_cache_misses'], 0)
+
+    def test_group_and_role_acls(self):
+        dataset = factories.Dataset()
+        resource = factories.Resource(package_id=dataset['id'])
+        acl = helpers.call_action(
+            'resource_acl_create', resource_id=resource['id'],
+            auth_type='anonymous', permission='none')
+        assert_equal(acl['auth_id'], u'*')
+        helpers.call_action(
+            'resource_acl_create', resource_id=resource['id'],
+            auth_type='group', auth_id=self.group['id'], permission='read')
+
+        def allowed(user_dict):
+            context = user_context(user_dict, ignore_auth=False)
+            return helpers.call_action(
+                'resource_authorize_many', context,
+                resource_ids=[resource['id']])[resource['id']]
+
+        assert allowed(self.user)
+        # other users fall back to the public dataset
+        assert allowed(factories.User())
+        assert_false(allowed(None))
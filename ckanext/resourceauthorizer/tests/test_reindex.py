@@ -0,0 +1,85 @@
+"""Tests for reindex.py."""
+import mock
+from nose.tools import assert_equal
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ckan.tests import helpers
+
+from ckanext.resourceauthorizer import reindex
+from ckanext.resourceauthorizer.model import resource_acl_reindex_table
+from ckanext.resourceauthorizer.reindex import (pending_count, process,
+                                                record_packages,
+                                                reindex_pending, schedule)
+
+
+def test_requests_are_coalesced_on_sqlite():
+    engine = create_engine('sqlite://')
+    resource_acl_reindex_table.create(bind=engine)
+    session = sessionmaker(bind=engine)()
+    record_packages(session, [u'p1', u'p2'])
+    record_packages(session, [u'p1'])
+    assert_equal(
+        session.query(resource_acl_reindex_table).count(), 3)
+    assert_equal(pending_count(session), 2)
+
+
+@helpers.change_config('ckanext.resourceauthorizer.reindex.delayed_jobs',
+                       'true')
+@mock.patch('ckanext.resourceauthorizer.reindex.process')
+@mock.patch('ckanext.resourceauthorizer.reindex._enqueue')
+@mock.patch('ckanext.resourceauthorizer.reindex._quiet_delay')
+def test_job_requeued_while_acls_change(quiet_delay, enqueue, process):
+    quiet_delay.return_value = 4
+    assert_equal(reindex_pending(100.0), 0)
+    enqueue.assert_called_once_with(4, 100.0)
+    assert not process.called
+
+    quiet_delay.return_value = 0
+    process.return_value = 3
+    assert_equal(reindex_pending(100.0), 3)
+    assert_equal(enqueue.call_count, 1)
+
+
+
+class FakeJob(object):
+
+    def __init__(self):
+        self.status = 'queued'
+
+    def get_status(self):
+        return self.status
+
+
+@mock.patch.dict(reindex._state, clear=True)
+@mock.patch('ckanext.resourceauthorizer.indexing.reindex_packages')
+@mock.patch('ckanext.resourceauthorizer.reindex._enqueue')
+def test_writes_after_the_job_started_are_reindexed(enqueue,
+                                                    reindex_packages):
+    engine = create_engine('sqlite://')
+    resource_acl_reindex_table.create(bind=engine)
+    session = sessionmaker(bind=engine)()
+    enqueue.side_effect = lambda delay, started: FakeJob()
+
+    def write(package_id):
+        record_packages(session, [package_id])
+        session.commit()
+        schedule()
+
+    write(u'p1')
+    job = reindex._state['job']
+    # the job has not started, it reindexes this write too
+    write(u'p2')
+    assert_equal(enqueue.call_count, 1)
+
+    job.status = 'started'
+    process(session)
+    # within the debounce delay, but after the job started
+    write(u'p3')
+    assert_equal(enqueue.call_count, 2)
+    process(session)
+
+    reindexed = [sorted(call[0][0])
+                 for call in reindex_packages.call_args_list]
+    assert_equal(reindexed, [[u'p1', u'p2'], [u'p3']])
+    assert_equal(pending_count(session), 0)
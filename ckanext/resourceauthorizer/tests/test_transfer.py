@@ -0,0 +1,120 @@
+"""Tests for the acl export and import of transfer.py."""
+import datetime
+import json
+from StringIO import StringIO
+
+from nose.tools import assert_equal
+
+import ckan.model as model
+from ckan.tests import factories
+
+from ckanext.resourceauthorizer import transfer
+from ckanext.resourceauthorizer.model import resource_acl_table
+from ckanext.resourceauthorizer.tests.fixtures import DatabaseTest, create_acls
+
+
+class TestTransfer(DatabaseTest):
+
+    def setup(self):
+        super(TestTransfer, self).setup()
+        self.dataset = factories.Dataset()
+        self.resource = factories.Resource(package_id=self.dataset['id'])
+        self.user = factories.User()
+        self.org = factories.Organization()
+        create_acls({
+            'resource_id': self.resource['id'],
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': 'read',
+            'valid_until': datetime.datetime(2030, 1, 1, 12, 30)
+        }, {
+            'resource_id': self.resource['id'],
+            'auth_type': 'anonymous',
+            'auth_id': u'*',
+            'permission': 'none'
+        }, {
+            'package_id': self.dataset['id'],
+            'auth_type': 'org',
+            'auth_id': self.org['id'],
+            'permission': 'download'
+        })
+
+    def _acls(self):
+        return model.Session.query(*transfer.COLUMNS).order_by(
+            resource_acl_table.c.id).all()
+
+    def _clear(self):
+        model.Session.execute(resource_acl_table.delete())
+        model.Session.commit()
+
+    def test_round_trip(self):
+        acls = self._acls()
+        for fmt in transfer.FORMATS:
+            out = StringIO()
+            assert_equal(transfer.export_acls(out, fmt), 3)
+            self._clear()
+            totals = transfer.import_acls(StringIO(out.getvalue()), fmt)
+            assert_equal((totals['inserted'], totals['skipped']), (3, 0),
+                         fmt)
+            assert_equal(self._acls(), acls, fmt)
+
+    def test_import_updates_and_skips(self):
+        lines = [{
+            'resource_id': self.resource['id'],
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': 'manage'
+        }, {
+            'resource_id': u'missing',
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': 'read'
+        }, {
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': 'read'
+        }]
+        input = StringIO('\n'.join([json.dumps(line) for line in lines] +
+                                   ['not json']))
+        totals = transfer.import_acls(input)
+        assert_equal(totals, {
+            'read': 4,
+            'inserted': 0,
+            'updated': 1,
+            'unchanged': 0,
+            'skipped': 3
+        })
+        permissions = dict((acl.auth_id, acl.permission)
+                           for acl in self._acls())
+        assert_equal(permissions[self.user['id']], 'manage')
+
+    def test_dry_run(self):
+        out = StringIO()
+        transfer.export_acls(out)
+        self._clear()
+        totals = transfer.import_acls(StringIO(out.getvalue()), dry_run=True)
+        assert_equal(totals['inserted'], 3)
+        assert_equal(self._acls(), [])
+
+    def test_import_validates_as_create(self):
+        lines = [{
+            'resource_id': self.resource['id'],
+            'auth_type': 'anonymous',
+            'auth_id': u'someone',
+            'permission': 'read'
+        }, {
+            'package_id': self.dataset['id'],
+            'auth_type': 'user',
+            'auth_id': self.user['id'],
+            'permission': 'read',
+            'valid_from': '2030-01-01T00:00:00',
+            'valid_until': '2020-01-01T00:00:00'
+        }]
+        input = StringIO('\n'.join(json.dumps(line) for line in lines))
+        totals = transfer.import_acls(input)
+        assert_equal((totals['inserted'], totals['updated'],
+                      totals['skipped']), (0, 1, 1))
+        anonymous = [acl for acl in self._acls()
+                     if acl.auth_type == 'anonymous']
+        assert_equal([(acl.auth_id, acl.permission) for acl in anonymous],
+                     [(u'*', 'read')])
@@ -0,0 +1,13 @@
+"""Tests for util.py."""
+from nose.tools import assert_equal, assert_is_none
+
+from ckanext.resourceauthorizer.util import chunks, request_store
+
+
+def test_chunks():
+    assert_equal(list(chunks(range(5), 2)), [[0, 1], [2, 3], [4]])
+    assert_equal(list(chunks(set())), [])
+
+
+def test_request_store_outside_of_requests():
+    assert_is_none(request_store('key'))
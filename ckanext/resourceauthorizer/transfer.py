@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import datetime
+import json
+import time
+
+import ckan.model as model
+from ckan.lib.navl.dictization_functions import validate
+from ckan.lib.navl.validators import ignore_missing
+from ckan.plugins.toolkit import Invalid
+
+from ckanext.resourceauthorizer.changes import commit_acl_changes
+from ckanext.resourceauthorizer.logic.schema import resource_acl_create_schema
+from ckanext.resourceauthorizer.model import resource_acl_table
+from ckanext.resourceauthorizer.model import upsert_acls
+
+FORMATS = ['jsonl', 'csv']
+# the permission rank is derived from the permission
+COLUMNS = [
+    c for c in resource_acl_table.columns if c.name != 'permission_rank'
+]
+FIELDS = [c.name for c in COLUMNS]
+DATE_FIELDS = ['created', 'last_modified', 'valid_from', 'valid_until']
+
+
+def _serialize(row):
+    return dict((key, value.isoformat()
+                 if isinstance(value, datetime.datetime) else value)
+                for key, value in zip(FIELDS, row))
+
+
+def _parse_date(value):
+    for date_format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise Invalid('Invalid date %s' % value)
+
+
+def export_acls(out, fmt='jsonl', chunk_size=1000, progress=None):
+    '''Write every resource acl to the file, reading them through a
+    server-side cursor so that memory stays bounded.
+
+    Returns the number of exported acls.
+    '''
+    query = model.Session.query(*COLUMNS).order_by(
+        resource_acl_table.c.created,
+        resource_acl_table.c.id).execution_options(
+            stream_results=True).yield_per(chunk_size)
+
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(FIELDS)
+
+    count = 0
+    for row in query:
+        acl = _serialize(row)
+        if fmt == 'csv':
+            writer.writerow([(acl[f] or u'').encode('utf-8') for f in FIELDS])
+        else:
+            out.write(json.dumps(acl) + '\n')
+        count += 1
+        if progress and count % chunk_size == 0:
+            progress(count, {'exported': count})
+    if progress:
+        progress(count, {'exported': count})
+    return count
+
+
+def _read_rows(input, fmt):
+    if fmt == 'csv':
+        for row in csv.DictReader(input):
+            yield dict((k, v.decode('utf-8') if v else None)
+                       for k, v in row.items())
+    else:
+        for line in input:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+
+
+def _import_schema():
+    '''The schema of resource_acl_create, except that the resources and
+    datasets are looked up a chunk at a time.
+    '''
+    schema = resource_acl_create_schema()
+    schema['resource_id'] = [ignore_missing, unicode]
+    schema['package_id'] = [ignore_missing, unicode]
+    return schema
+
+
+def _clean_row(row):
+    if not isinstance(row, dict):
+        raise Invalid('Invalid row')
+    acl = {}
+    for field in FIELDS:
+        value = row.get(field)
+        if value in (None, u''):
+            continue
+        if field in DATE_FIELDS:
+            value = _parse_date(value)
+        acl[field] = value
+    if acl.get('resource_id'):
+        acl.pop('package_id', None)
+    # the acls given to a role get the auth_id '*', as in resource_acl_create,
+    # so that they update the existing acl of the role
+    data, errors = validate(acl, _import_schema(), {
+        'model': model,
+        'session': model.Session
+    })
+    if errors:
+        raise Invalid(errors)
+    acl.update((field, data[field])
+               for field in ('auth_type', 'auth_id', 'permission'))
+    return acl
+
+
+def _import_chunk(rows, user):
+    resource_ids = set(r.get('resource_id') for r in rows) - set([None])
+    package_ids = set(r.get('package_id') for r in rows) - set([None])
+    existing = set(row[0] for row in model.Session.query(
+        model.Resource.id).filter(model.Resource.id.in_(resource_ids)))
+    existing.update(row[0] for row in model.Session.query(
+        model.Package.id).filter(model.Package.id.in_(package_ids)))
+    valid = [
+        r for r in rows
+        if (r.get('resource_id') or r.get('package_id')) in existing
+    ]
+    inserted, updated = upsert_acls(valid, user)
+    return inserted, updated, len(valid) - inserted - updated, len(
+        rows) - len(valid)
+
+
+def import_acls(input, fmt='jsonl', chunk_size=1000, dry_run=False,
+                user=u'', progress=None):
+    '''Upsert the resource acls read from the file, on
+    (resource_id, auth_type, auth_id), or (package_id, auth_type, auth_id)
+    for the acls of datasets, one chunk and transaction at a time.
+
+    Rows are validated as by resource_acl_create, and the rows that are
+    invalid or refer to a missing resource or dataset are skipped. With
+    dry_run, every chunk is rolled back instead of committed.
+
+    Returns the number of read, inserted, updated, unchanged and skipped
+    acls.
+    '''
+    totals = {
+        'read': 0,
+        'inserted': 0,
+        'updated': 0,
+        'unchanged': 0,
+        'skipped': 0
+    }
+
+    def flush(chunk):
+        inserted, updated, unchanged, skipped = _import_chunk(chunk, user)
+        if dry_run:
+            model.Session.rollback()
+        else:
+            commit_acl_changes([r.get('resource_id') for r in chunk],
+                               package_ids=[r.get('package_id')
+                                            for r in chunk])
+        totals['inserted'] += inserted
+        totals['updated'] += updated
+        totals['unchanged'] += unchanged
+        totals['skipped'] += skipped
+        if progress:
+            progress(totals['read'], totals)
+
+    chunk = []
+    for row in _read_rows(input, fmt):
+        totals['read'] += 1
+        try:
+            chunk.append(_clean_row(row))
+        except Invalid:
+            totals['skipped'] += 1
+            continue
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    return totals
+
+
+class ProgressReport(object):
+    '''Prints the progress and the throughput of an import or export.'''
+
+    def __init__(self, out):
+        self.out = out
+        self.start = time.time()
+
+    def __call__(self, processed, totals):
+        elapsed = max(time.time() - self.start, 1e-6)
+        self.out.write('%s, %.0f rows/s\n' % (', '.join(
+            '%d %s' % (totals[key], key)
+            for key in sorted(totals)), processed / elapsed))
+        self.out.flush()
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+
+def chunks(items, size=1000):
+    '''Yield the items in lists of at most size of them, e.g. to keep the
+    IN clauses of the statements short.
+    '''
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def request_store(key, factory=dict):
+    '''Return the value kept under the key in the environ of the current
+    web request, made by calling factory the first time, or None outside
+    of a web request, e.g. in paster commands or background jobs.
+    '''
+    try:
+        from ckan.common import request
+        environ = request.environ
+    except (TypeError, AttributeError, RuntimeError):
+        return None
+    if environ is None:
+        return None
+    if key not in environ:
+        environ[key] = factory()
+    return environ[key]